@@ -442,6 +442,38 @@ class Analyzer:
 
         return resampled_df
 
+    def resample_columns(self, data, columns=["Brake", "SpeedMs"], method="nearest", freq=1):
+        """Like resample, for a mapping of column names to numpy arrays, returns the resampled arrays."""
+        distance = data["DistanceRoundTrack"]
+        valid = ~np.isnan(distance)
+        if not valid.any():
+            return {name: values[valid] for name, values in data.items()}
+        distance = distance[valid]
+
+        min_distance = int(np.ceil(distance.min()))
+        max_distance = int(np.floor(distance.max()))
+        target_rows = int(max_distance / freq)
+
+        new_distance_round_track = np.linspace(min_distance, max_distance, target_rows)
+
+        new_distance_round_track = np.round(new_distance_round_track, decimals=2)
+        new_distance_round_track[0] = max(new_distance_round_track[0], min_distance)
+        new_distance_round_track[-1] = min(new_distance_round_track[-1], max_distance)
+
+        resampled = {"DistanceRoundTrack": new_distance_round_track}
+
+        for column in columns:
+            values = data[column][valid]
+            interp = interp1d(distance, values, kind=method, bounds_error=False, fill_value="extrapolate")
+            interpolated_values = interp(new_distance_round_track)
+
+            if np.issubdtype(values.dtype, np.integer):
+                interpolated_values = np.round(interpolated_values).astype(int)
+
+            resampled[column] = interpolated_values
+
+        return resampled
+
     def value_at_distance(self, df, meters, column="SpeedMs"):
         value = df.iloc[(df["DistanceRoundTrack"] - meters).abs().idxmin()][column]
         return value
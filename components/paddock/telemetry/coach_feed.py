@@ -0,0 +1,90 @@
+import json
+import logging
+import select
+import threading
+import time
+
+from django.db import connection, transaction
+
+CHANNEL = "coach_changes"
+
+
+class CoachFeed:
+    """Change feed of Coach.enabled and Coach.mode.
+
+    A post_save receiver publishes every change once the transaction commits.
+    On PostgreSQL the changes are sent with NOTIFY, so the pitcrew learns about
+    coaches enabled on the website. The listener thread of a process LISTENs on
+    a connection of its own and passes the changes to the subscribers. Other
+    databases, i.e. SQLite in development and tests, pass the changes to the
+    subscribers of the same process.
+
+    A change is a dict with driver_id, driver, enabled and mode.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, callback):
+        with self._lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def publish(self, change):
+        if connection.vendor == "postgresql":
+            # NOTIFY is only delivered when the transaction commits
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, json.dumps(change)])
+        else:
+            transaction.on_commit(lambda: self.deliver(change))
+
+    def deliver(self, change):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(change)
+            except Exception as e:
+                logging.exception(f"Error delivering coach change {change}: {e}")
+
+    def listen(self):
+        """Start the listener thread, only needed on PostgreSQL."""
+        if connection.vendor != "postgresql" or self._listener:
+            return
+        self._listener = threading.Thread(target=self.run_listener, daemon=True)
+        self._listener.name = "coach_feed"
+        self._listener.start()
+
+    def run_listener(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        while True:
+            try:
+                # a connection of its own, django's connections are not shared between threads
+                listen_connection = psycopg2.connect(**connection.get_connection_params())
+                listen_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with listen_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                logging.info(f"Listening for coach changes on {CHANNEL}")
+                # the missed changes are picked up by the resync of the coach watcher
+                self.deliver({"resync": True})
+                while True:
+                    if select.select([listen_connection], [], [], 60) == ([], [], []):
+                        continue
+                    listen_connection.poll()
+                    while listen_connection.notifies:
+                        notify = listen_connection.notifies.pop(0)
+                        self.deliver(json.loads(notify.payload))
+            except Exception as e:
+                logging.error(f"Coach change listener failed, reconnecting: {e}")
+                time.sleep(5)
+
+
+coach_feed = CoachFeed()
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+
+from telemetry.models import Car, CarClass, Driver, Game, SessionType, Track
+
+
+class DimensionCache:
+    """Process wide cache of the rows the telemetry is filed under.
+
+    Drivers, games, cars, car classes, tracks and session types are looked up
+    by their natural key, the game name plus the name for rows that belong to
+    a game. The rows almost never change: saving or deleting one in this
+    process drops it from the cache, changes made by other processes are
+    picked up after ttl seconds. The least recently used rows are evicted
+    once max_size is reached.
+
+    Rows looked up inside a transaction are only cached once it commits, a
+    rollback must not leave rows in the cache that don't exist.
+    """
+
+    def __init__(self, max_size=10000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        # (model name, natural key) -> (row, expiry)
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def driver(self, name, create=False):
+        return self._get(Driver, (name,), Driver.objects, {"name": name}, create)
+
+    def game(self, name, create=False):
+        return self._get(Game, (name,), Game.objects, {"name": name}, create)
+
+    def session_type(self, type, create=False):
+        return self._get(SessionType, (type,), SessionType.objects, {"type": type}, create)
+
+    def car(self, game, name, create=False):
+        return self._get(Car, (game.name, name), game.cars, {"name": name}, create)
+
+    def car_class(self, game, name, create=False):
+        return self._get(CarClass, (game.name, name), game.car_classes, {"name": name}, create)
+
+    def track(self, game, name, create=False):
+        return self._get(Track, (game.name, name), game.tracks, {"name": name}, create)
+
+    def _get(self, model, natural_key, manager, lookup, create):
+        key = (model.__name__, natural_key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._rows.get(key)
+            if cached and cached[1] > now:
+                self._rows.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        if create:
+            row, created = manager.get_or_create(**lookup)
+        else:
+            # raises DoesNotExist like the lookup without cache
+            row = manager.get(**lookup)
+
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self._put(key, row))
+        else:
+            self._put(key, row)
+        return row
+
+    def _put(self, key, row):
+        with self._lock:
+            self._rows[key] = (row, time.monotonic() + self.ttl)
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def invalidate(self, model, pk):
+        with self._lock:
+            for key, (row, expiry) in list(self._rows.items()):
+                if isinstance(row, model) and row.pk == pk:
+                    del self._rows[key]
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def warm_up(self):
+        """Load the rows every session needs, drivers are left to the first lookup."""
+        count = 0
+        # the least recently used rows are evicted first, load the few games and session types last
+        for model in [Car, CarClass, Track]:
+            for row in model.objects.select_related("game").order_by("-modified")[: self.max_size]:
+                self._put((model.__name__, (row.game.name, row.name)), row)
+                count += 1
+        for session_type in SessionType.objects.all():
+            self._put(("SessionType", (session_type.type,)), session_type)
+            count += 1
+        for game in Game.objects.all():
+            self._put(("Game", (game.name,)), game)
+            count += 1
+        logging.info(f"DimensionCache: warmed up with {count} rows")
+
+    def metrics(self):
+        return {
+            "pitcrew_dimensions_hits_total": self.hits,
+            "pitcrew_dimensions_misses_total": self.misses,
+            "pitcrew_dimensions_rows": len(self._rows),
+        }
+
+
+dimensions = DimensionCache()
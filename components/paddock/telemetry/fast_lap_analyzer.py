@@ -7,6 +7,7 @@ from .analyzer import Analyzer
 from .influx import Influx
 from .models import FastLap
 from .pitcrew.segment import Segment
+from .pitcrew.telemetry_buffer import TelemetryFrame
 
 
 class FastLapAnalyzer:
@@ -278,3 +279,9 @@ class FastLapAnalyzer:
             columns=self.columns,
         )
         return df
+
+    def preprocess_frame(self, frame):
+        """Like preprocess, for the TelemetryFrame of a live segment."""
+        keep = frame["Gear"] != 0
+        data = {name: frame[name][keep] for name in ["DistanceRoundTrack", *self.columns]}
+        return TelemetryFrame(self.analyzer.resample_columns(data, freq=1, columns=self.columns))
@@ -0,0 +1,87 @@
+import json
+import os
+import re
+
+import django.utils.timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from telemetry.pitcrew.benchmark import (
+    THROUGHPUT_TARGETS,
+    decode_benchmark,
+    features_benchmark,
+    memory_benchmark,
+    saver_benchmark,
+    throughput_benchmark,
+)
+
+
+def version():
+    with open(os.path.join(settings.BASE_DIR, "pyproject.toml")) as f:
+        match = re.search(r'^version = "(.+)"$', f.read(), re.MULTILINE)
+    return match.group(1) if match else "unknown"
+
+
+class Command(BaseCommand):
+    help = "benchmark pitcrew components"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "benchmark", choices=["memory", "decode", "features", "throughput", "saver"], help="what to benchmark"
+        )
+        parser.add_argument("--sessions", type=int, default=1000, help="number of sessions")
+        parser.add_argument("--laps", type=int, default=10, help="number of laps per session")
+        parser.add_argument("--session-id", nargs="+", default=None, help="recorded sessions to replay")
+        parser.add_argument("--limit", type=int, default=None, help="number of recorded messages per session")
+        parser.add_argument(
+            "--target",
+            nargs="+",
+            choices=list(THROUGHPUT_TARGETS.keys()),
+            default=["firehose"],
+            help="components to drive with telemetry",
+        )
+        parser.add_argument("--drivers", type=int, default=10, help="number of virtual drivers")
+        parser.add_argument("--output", default=None, help="append the results as json lines to this file")
+
+    def handle(self, *args, **options):
+        kwargs = {}
+        if options["limit"]:
+            kwargs["limit"] = options["limit"]
+
+        if options["benchmark"] == "memory":
+            runs = [memory_benchmark(sessions=options["sessions"], laps=options["laps"])]
+        elif options["benchmark"] == "saver":
+            runs = [saver_benchmark(sessions=options["sessions"], laps=options["laps"])]
+        elif options["benchmark"] == "decode":
+            if options["session_id"]:
+                kwargs["session_id"] = options["session_id"][0]
+            runs = [decode_benchmark(**kwargs)]
+        elif options["benchmark"] == "features":
+            if options["session_id"]:
+                kwargs["session_id"] = options["session_id"][0]
+            runs = [features_benchmark(**kwargs)]
+        elif options["benchmark"] == "throughput":
+            runs = []
+            for target in options["target"]:
+                results = throughput_benchmark(
+                    target=target, drivers=options["drivers"], session_ids=options["session_id"], **kwargs
+                )
+                runs.append(results)
+
+        for results in runs:
+            for key, value in results.items():
+                if isinstance(value, float):
+                    value = f"{value:.1f}"
+                self.stdout.write(f"{key}: {value}")
+            self.stdout.write("")
+
+        if options["output"]:
+            with open(options["output"], "a") as f:
+                for results in runs:
+                    record = {
+                        "benchmark": options["benchmark"],
+                        "version": version(),
+                        "timestamp": django.utils.timezone.now().isoformat(),
+                        **results,
+                    }
+                    f.write(json.dumps(record) + "\n")
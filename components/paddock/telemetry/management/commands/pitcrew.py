@@ -1,11 +1,14 @@
 import threading
 
-from django.core.management.base import BaseCommand
-from flask import Flask
+from django.core.management.base import BaseCommand, CommandError
+from flask import Flask, make_response
 from flask_healthz import healthz
 
-from telemetry.models import Coach, Driver, FastLap
+from telemetry.models import Coach, Driver, FastLap, LiveFeatures
+from telemetry.pitcrew.async_crew import AsyncCrew
 from telemetry.pitcrew.crew import Crew
+from telemetry.pitcrew.ingest import Ingest
+from telemetry.pitcrew.metrics import generate_metrics
 
 
 class Command(BaseCommand):
@@ -17,18 +20,111 @@ class Command(BaseCommand):
         parser.add_argument("-s", "--session-saver", action="store_true")
         parser.add_argument("-n", "--no-save", action="store_true")
         parser.add_argument("-d", "--delete-driver-fastlaps", action="store_true")
+        parser.add_argument(
+            "--ingest-queue-size",
+            type=int,
+            default=600,
+            help="max number of queued messages per topic",
+        )
+        parser.add_argument(
+            "--drop-policy",
+            choices=Ingest.DROP_POLICIES,
+            default=Ingest.DROP_OLDEST,
+            help="what to drop if a topic queue is full",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=1,
+            help="number of firehose worker processes",
+        )
+        parser.add_argument(
+            "--session-ttl",
+            type=int,
+            default=600,
+            help="seconds without telemetry after which a session is deleted",
+        )
+        parser.add_argument(
+            "--max-sessions",
+            type=int,
+            default=1000,
+            help="max number of live sessions",
+        )
+        parser.add_argument(
+            "--spool",
+            type=str,
+            default=None,
+            help="sqlite file to spool finished laps to before they are saved to the database",
+        )
+        parser.add_argument(
+            "--coach-workers",
+            type=int,
+            default=4,
+            help="number of threads doing the work of the coaches, --asyncio uses the --db-workers",
+        )
+        parser.add_argument(
+            "--coach-processes",
+            type=int,
+            default=0,
+            help="number of worker processes running the coaches, 0 runs them in the crew process",
+        )
+        parser.add_argument(
+            "--asyncio",
+            action="store_true",
+            help="run the crew on an asyncio event loop instead of a thread per component",
+        )
+        parser.add_argument(
+            "--db-workers",
+            type=int,
+            default=4,
+            help="number of database worker threads of the asyncio runtime",
+        )
 
     def handle(self, *args, **options):
         if options["delete_driver_fastlaps"]:
             # get all fastlaps where driver is not empty
             FastLap.objects.filter(driver__isnull=False).delete()
+            LiveFeatures.objects.all().delete()
             return
 
-        crew = Crew(save=(not options["no_save"]), replay=options["replay"])
+        kwargs = {}
+        crew_class = Crew
+        if options["asyncio"] and not (options["coach"] or options["session_saver"]):
+            # the History of every coach runs as a task on the database executor
+            if options["coach_processes"] > 0:
+                raise CommandError("--asyncio can't run the coaches in --coach-processes")
+            if options["shards"] > 1:
+                raise CommandError("--asyncio can't run the firehose in --shards")
+            crew_class = AsyncCrew
+            kwargs["db_workers"] = options["db_workers"]
+
+        crew = crew_class(
+            save=(not options["no_save"]),
+            replay=options["replay"],
+            ingest_queue_size=options["ingest_queue_size"],
+            drop_policy=options["drop_policy"],
+            shards=options["shards"],
+            session_ttl=options["session_ttl"],
+            max_sessions=options["max_sessions"],
+            spool=options["spool"],
+            coach_workers=options["coach_workers"],
+            coach_processes=options["coach_processes"],
+            **kwargs,
+        )
+        # fork the worker processes before any thread is started, a forked thread could hold a lock
+        crew.start_processes()
         if options["coach"]:
             driver, created = Driver.objects.get_or_create(name=options["coach"])
             coach, created = Coach.objects.get_or_create(driver=driver)
             crew.coach_watcher.start_coach(driver.name, coach, debug=True)
+            # the coach gets its telemetry through the crew's MQTT client
+            crew.mqtt.topic = f"crewchief/{driver.name}/#"
+            for name in ["mqtt", "ingest", "publisher", "coach_scheduler", "coach_pool"]:
+                if name not in crew.components:
+                    continue
+                t = threading.Thread(target=crew.components[name].run)
+                t.name = name
+                t.start()
         elif options["session_saver"]:
             t = threading.Thread(target=crew.firehose.run)
             t.name = "firehose"
@@ -36,6 +132,10 @@ class Command(BaseCommand):
             t = threading.Thread(target=crew.session_saver.run)
             t.name = "session_saver"
             t.start()
+            if crew.spool_drainer:
+                t = threading.Thread(target=crew.spool_drainer.run)
+                t.name = "spool_drainer"
+                t.start()
         else:
             if not crew.replay and not options["no_save"]:
 
@@ -43,6 +143,13 @@ class Command(BaseCommand):
                     app = Flask(__name__)
                     app.register_blueprint(healthz, url_prefix="/healthz")
                     app.config["HEALTHZ"] = {"live": crew.live, "ready": crew.ready}
+
+                    @app.route("/metrics")
+                    def metrics():
+                        response = make_response(generate_metrics(crew.metrics()), 200)
+                        response.mimetype = "text/plain"
+                        return response
+
                     app.run(host="0.0.0.0", port=8080, debug=False, use_reloader=False)
 
                 flask_thread = threading.Thread(target=start_flask)
@@ -6,7 +6,8 @@ import threading
 import time
 
 import paho.mqtt.client as mqtt
-from django.core.management.base import BaseCommand
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from rich.console import Console
 from rich.progress import Progress, TextColumn
@@ -77,6 +78,11 @@ class Command(BaseCommand):
         parser.add_argument("--delta", type=str, default=None)
         parser.add_argument("--quiet", action="store_true")
         parser.add_argument("--keep-session-id", action="store_true")
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help="detect the laps of whole sessions at once, needs --firehose and --session-ids",
+        )
 
     def handle(self, *args, **options):
         influx = Influx()
@@ -112,7 +118,12 @@ class Command(BaseCommand):
             logging.debug(f"connected to {B4MAD_RACING_MQTT_HOST}:{B4MAD_RACING_MQTT_PORT}")
             self.observer = self.mqtt_notify
 
-        if options["session_ids"]:
+        if options["batch"]:
+            if not options["firehose"] or not options["session_ids"]:
+                raise CommandError("--batch needs --firehose and --session-ids")
+            for session_id in options["session_ids"]:
+                self.replay_batch(influx, session_id, options)
+        elif options["session_ids"]:
             for session_id in options["session_ids"]:
                 session = influx.session(
                     session_id=session_id,
@@ -154,14 +165,49 @@ class Command(BaseCommand):
             msg = f"[green] Replaying from start {options['start']} to end {options['end']}"
             self.progress.console.print(msg)
 
-        with self.progress:
-            self.replay(session, wait=options["wait"], new_session_id=new_session_id)
+        if not options["batch"]:
+            with self.progress:
+                self.replay(session, wait=options["wait"], new_session_id=new_session_id)
 
         if self.session_save_thread:
             self.session_saver.stop()
             self.session_save_thread.join()
             self.session_saver.save_sessions()
 
+    def replay_batch(self, influx, session_id, options):
+        kwargs = {}
+        if options["start"]:
+            kwargs["start"] = options["start"]
+        if options["end"]:
+            kwargs["end"] = options["end"]
+        df = influx.session_df(
+            session_id,
+            measurement=options["measurement"],
+            bucket=options["bucket"],
+            **kwargs,
+        )
+        if df.empty:
+            logging.error(f"no telemetry found for session {session_id}")
+            self.progress.console.print(f"[red] No telemetry found for session {session_id}")
+            return
+        # CurrentLap is a tag and comes back as a string
+        df["CurrentLap"] = pd.to_numeric(df["CurrentLap"])
+
+        prefix, driver, _session_id, game, track, car, session_type = df["topic"].iloc[0].split("/")
+        if self.keep_session_id:
+            new_session_id = session_id
+        else:
+            new_session_id = options["new_session_id"] or int(time.time())
+        if self.change_driver:
+            driver = self.change_driver
+        topic = f"{prefix}/{driver}/{new_session_id}/{game}/{track}/{car}/{session_type}"
+
+        self.firehose.add_session_df(topic, df)
+        session = self.firehose.sessions.get(topic)
+        laps = len(session.laps) if session else 0
+        self.progress.console.print(f"[green] Detected {laps} laps in {len(df)} rows of session {session_id}")
+        self.progress.console.print(f"[bold blue] {topic}")
+
     def firehose_notify(self, topic, payload):
         now = timezone.make_aware(datetime.datetime.fromtimestamp(payload["time"] / 1000))
 
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.17 on 2026-10-18 21:38
+
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+import picklefield.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telemetry", "0025_alter_coach_mode"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LiveFeatures",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now, editable=False, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now, editable=False, verbose_name="modified"
+                    ),
+                ),
+                ("session_id", models.CharField(max_length=200)),
+                ("turn", models.IntegerField()),
+                ("lap", models.IntegerField(default=-1)),
+                ("features", picklefield.fields.PickledObjectField(editable=False, null=True)),
+                (
+                    "car",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="live_features", to="telemetry.car"
+                    ),
+                ),
+                (
+                    "driver",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="live_features", to="telemetry.driver"
+                    ),
+                ),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="live_features", to="telemetry.game"
+                    ),
+                ),
+                (
+                    "track",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="live_features", to="telemetry.track"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["driver", "game", "car", "track", "turn"], name="telemetry_l_driver__2dc950_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -181,6 +181,28 @@ class FastLapSegment(TimeStampedModel):
         return repr
 
 
+class LiveFeatures(TimeStampedModel):
+    """The features of one lap of a driver through a segment, rows are only ever added."""
+
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name="live_features")
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name="live_features")
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="live_features")
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name="live_features")
+    session_id = models.CharField(max_length=200)
+    turn = models.IntegerField()
+    lap = models.IntegerField(default=-1)
+    # the brake, throttle, gear and other features of the segment
+    features = PickledObjectField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["driver", "game", "car", "track", "turn"]),
+        ]
+
+    def __str__(self):
+        return f"{self.driver} {self.track} turn {self.turn} lap {self.lap}"
+
+
 class Coach(ExportModelOperationsMixin("coach"), TimeStampedModel):
     driver = models.OneToOneField(
         Driver,
@@ -123,7 +123,7 @@ class Application(LoggingMixin):
         return response
 
     def race_pace_speed_at(self, distance):
-        return self.history.map_distance_speed.get(distance, 0)
+        return self.history.lookup_table.speed_at(distance, 0)
 
     def calculate_avg_speed(self):
         race_pace_speed = self.race_pace_speed_at(self.distance)
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+from .coach_watcher import CoachWatcher
+from .crew import Crew
+from .mqtt import B4MAD_RACING_MQTT_HOST, B4MAD_RACING_MQTT_PORT
+
+
+def event_wakeup(loop, event):
+    """A wakeup callback that sets an asyncio event from any thread."""
+
+    def wakeup():
+        # skip the round trip through the loop if the event is already set
+        if not event.is_set():
+            loop.call_soon_threadsafe(event.set)
+
+    return wakeup
+
+
+async def wait_event(event, timeout):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+class AsyncioMqttHelper:
+    """Drive a paho client from the asyncio event loop instead of loop_forever().
+
+    The socket of the client is watched by the loop, paho only reads or writes when
+    there is something to read or write. Publishing from other threads is fine, the
+    loop is told to watch the socket for writing.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        self.disconnected = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        client.on_disconnect = self.on_disconnect
+
+    def call(self, callback, *args):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        # the client connects in an executor thread
+        self.call(self.watch, client, sock)
+
+    def watch(self, client, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call(self.loop.remove_reader, sock)
+        self.call(self.loop.remove_writer, sock)
+        if self.misc:
+            self.call(self.misc.cancel)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call(self.loop.remove_writer, sock)
+
+    def on_disconnect(self, client, userdata, rc):
+        logging.info(f"MQTT disconnected rc: {rc}")
+        if self.disconnected:
+            self.call(self.disconnected.set)
+
+    async def misc_loop(self):
+        # keepalive pings and retries
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+class AsyncCoachWatcher(CoachWatcher):
+    """Run the History of every coach as a task instead of a thread.
+
+    The task sleeps until the History has work to do, the work itself runs in the
+    database executor.
+    """
+
+    def __init__(self, firehose, fanout, scheduler=None, pool=None):
+        if scheduler or pool:
+            raise ValueError("the History tasks of the asyncio runtime don't run on a coach scheduler or pool")
+        super().__init__(firehose, fanout)
+        self.loop = None
+        self.executor = None
+
+    def start_history(self, driver_name, history):
+        event = asyncio.Event()
+        history.wakeup_callback = event_wakeup(self.loop, event)
+        # the coach must not do the work of the History itself
+        history.threaded = True
+        return asyncio.run_coroutine_threadsafe(self.run_history(driver_name, history, event), self.loop)
+
+    async def run_history(self, driver_name, history, event):
+        logging.info(f"History task starting for {driver_name}")
+        # pick up the work queued before the task started
+        event.set()
+        while history.do_run:
+            await event.wait()
+            event.clear()
+            await self.loop.run_in_executor(self.executor, history.step)
+        logging.info(f"History task stopped for {driver_name}")
+
+    def is_alive(self, worker):
+        return not worker.done()
+
+
+class AsyncCrew(Crew):
+    """Run the pitcrew on an asyncio event loop instead of a thread per component.
+
+    The MQTT client is driven by the loop, the ingest queue is drained in a single
+    worker thread to keep the order of messages. Everything touching the database
+    (session saver, coach watcher, History work) runs in a bounded executor.
+    Components are woken up by events, the only timers left are the intervals of
+    the session saver and the coach watcher.
+    """
+
+    coach_watcher_class = AsyncCoachWatcher
+    # History instances run as tasks
+    coach_scheduler_class = None
+
+    def __init__(self, *args, db_workers=4, **kwargs):
+        if kwargs.get("shards", 1) > 1:
+            raise ValueError("the asyncio runtime doesn't support firehose shards")
+        if kwargs.get("coach_processes", 0) > 0:
+            raise ValueError("the asyncio runtime doesn't support coach processes")
+        super().__init__(*args, **kwargs)
+        self.db_workers = db_workers
+        self.loop = None
+        self._async_stop = None
+
+    def stop(self):
+        super().stop()
+        if self.loop and self._async_stop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._async_stop.set)
+
+    def run(self):
+        logging.info(f"starting Crew with pid {os.getpid()} on asyncio")
+        asyncio.run(self.main())
+        logging.debug("all tasks done... bye")
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self._async_stop = asyncio.Event()
+        if self.stopped():
+            self._async_stop.set()
+        if threading.current_thread() is threading.main_thread():
+            self.loop.add_signal_handler(signal.SIGTERM, self._handle_sigterm, signal.SIGTERM, None)
+
+        db_executor = ThreadPoolExecutor(max_workers=self.db_workers, thread_name_prefix="db")
+        # a single worker keeps the messages of a topic in order
+        ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self.coach_watcher.loop = self.loop
+        self.coach_watcher.executor = db_executor
+        await self.loop.run_in_executor(db_executor, self.warm_up)
+
+        coroutines = {
+            "mqtt": self.run_mqtt(),
+            "ingest": self.run_ingest(ingest_executor),
+            "publisher": self.run_publisher(),
+            "coach_watcher": self.run_coach_watcher(db_executor),
+        }
+        if self.session_saver:
+            coroutines["session_saver"] = self.run_session_saver(db_executor)
+        if self.spool_drainer:
+            coroutines["spool_drainer"] = self.run_spool_drainer(db_executor)
+        tasks = [asyncio.create_task(coroutine, name=name) for name, coroutine in coroutines.items()]
+        stop_task = asyncio.create_task(self._async_stop.wait())
+
+        try:
+            while not self.stopped():
+                done, pending = await asyncio.wait([stop_task, *tasks], timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not stop_task:
+                        logging.error(f"Task {task.get_name()} died: {task.exception()}")
+                        self.stop()
+
+                if not self._ready and all(component.ready for component in self.components.values()):
+                    logging.debug("..tasks are ready")
+                    self._ready = True
+                    self._live = True
+        finally:
+            self.stop()
+            done, pending = await asyncio.wait(tasks, timeout=60)
+            for task in pending:
+                logging.error(f"Task {task.get_name()} didn't stop")
+                task.cancel()
+            ingest_executor.shutdown()
+            db_executor.shutdown()
+
+    async def run_mqtt(self):
+        client = self.mqtt.mqttc
+        helper = AsyncioMqttHelper(self.loop, client)
+        topic = self.mqtt.topic
+        if self.replay:
+            topic = f"replay/{topic}"
+
+        try:
+            while not self.stopped():
+                helper.disconnected = asyncio.Event()
+                try:
+                    # resolving and connecting blocks, keep it off the event loop
+                    await self.loop.run_in_executor(
+                        None, client.connect, B4MAD_RACING_MQTT_HOST, B4MAD_RACING_MQTT_PORT, 60
+                    )
+                except OSError as e:
+                    logging.error(f"Failed to connect to MQTT: {e}")
+                    await wait_event(self._async_stop, 5)
+                    continue
+
+                s = client.subscribe(topic, 0)
+                if s[0] != mqtt.MQTT_ERR_SUCCESS:
+                    raise RuntimeError(f"Failed to subscribe to {topic}")
+                logging.info(f"Subscribed to {topic}")
+
+                stop_task = asyncio.create_task(self._async_stop.wait())
+                disconnected_task = asyncio.create_task(helper.disconnected.wait())
+                await asyncio.wait([stop_task, disconnected_task], return_when=asyncio.FIRST_COMPLETED)
+                stop_task.cancel()
+                disconnected_task.cancel()
+                self.mqtt.ready = False
+        finally:
+            client.disconnect()
+            logging.info("MQTT stopped")
+
+    async def run_ingest(self, executor):
+        event = asyncio.Event()
+        self.ingest.wakeup_callback = event_wakeup(self.loop, event)
+        self.ingest.ready = True
+        next_stats = time.monotonic() + self.ingest.stats_interval
+        while not self.stopped():
+            await wait_event(event, 1)
+            event.clear()
+            await self.loop.run_in_executor(executor, self.ingest.drain)
+
+            if time.monotonic() > next_stats:
+                self.ingest.log_stats()
+                next_stats = time.monotonic() + self.ingest.stats_interval
+
+        # process whatever was received before we got stopped
+        await self.loop.run_in_executor(executor, self.ingest.drain)
+
+    async def run_publisher(self):
+        event = asyncio.Event()
+        self.publisher.wakeup_callback = event_wakeup(self.loop, event)
+        self.publisher.ready = True
+        while not self.stopped():
+            await wait_event(event, 1)
+            event.clear()
+            if self.publisher.linger:
+                # collect the responses of this tick
+                await asyncio.sleep(self.publisher.linger)
+            self.publisher.flush()
+
+        self.publisher.flush()
+
+    async def run_session_saver(self, executor):
+        event = asyncio.Event()
+        self.session_saver.wakeup_callback = event_wakeup(self.loop, event)
+        next_sweep = time.monotonic()
+        while not self.stopped():
+            if time.monotonic() >= next_sweep:
+                await self.loop.run_in_executor(executor, self.session_saver.save_and_clear_sessions)
+                self.session_saver.ready = True
+                next_sweep = time.monotonic() + self.session_saver.sleep_time
+
+            await wait_event(event, min(max(next_sweep - time.monotonic(), 0), 1))
+            event.clear()
+            await self.loop.run_in_executor(executor, self.session_saver.process_events)
+
+    async def run_spool_drainer(self, executor):
+        self.spool_drainer.ready = True
+        while not self.stopped():
+            try:
+                wait = await self.loop.run_in_executor(executor, self.spool_drainer.drain)
+            except Exception as e:
+                logging.exception(f"Error draining the spool: {e}")
+                wait = self.spool_drainer.max_backoff
+            await wait_event(self._async_stop, wait)
+
+    async def run_coach_watcher(self, executor):
+        event = asyncio.Event()
+        self.coach_watcher.wakeup_callback = event_wakeup(self.loop, event)
+        self.coach_watcher.listen()
+        try:
+            while not self.stopped():
+                await self.loop.run_in_executor(executor, self.coach_watcher.watch_once)
+                self.coach_watcher.ready = True
+                await wait_event(event, min(self.coach_watcher.sleep_time, 1))
+                event.clear()
+        finally:
+            await self.loop.run_in_executor(executor, self.coach_watcher.stop_coaches)
+            logging.info("CoachWatcher stopped")
@@ -0,0 +1,432 @@
+import datetime
+import gc
+import json
+import logging
+import os
+import resource
+import time
+import tracemalloc
+
+import django.utils.timezone
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from telemetry.analyzer import Analyzer
+from telemetry.fast_lap_analyzer import FastLapAnalyzer
+from telemetry.models import Coach, Driver, FastLap, Game, SessionType, TrackGuide
+
+from . import segment_features
+from .coach_watcher import create_coach
+from .decoder import Decoder, orjson
+from .firehose import Firehose
+from .history import History
+from .session import Lap, Session
+from .session_saver import SessionSaver
+from .telemetry_buffer import TelemetryBuffer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests", "data")
+
+# influx columns that are not part of the telemetry
+META_COLUMNS = [
+    "result",
+    "table",
+    "_start",
+    "_stop",
+    "_time",
+    "_measurement",
+    "topic",
+    "host",
+    "CarModel",
+    "GameName",
+    "SessionId",
+    "SessionTypeName",
+    "TrackCode",
+    "user",
+]
+
+# what the throughput benchmark can drive, coaches by their mode
+THROUGHPUT_TARGETS = {
+    "firehose": None,
+    "coach": Coach.MODE_DEFAULT,
+    "track_guide": Coach.MODE_TRACK_GUIDE_APP,
+    "debug": Coach.MODE_DEBUG_APP,
+    "copilots": Coach.MODE_COPILOTS,
+}
+
+
+class UnslottedLap:
+    """A Lap without __slots__, as laps were before, the baseline of the memory benchmark."""
+
+    __init__ = Lap.__init__
+
+
+class UnslottedSession:
+    """A Session without __slots__ that creates its Game right away, as sessions were before."""
+
+    def __init__(self, id, start=None):
+        Session.__init__(self, id, start=start)
+        self._game = Game()
+
+
+def _memory(session_class, lap_class, sessions, laps, now):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        objects = []
+        for i in range(sessions):
+            session = session_class(f"crewchief/driver{i}/{i}/game/track/car/Practice", start=now)
+            session.driver = f"driver{i}"
+            session.session_id = str(i)
+            objects.append(session)
+        with_sessions = tracemalloc.get_traced_memory()[0]
+
+        for session in objects:
+            # what Session.new_lap keeps of a lap
+            for lap_number in range(laps):
+                lap = lap_class(lap_number, start=now, end=now)
+                session.laps[lap_number] = lap
+                session.previous_lap = session.current_lap
+                session.current_lap = lap
+        with_laps = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    bytes_per_session = (with_sessions - baseline) / sessions
+    bytes_per_lap = (with_laps - with_sessions) / max(sessions * laps, 1)
+    return bytes_per_session, bytes_per_lap, objects
+
+
+def memory_benchmark(sessions=1000, laps=10):
+    """Measure the memory held by firehose sessions and their laps.
+
+    Returns bytes per session (without laps) and bytes per lap, as traced by tracemalloc,
+    for the slotted Session and Lap and for unslotted ones with an eager Game, as they
+    were before, and the bytes saved.
+    """
+    now = django.utils.timezone.now()
+    bytes_per_session, bytes_per_lap, objects = _memory(Session, Lap, sessions, laps, now)
+    approx_size_per_session = sum(session.approx_size() for session in objects) / sessions
+    del objects
+    unslotted_per_session, unslotted_per_lap, objects = _memory(UnslottedSession, UnslottedLap, sessions, laps, now)
+    del objects
+
+    return {
+        "sessions": sessions,
+        "laps": sessions * laps,
+        "bytes_per_session": bytes_per_session,
+        "bytes_per_lap": bytes_per_lap,
+        "approx_size_per_session": approx_size_per_session,
+        "unslotted_bytes_per_session": unslotted_per_session,
+        "unslotted_bytes_per_lap": unslotted_per_lap,
+        "saved_bytes_per_session": unslotted_per_session - bytes_per_session,
+        "saved_bytes_per_lap": unslotted_per_lap - bytes_per_lap,
+    }
+
+
+def recorded_frame(session_id="1673613558"):
+    df = pd.read_csv(f"{DATA_DIR}/session_{session_id}_df.csv.gz", compression="gzip", parse_dates=["_time"])
+    return df.sort_values(by="_time")
+
+
+def recorded_session(session_id="1673613558", limit=None):
+    """Topic, telemetry and times in ms of a recorded session, the way the replay command publishes it."""
+    df = recorded_frame(session_id)
+    if limit:
+        df = df.head(limit)
+    topic = df["topic"].iloc[0]
+    times = (df["_time"].astype("int64") // 1_000_000).tolist()
+    df = df.drop(columns=[column for column in META_COLUMNS if column in df.columns])
+    df = df.astype(object).where(pd.notnull(df), None)
+    return topic, df.to_dict(orient="records"), times
+
+
+def recorded_payloads(session_id="1673613558", limit=None):
+    """MQTT payloads of a recorded session."""
+    topic, telemetry, times = recorded_session(session_id, limit=limit)
+    payloads = []
+    for _time, values in zip(times, telemetry):
+        payloads.append(json.dumps({"time": _time, "telemetry": values}).encode("utf-8"))
+    return payloads
+
+
+def decode_benchmark(session_id="1673613558", limit=None):
+    """Measure the cost of decoding a recorded payload for every decoder variant.
+
+    Returns microseconds per message for the json and orjson backends,
+    with and without the projection onto the firehose fields.
+    """
+    payloads = recorded_payloads(session_id, limit=limit)
+    results = {
+        "messages": len(payloads),
+        "bytes_per_message": sum(len(payload) for payload in payloads) / max(len(payloads), 1),
+    }
+
+    backends = [Decoder.BACKEND_JSON]
+    if orjson:
+        backends.append(Decoder.BACKEND_ORJSON)
+    for backend in backends:
+        for name, fields in [("full", None), ("firehose", Firehose.TELEMETRY_FIELDS)]:
+            decoder = Decoder(fields=fields, backend=backend)
+            start = time.perf_counter()
+            for payload in payloads:
+                decoder.decode(payload)
+            elapsed = time.perf_counter() - start
+            results[f"{backend}_{name}_us_per_message"] = elapsed * 1_000_000 / max(len(payloads), 1)
+
+    return results
+
+
+def recorded_segments(session_id="1673613558", limit=None, length=300):
+    """The preprocessed telemetry of a recorded session, split into segments of length meters."""
+    topic, telemetry, times = recorded_session(session_id, limit=limit)
+    analyzer = FastLapAnalyzer()
+    buffer = TelemetryBuffer()
+    frames = []
+    segment = None
+    for _time, values in zip(times, telemetry):
+        if values.get("DistanceRoundTrack") is None:
+            continue
+        current = int(values["DistanceRoundTrack"] // length)
+        if segment is not None and current != segment:
+            frames.append(analyzer.preprocess_frame(buffer.finish()))
+        segment = current
+        buffer.append(pd.Timestamp(_time, unit="ms", tz="UTC"), values)
+    frames.append(analyzer.preprocess_frame(buffer.finish()))
+    return frames
+
+
+def features_benchmark(session_id="1673613558", limit=None, length=300):
+    """Measure the feature extraction of a finished segment, pandas vs numpy.
+
+    The pandas path is what the History worker did before, the Analyzer and
+    FastLapAnalyzer functions on a DataFrame. Returns microseconds per segment.
+    """
+    frames = recorded_segments(session_id, limit=limit, length=length)
+    dfs = [frame.to_df() for frame in frames]
+    analyzer = Analyzer()
+    fast_lap_analyzer = FastLapAnalyzer()
+
+    start = time.perf_counter()
+    for df in dfs:
+        fast_lap_analyzer.brake_features(df)
+        fast_lap_analyzer.throttle_features(df)
+        fast_lap_analyzer.gear_features(df)
+        analyzer.sector_time(df)
+        analyzer.sector_lap_time(df)
+    pandas_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame in frames:
+        segment_features.brake_features(frame, brake_threshold=0.1)
+        segment_features.throttle_features(frame)
+        segment_features.gear_features(frame)
+        segment_features.sector_time(frame)
+        segment_features.sector_lap_time(frame)
+    numpy_elapsed = time.perf_counter() - start
+
+    segments = max(len(frames), 1)
+    return {
+        "segments": len(frames),
+        "rows_per_segment": sum(len(frame) for frame in frames) / segments,
+        "pandas_us_per_segment": pandas_elapsed * 1_000_000 / segments,
+        "numpy_us_per_segment": numpy_elapsed * 1_000_000 / segments,
+        "speedup": pandas_elapsed / numpy_elapsed if numpy_elapsed else 0.0,
+    }
+
+
+def virtual_topic(topic, driver):
+    frags = topic.split("/")
+    frags[1] = driver
+    return "/".join(frags)
+
+
+def seed_fast_lap(session_id, max_laps=3):
+    """The fast lap of the game, track and car of a recorded session, created if there is none.
+
+    The segments are extracted from the complete laps of the recording, the way
+    manage.py analyze does it with the fast laps in influx. Raises a ValueError
+    if the recording has no complete lap.
+    """
+    df = recorded_frame(session_id)
+    prefix, driver, _session_id, game_name, track_name, car_name, session_type = df["topic"].iloc[0].split("/")
+    track_length = int(df["DistanceRoundTrack"].max())
+    game, created = Game.objects.get_or_create(name=game_name)
+    track, created = game.tracks.get_or_create(name=track_name, defaults={"length": track_length})
+    car, created = game.cars.get_or_create(name=car_name)
+    fast_lap = FastLap.objects.filter(game=game, track=track, car=car, driver=None).first()
+    if fast_lap and fast_lap.data:
+        return fast_lap
+
+    analyzer = FastLapAnalyzer()
+    laps = []
+    for number, lap in df.groupby("CurrentLap"):
+        distance = lap["DistanceRoundTrack"]
+        # laps from the start line all the way around
+        if distance.min() < 50 and distance.max() > 0.95 * track_length:
+            laps.append(analyzer.preprocess(lap))
+        if len(laps) == max_laps:
+            break
+    if not laps:
+        raise ValueError(f"session {session_id} has no complete lap to build a fast lap from")
+
+    sectors, df_max = analyzer.extract_sectors(laps)
+    if not sectors:
+        raise ValueError(f"no segments found in the laps of session {session_id}")
+    segments, used_laps = analyzer.extract_segments(sectors, laps, list(range(len(laps))), df_max)
+    data = {
+        "distance_time": analyzer.analyzer.distance_speed_lookup_table(laps[0]),
+        "segments": segments,
+    }
+    fast_lap, created = FastLap.objects.update_or_create(
+        game=game, track=track, car=car, driver=None, defaults={"data": data}
+    )
+    logging.info(f"seeded the fast lap of {fast_lap} with {len(segments)} segments")
+    return fast_lap
+
+
+def seed_track_guide(fast_lap):
+    """The track guide of the car and track of a fast lap, created with two recon notes per segment if there is none."""
+    track_guide = TrackGuide.objects.filter(car=fast_lap.car, track=fast_lap.track).first()
+    if track_guide:
+        return track_guide
+
+    track_guide = TrackGuide.objects.create(name="benchmark", car=fast_lap.car, track=fast_lap.track)
+    for segment in fast_lap.data["segments"]:
+        # played at the brake or throttle point of the segment, a turn cycles through its sort keys
+        for sort_key in ["1", "2"]:
+            track_guide.notes.create(
+                segment=segment.turn, mode="recon", sort_key=sort_key, message=f"turn {segment.turn} note {sort_key}"
+            )
+    return track_guide
+
+
+def throughput_benchmark(target="firehose", drivers=10, session_ids=None, limit=3600, hz=60):
+    """Drive N virtual drivers through a pitcrew component in process, without a broker.
+
+    Every driver replays one of the recorded sessions, all drivers send one message per tick
+    of a hz clock. Coaches do their History work inline, so it is part of the latency of the
+    message that triggered it. Coaches compare the drivers to the fast lap of the recorded game,
+    track and car, if the database has none it is seeded from the complete laps of the recording.
+    The track guide gets a track guide with recon notes for every segment the same way.
+    coaches_ready tells how many coaches got past their initialization.
+    Everything written to the database is rolled back.
+    """
+    mode = THROUGHPUT_TARGETS[target]
+    session_ids = session_ids or ["1690362827"]
+    sessions = [recorded_session(session_id, limit=limit) for session_id in session_ids]
+
+    streams = []
+    for i in range(drivers):
+        topic, telemetry, times = sessions[i % len(sessions)]
+        driver_name = f"benchmark-{i}"
+        streams.append((virtual_topic(topic, driver_name), driver_name, telemetry))
+
+    with transaction.atomic():
+        if mode is not None:
+            for session_id in session_ids:
+                fast_lap = seed_fast_lap(session_id)
+                if mode == Coach.MODE_TRACK_GUIDE_APP:
+                    seed_track_guide(fast_lap)
+        results = _throughput(target, mode, streams, hz)
+        transaction.set_rollback(True)
+    return results
+
+
+def _throughput(target, mode, streams, hz):
+    histories = []
+    if mode is None:
+        firehose = Firehose()
+        handlers = [firehose] * len(streams)
+    else:
+        handlers = []
+        for topic, driver_name, telemetry in streams:
+            SessionType.objects.get_or_create(type=topic.split("/")[6])
+            driver, created = Driver.objects.get_or_create(name=driver_name)
+            coach_model, created = Coach.objects.get_or_create(driver=driver, defaults={"mode": mode})
+            history = History()
+            handlers.append(create_coach(history, coach_model))
+            histories.append(history)
+
+    start_time = django.utils.timezone.now()
+    ticks = max(len(telemetry) for topic, driver_name, telemetry in streams)
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for tick in range(ticks):
+        now = start_time + datetime.timedelta(seconds=tick / hz)
+        for i, (topic, driver_name, telemetry) in enumerate(streams):
+            if tick >= len(telemetry):
+                continue
+            # the coaches add fields to the telemetry
+            data = dict(telemetry[tick])
+            message_start = time.perf_counter_ns()
+            try:
+                handlers[i].notify(topic, data, now)
+                # the History thread of a coach
+                if histories and histories[i].is_initializing():
+                    histories[i].step()
+            except Exception as e:
+                if not errors:
+                    logging.exception(f"{topic}: Error processing message: {e}")
+                errors += 1
+            latencies.append(time.perf_counter_ns() - message_start)
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) / 1000
+    results = {
+        "target": target,
+        "drivers": len(streams),
+        "messages": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "messages_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_us": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        "p99_us": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+        # ru_maxrss is in kilobytes on linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if histories:
+        results["coaches_ready"] = len([history for history in histories if history.is_ready()])
+    return results
+
+
+def saver_benchmark(sessions=100, laps=5):
+    """Measure the database work of a SessionSaver cycle.
+
+    The first cycle creates the session records and saves the first laps, the second
+    cycle only saves the laps finished since then, like a cycle at peak traffic.
+    Everything written to the database is rolled back.
+    """
+    with transaction.atomic():
+        results = _saver(sessions, laps)
+        transaction.set_rollback(True)
+    return results
+
+
+def _saver(sessions, laps):
+    start_time = django.utils.timezone.now()
+    firehose = Firehose()
+    for i in range(sessions):
+        topic = f"crewchief/benchmark-{i}/{i}/game/track/car/Practice"
+        firehose.new_session(topic, {"CarClass": "class"}, start_time)
+    saver = SessionSaver(firehose)
+
+    results = {"sessions": sessions, "laps": sessions * laps}
+    for cycle in ["first_cycle", "cycle"]:
+        for session in firehose.sessions.values():
+            offset = len(session.laps)
+            for lap_number in range(offset, offset + laps):
+                lap = session.new_lap(start_time + datetime.timedelta(minutes=lap_number), lap_number)
+                lap.finished = True
+                lap.length = 1000 + lap_number
+                lap.time = 60.0
+
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            saver.save_sessions()
+        results[f"{cycle}_seconds"] = time.perf_counter() - start
+        results[f"{cycle}_queries"] = len(queries)
+    return results
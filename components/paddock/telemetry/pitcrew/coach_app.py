@@ -2,7 +2,8 @@ import json
 
 import django.utils.timezone
 
-from telemetry.models import Coach, SessionType
+from telemetry.dimensions import dimensions
+from telemetry.models import Coach
 from telemetry.pitcrew.logging_mixin import LoggingMixin
 
 from .application.debug_application import DebugApplication
@@ -54,7 +55,7 @@ class CoachApp(LoggingMixin):
         self.topic = topic
         filter = self.filter_from_topic(topic)
         self.session_id = filter["SessionId"]
-        self.session_type = SessionType.objects.get(type=filter["SessionType"])
+        self.session_type = dimensions.session_type(filter["SessionType"])
         self.log_debug("new session %s", topic)
         self.history.set_filter(filter, self.coach_model.mode)
 
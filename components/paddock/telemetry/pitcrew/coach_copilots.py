@@ -3,7 +3,8 @@ import json
 import django.utils.timezone
 from b4mad_racing_website.models import CopilotInstance
 
-from telemetry.models import Coach, SessionType
+from telemetry.dimensions import dimensions
+from telemetry.models import Coach
 from telemetry.pitcrew.logging_mixin import LoggingMixin
 
 from .application.brake_application import BrakeApplication
@@ -57,7 +58,7 @@ class CoachCopilots(LoggingMixin):
         self.topic = topic
         filter = self.filter_from_topic(topic)
         self.session_id = filter["SessionId"]
-        self.session_type = SessionType.objects.get(type=filter["SessionType"])
+        self.session_type = dimensions.session_type(filter["SessionType"])
         self.log_debug("new session %s", topic)
         self.history.set_filter(filter, self.coach_model.mode)
 
@@ -0,0 +1,294 @@
+import bisect
+import logging
+import queue
+import threading
+import zlib
+
+from telemetry.models import Coach
+
+from .coach_scheduler import CoachScheduler
+from .coach_watcher import create_coach
+from .fanout import driver_name
+from .history import History
+from .worker_processes import WorkerProcesses
+
+
+class HashRing:
+    """Consistent hashing of driver names onto workers.
+
+    Every worker owns replicas points on the ring, a driver belongs to the
+    first point after the hash of its name. When a worker joins or leaves,
+    only the drivers of the points it takes over or hands back move.
+    """
+
+    def __init__(self, replicas=64):
+        self.replicas = replicas
+        self._points = []
+        self._nodes = {}
+
+    @staticmethod
+    def hash(key):
+        # crc32 is stable across processes and restarts, unlike hash()
+        return zlib.crc32(str(key).encode("utf-8"))
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self.hash(f"{node}-{i}")
+            bisect.insort(self._points, point)
+            self._nodes[point] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            point = self.hash(f"{node}-{i}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._points.remove(point)
+
+    def nodes(self):
+        return set(self._nodes.values())
+
+    def node_for(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self.hash(key)) % len(self._points)
+        return self._nodes[self._points[index]]
+
+
+def run_coach_worker(worker, inbox, outbox, threads=2):
+    """Main loop of a coach worker process.
+
+    Runs the coaches the pool places on this worker. The History work of the
+    coaches is done by a CoachScheduler of the process, the responses of the
+    coaches are sent back to the pool.
+    """
+    scheduler = CoachScheduler(workers=threads)
+    scheduler.start()
+    coaches = {}
+    logging.info(f"coach worker {worker} started")
+
+    def stop_coach(name):
+        if name in coaches:
+            history, coach = coaches.pop(name)
+            history.disconnect()
+
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+
+        if message[0] == "telemetry":
+            topic, payload, now = message[1:]
+            entry = coaches.get(driver_name(topic))
+            if not entry:
+                continue
+            try:
+                response = entry[1].notify(topic, payload, now)
+            except Exception as e:
+                logging.exception(f"{topic}: Error in coach: {e}")
+                continue
+            if response:
+                r_topic, r_payload = response
+                payloads = r_payload if isinstance(r_payload, list) else [r_payload]
+                for r_payload in payloads:
+                    outbox.put((r_topic, r_payload))
+        elif message[0] == "start":
+            name, coach_pk, debug = message[1:]
+            stop_coach(name)
+            try:
+                coach_model = Coach.objects.select_related("driver").get(pk=coach_pk)
+            except Exception as e:
+                logging.exception(f"coach worker {worker}: Error loading coach of {name}: {e}")
+                continue
+            history = History()
+            coaches[name] = (history, create_coach(history, coach_model, debug=debug))
+            scheduler.add(history)
+            logging.info(f"coach worker {worker}: started coach for {name}")
+        elif message[0] == "stop":
+            stop_coach(message[1])
+            logging.info(f"coach worker {worker}: stopped coach for {message[1]}")
+
+    for name in list(coaches.keys()):
+        stop_coach(name)
+    scheduler.stop()
+    logging.info(f"coach worker {worker} stopped")
+
+
+class RemoteCoach:
+    """Stands in for a coach running in a worker process of the CoachPool.
+
+    The fanout passes the telemetry on, the responses are published by the
+    pool when they come back. It takes the place of the History, the coach
+    and the thread of a local coach in CoachWatcher.active_coaches.
+    """
+
+    def __init__(self, pool, driver_name):
+        self.pool = pool
+        self.driver_name = driver_name
+
+    def notify(self, topic, payload, now=None):
+        self.pool.notify(topic, payload, now)
+
+    def disconnect(self):
+        self.pool.unregister(self.driver_name)
+
+    def is_alive(self):
+        return self.pool.is_alive(self.driver_name)
+
+
+class CoachPool:
+    """Run the coaches in worker processes instead of threads of the crew.
+
+    The History work of a coach is pandas heavy, in a single process all
+    coaches compete for the GIL. The pool places every coached driver on one
+    of its worker processes by consistent hashing of the driver name, the
+    telemetry of the driver is forwarded to that worker and the responses
+    are read back from a shared queue. When a worker dies, its drivers are
+    moved to the remaining workers, when a worker is added, it takes over
+    its share of the drivers. A moved coach starts over with a new History.
+    """
+
+    def __init__(self, workers=2, threads=2, debug=False):
+        self.workers = workers
+        self.threads = threads
+        self.debug = debug
+        self.ring = HashRing()
+        # set to the publish method of the MQTT client
+        self.publish = None
+
+        self.worker_processes = WorkerProcesses()
+        # worker -> inbox, the workers on the ring
+        self.inboxes = {}
+        self._next_worker = 0
+        # driver name -> (coach pk, debug)
+        self.coaches = {}
+        # driver name -> worker
+        self.owners = {}
+        self._lock = threading.RLock()
+
+        self.forwarded = 0
+        self.responses = 0
+        self.rebalanced = 0
+        self._stop_event = threading.Event()
+        self.ready = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def start(self):
+        """Fork the worker processes, call this before starting any threads."""
+        for _ in range(self.workers):
+            self.add_worker()
+
+    def add_worker(self):
+        worker = self._next_worker
+        self._next_worker += 1
+        inbox = self.worker_processes.start(worker, f"coach-worker-{worker}", run_coach_worker, threads=self.threads)
+        self.join(worker, inbox)
+        return worker
+
+    def join(self, worker, inbox):
+        with self._lock:
+            self.inboxes[worker] = inbox
+            self.ring.add(worker)
+            self.rebalance()
+
+    def leave(self, worker):
+        with self._lock:
+            self.ring.remove(worker)
+            self.inboxes.pop(worker, None)
+            self.worker_processes.remove(worker)
+            # the coaches of the worker are gone with it
+            for name, owner in list(self.owners.items()):
+                if owner == worker:
+                    del self.owners[name]
+                    self.rebalanced += 1
+            self.rebalance()
+
+    def rebalance(self):
+        with self._lock:
+            for name in self.coaches.keys():
+                owner = self.ring.node_for(name)
+                previous = self.owners.get(name)
+                if owner == previous:
+                    continue
+                if previous is not None:
+                    self.inboxes[previous].put(("stop", name))
+                    self.rebalanced += 1
+                    logging.info(f"moving coach for {name} from worker {previous} to {owner}")
+                self.assign(name, owner)
+
+    def assign(self, name, owner):
+        if owner is None:
+            self.owners.pop(name, None)
+            return
+        coach_pk, debug = self.coaches[name]
+        self.inboxes[owner].put(("start", name, coach_pk, debug))
+        self.owners[name] = owner
+
+    def register(self, driver_name, coach_model, debug=False):
+        with self._lock:
+            self.coaches[driver_name] = (coach_model.pk, debug)
+            self.owners.pop(driver_name, None)
+            self.assign(driver_name, self.ring.node_for(driver_name))
+        return RemoteCoach(self, driver_name)
+
+    def unregister(self, driver_name):
+        with self._lock:
+            self.coaches.pop(driver_name, None)
+            owner = self.owners.pop(driver_name, None)
+            if owner is not None:
+                self.inboxes[owner].put(("stop", driver_name))
+
+    def is_alive(self, driver_name):
+        if not self.ring.nodes():
+            # not started yet
+            return not self.worker_processes.processes and not self.stopped()
+        return driver_name in self.owners
+
+    def notify(self, topic, payload, now=None):
+        owner = self.owners.get(driver_name(topic))
+        inbox = self.inboxes.get(owner)
+        if inbox is not None:
+            inbox.put(("telemetry", topic, payload, now))
+            self.forwarded += 1
+
+    def metrics(self):
+        return {
+            "pitcrew_coach_pool_workers": len(self.worker_processes.alive()),
+            "pitcrew_coach_pool_coaches": len(self.owners),
+            "pitcrew_coach_pool_forwarded_total": self.forwarded,
+            "pitcrew_coach_pool_responses_total": self.responses,
+            "pitcrew_coach_pool_rebalanced_total": self.rebalanced,
+        }
+
+    def publish_response(self, response):
+        r_topic, r_payload = response
+        logging.debug("r-->: %s : %s", r_topic, r_payload)
+        self.responses += 1
+        if self.publish:
+            self.publish(r_topic, r_payload)
+
+    def run(self):
+        if not self.worker_processes.processes:
+            self.start()
+        self.ready = True
+        try:
+            while not self.stopped():
+                try:
+                    self.publish_response(self.worker_processes.outbox.get(timeout=1))
+                except queue.Empty:
+                    pass
+
+                for worker, p in self.worker_processes.dead().items():
+                    logging.error(f"{p.name} died, moving its coaches to the other workers")
+                    self.leave(worker)
+                if not self.worker_processes.processes:
+                    logging.error("all coach workers died")
+                    return
+        finally:
+            # the last responses of the workers
+            self.worker_processes.stop(self.publish_response)
+            logging.info("CoachPool stopped")
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class CoachScheduler:
+    """Run the work of all History instances on a fixed pool of worker threads.
+
+    A History schedules itself when it is woken up, e.g. when a segment is
+    ready to be processed. A History is never run by two workers at the same
+    time, work scheduled while it runs is done right after, so the segments
+    of a driver are processed in order.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    # woken up again while running
+    RERUN = "rerun"
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.queue = deque()
+        # id(history) -> state
+        self._states = {}
+        self._condition = threading.Condition()
+
+        self.jobs = 0
+        self.errors = 0
+        # seconds from scheduling to running, and of running the latest jobs
+        self.wait_times = deque(maxlen=1000)
+        self.job_times = deque(maxlen=1000)
+
+        self._threads = []
+        self._stop_event = threading.Event()
+        self.ready = False
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def add(self, history):
+        history.threaded = True
+        history.wakeup_callback = lambda: self.schedule(history)
+        # pick up the work queued before the history was added
+        self.schedule(history)
+        return self
+
+    def is_alive(self):
+        if not self._threads:
+            # not started yet
+            return not self.stopped()
+        return any(thread.is_alive() for thread in self._threads)
+
+    def schedule(self, history):
+        key = id(history)
+        with self._condition:
+            state = self._states.get(key)
+            if state == self.RUNNING:
+                self._states[key] = self.RERUN
+            elif state is None:
+                self._states[key] = self.QUEUED
+                self.queue.append((history, time.monotonic()))
+                self._condition.notify()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def work(self):
+        while True:
+            with self._condition:
+                while not self.queue and not self.stopped():
+                    self._condition.wait(timeout=1)
+                if not self.queue:
+                    return
+                history, queued_at = self.queue.popleft()
+                self._states[id(history)] = self.RUNNING
+
+            start = time.monotonic()
+            self.wait_times.append(start - queued_at)
+            try:
+                if history.do_run:
+                    history.step()
+            except Exception as e:
+                self.errors += 1
+                logging.exception(f"Error in History {history.session_id}: {e}")
+            self.job_times.append(time.monotonic() - start)
+            self.jobs += 1
+
+            with self._condition:
+                if self._states.get(id(history)) == self.RERUN:
+                    self._states[id(history)] = self.QUEUED
+                    self.queue.append((history, time.monotonic()))
+                    self._condition.notify()
+                else:
+                    del self._states[id(history)]
+
+    def metrics(self):
+        wait_times = list(self.wait_times)
+        job_times = list(self.job_times)
+        return {
+            "pitcrew_coach_scheduler_jobs_total": self.jobs,
+            "pitcrew_coach_scheduler_errors_total": self.errors,
+            "pitcrew_coach_scheduler_workers": self.workers,
+            "pitcrew_coach_scheduler_queue_depth": self.queue_depth(),
+            "pitcrew_coach_scheduler_wait_p50_seconds": float(np.percentile(wait_times, 50)) if wait_times else 0.0,
+            "pitcrew_coach_scheduler_wait_p99_seconds": float(np.percentile(wait_times, 99)) if wait_times else 0.0,
+            "pitcrew_coach_scheduler_job_p50_seconds": float(np.percentile(job_times, 50)) if job_times else 0.0,
+            "pitcrew_coach_scheduler_job_p99_seconds": float(np.percentile(job_times, 99)) if job_times else 0.0,
+        }
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.name = f"coach-worker-{i}"
+            thread.start()
+            self._threads.append(thread)
+
+    def run(self):
+        self.start()
+        self.ready = True
+        self._stop_event.wait()
+        for thread in self._threads:
+            thread.join(timeout=60)
@@ -1,82 +1,191 @@
 import logging
 import threading
 import time
+from collections import deque
 
+from telemetry.coach_feed import coach_feed
+from telemetry.dimensions import dimensions
 from telemetry.models import Coach, Driver
 
 from .coach import Coach as PitCrewCoach
 from .coach_app import CoachApp
 from .coach_copilots import CoachCopilots
+from .fanout import CoachQueue
 from .history import History
-from .mqtt import Mqtt
+
+
+def create_coach(history, coach_model, debug=False):
+    if coach_model.mode == Coach.MODE_TRACK_GUIDE_APP or coach_model.mode == Coach.MODE_DEBUG_APP:
+        return CoachApp(history, coach_model, debug=debug)
+    elif coach_model.mode == Coach.MODE_COPILOTS:
+        return CoachCopilots(history, coach_model, debug=debug)
+    return PitCrewCoach(history, coach_model, debug=debug)
 
 
 class CoachWatcher:
-    def __init__(self, firehose, replay=False):
+    """Start and stop the coaches of the drivers in the firehose.
+
+    The coach of a driver is looked up once, when the driver shows up. Later
+    changes of Coach.enabled and Coach.mode arrive through the coach feed, so
+    no queries are needed while nothing changes. Every resync_interval
+    seconds all drivers are looked up again, in case a change got lost.
+    """
+
+    def __init__(self, firehose, fanout, scheduler=None, pool=None):
         self.firehose = firehose
+        # the coaches get their telemetry from the crew's MQTT subscription
+        self.fanout = fanout
+        # runs the work of the History instances, without it every History gets a thread
+        self.scheduler = scheduler
+        # runs the coaches in worker processes instead
+        self.pool = pool
         self.sleep_time = 3
+        self.resync_interval = 300
         self.active_coaches = {}
-        self.replay = replay
+        # pks of the drivers whose coach was looked up
+        self.checked_drivers = set()
+        self.changes = deque()
         self.ready = False
 
+        self._next_resync = time.monotonic() + self.resync_interval
+        self._wakeup_event = threading.Event()
+        # called on wakeup, lets an event loop schedule the work
+        self.wakeup_callback = None
         self._stop_event = threading.Event()
 
     def stop(self):
         self._stop_event.set()
+        self._wakeup_event.set()
 
     def stopped(self):
         return self._stop_event.is_set()
 
     def drivers(self):
         drivers = set()
-        for session in self.firehose.sessions.values():
-            # check if session.driver is a Driver object
-            if isinstance(session.driver, Driver):
-                drivers.add(session.driver)
+        for session in list(self.firehose.sessions.values()):
+            driver = session.driver
+            if not isinstance(driver, Driver):
+                # not resolved by the session saver yet, with a spool it never is
+                try:
+                    driver = dimensions.driver(driver)
+                except Driver.DoesNotExist:
+                    # a new driver has no coach
+                    continue
+            drivers.add(driver)
         return drivers
 
+    def notify(self, change):
+        self.changes.append(change)
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
+
+    def listen(self):
+        coach_feed.subscribe(self.notify)
+        coach_feed.listen()
+
     def watch_coaches(self):
+        self.listen()
         while True and not self.stopped():
-            self.check_active_coaches()
-            # sleep longer than save_sessions, to make sure all DB objects are initialized
-            drivers = self.drivers()
-            # collect all driver names
-            # driver_names = [driver.name for driver in drivers]
-            # logging.info("checking coaches for drivers: %s", ", ".join(driver_names))
-            coaches = Coach.objects.filter(driver__in=drivers)
-            for coach in coaches:
-                # logging.info(f"{coach.driver} coach enabled: {coach.enabled}")
-                if coach.enabled:
-                    if coach.driver.name not in self.active_coaches.keys():
-                        logging.debug(f"activating coach for {coach.driver}")
-                        self.start_coach(coach.driver.name, coach)
-                else:
-                    if coach.driver.name in self.active_coaches.keys():
-                        logging.debug(f"deactivating coach for {coach.driver}")
-                        self.stop_coach(coach.driver.name)
-            time.sleep(self.sleep_time)
+            self.watch_once()
             self.ready = True
+            # new drivers show up within sleep_time seconds, coach changes right away
+            self._wakeup_event.wait(self.sleep_time)
+            self._wakeup_event.clear()
+
+    def watch_once(self):
+        self.check_active_coaches()
+        drivers = {driver.pk: driver for driver in self.drivers()}
+
+        while self.changes:
+            self.apply_change(self.changes.popleft(), drivers)
+
+        if time.monotonic() > self._next_resync:
+            self.checked_drivers.clear()
+            self._next_resync = time.monotonic() + self.resync_interval
+
+        new_drivers = [driver for pk, driver in drivers.items() if pk not in self.checked_drivers]
+        # drivers that left are looked up again when they come back
+        self.checked_drivers = set(drivers.keys())
+        if not new_drivers:
+            return
+
+        coaches = Coach.objects.filter(driver__in=new_drivers).select_related("driver")
+        for coach in coaches:
+            # logging.info(f"{coach.driver} coach enabled: {coach.enabled}")
+            if coach.enabled:
+                if coach.driver.name not in self.active_coaches.keys():
+                    logging.debug(f"activating coach for {coach.driver}")
+                    self.start_coach(coach.driver.name, coach)
+            else:
+                if coach.driver.name in self.active_coaches.keys():
+                    logging.debug(f"deactivating coach for {coach.driver}")
+                    self.stop_coach(coach.driver.name)
+
+    def apply_change(self, change, drivers):
+        if change.get("resync"):
+            self.checked_drivers.clear()
+            return
+
+        driver_name = change["driver"]
+        active = self.active_coaches.get(driver_name)
+        if not change["enabled"]:
+            if active:
+                logging.debug(f"deactivating coach for {driver_name}")
+                self.stop_coach(driver_name)
+            return
+
+        if active and active[3].mode == change["mode"]:
+            return
+        # coaches only run for drivers with a session
+        if change["driver_id"] not in drivers:
+            return
+        coach = Coach.objects.filter(pk=change["driver_id"]).select_related("driver").first()
+        if not coach or not coach.enabled:
+            return
+        if active:
+            logging.debug(f"restarting coach for {driver_name} in mode {coach.mode}")
+            self.stop_coach(driver_name)
+        else:
+            logging.debug(f"activating coach for {driver_name}")
+        self.start_coach(driver_name, coach)
 
     def stop_coach(self, driver_name):
         if driver_name not in self.active_coaches.keys():
             return
-        logging.info(f"disconnectin MQTT thread for {driver_name}")
-        self.active_coaches[driver_name][0].disconnect()
+        logging.info(f"unregistering coach for {driver_name}")
+        self.fanout.unregister(driver_name)
         logging.info(f"disconnecting History thread for {driver_name}")
-        self.active_coaches[driver_name][1].disconnect()
+        history, coach = self.active_coaches[driver_name][:2]
+        history.disconnect()
+        # a remote coach stands in for both
+        if coach is not history:
+            coach.disconnect()
         del self.active_coaches[driver_name]
 
     def start_coach(self, driver_name, coach_model, debug=False):
+        if self.pool:
+            # the remote coach stands in for the History, the coach and its worker
+            remote = self.pool.register(driver_name, coach_model, debug=debug)
+            self.fanout.register(driver_name, remote)
+            self.active_coaches[driver_name] = [remote, remote, [remote], coach_model]
+            return
+
         history = History()
-        if coach_model.mode == Coach.MODE_TRACK_GUIDE_APP or coach_model.mode == Coach.MODE_DEBUG_APP:
-            coach = CoachApp(history, coach_model, debug=debug)
-        elif coach_model.mode == Coach.MODE_COPILOTS:
-            coach = CoachCopilots(history, coach_model, debug=debug)
-        else:
-            coach = PitCrewCoach(history, coach_model, debug=debug)
+        coach = create_coach(history, coach_model, debug=debug)
 
-        topic = f"crewchief/{driver_name}/#"
-        mqtt = Mqtt(coach, topic, replay=self.replay, debug=debug)
+        # the coach gets the telemetry off the ingest thread
+        coach_queue = CoachQueue(self.fanout, coach, driver_name)
+
+        threads = list()
+        threads.append(self.start_history(driver_name, history))
+        threads.append(self.start_history(f"{driver_name}/coach", coach_queue))
+        self.fanout.register(driver_name, coach_queue)
+        self.active_coaches[driver_name] = [history, coach_queue, threads, coach_model]
+
+    def start_history(self, driver_name, history):
+        if self.scheduler:
+            return self.scheduler.add(history)
 
         def history_thread():
             logging.info(f"History thread starting for {driver_name}")
@@ -85,31 +194,21 @@ class CoachWatcher:
 
         h = threading.Thread(target=history_thread)
         h.name = f"history-{driver_name}"
-
-        def mqtt_thread():
-            logging.info(f"MQTT thread starting for {driver_name}")
-            mqtt.run()
-            logging.info(f"MQTT thread stopped for {driver_name}")
-
-        c = threading.Thread(target=mqtt_thread)
-        c.name = f"mqtt-{driver_name}"
-
-        threads = list()
-        threads.append(h)
-        threads.append(c)
-        c.start()
         h.start()
-        self.active_coaches[driver_name] = [history, mqtt, threads]
+        return h
+
+    def is_alive(self, worker):
+        return worker.is_alive()
 
     def check_active_coaches(self):
         dead_drivers = set()
         for driver_name in self.active_coaches.keys():
             # history = self.active_coaches[driver_name][0]
-            # mqtt = self.active_coaches[driver_name][1]
+            # coach = self.active_coaches[driver_name][1]
             threads = self.active_coaches[driver_name][2]
 
             for t in threads:
-                if not t.is_alive():
+                if not self.is_alive(t):
                     self.stop()
                     logging.error(f"Thread {t} died for {driver_name}")
                     dead_drivers.add(driver_name)
@@ -125,9 +224,11 @@ class CoachWatcher:
             logging.exception(f"Exception in CoachWatcher: {e}")
             raise e
         finally:
-            # stop all coaches
-            coaches = list(self.active_coaches.keys())
-            for driver in coaches:
-                self.stop_coach(driver)
-
+            self.stop_coaches()
             logging.info("CoachWatcher stopped")
+
+    def stop_coaches(self):
+        coach_feed.unsubscribe(self.notify)
+        coaches = list(self.active_coaches.keys())
+        for driver in coaches:
+            self.stop_coach(driver)
@@ -6,14 +6,40 @@ import time
 
 from flask_healthz import HealthError
 
+from telemetry.dimensions import dimensions
+
+from .coach_pool import CoachPool
+from .coach_scheduler import CoachScheduler
 from .coach_watcher import CoachWatcher
+from .fanout import Fanout
+from .fast_lap_cache import fast_laps
 from .firehose import Firehose
+from .ingest import Ingest
 from .mqtt import Mqtt
+from .publisher import Publisher
 from .session_saver import SessionSaver
+from .sharded_firehose import ShardedFirehose
+from .spool import Spool, SpoolDrainer
 
 
 class Crew:
-    def __init__(self, debug=False, replay=False, save=True):
+    coach_watcher_class = CoachWatcher
+    coach_scheduler_class = CoachScheduler
+
+    def __init__(
+        self,
+        debug=False,
+        replay=False,
+        save=True,
+        ingest_queue_size=600,
+        drop_policy=Ingest.DROP_OLDEST,
+        shards=1,
+        session_ttl=600,
+        max_sessions=1000,
+        spool=None,
+        coach_workers=4,
+        coach_processes=0,
+    ):
         self._ready = False
         self._live = False
         self.debug = debug
@@ -22,15 +48,71 @@ class Crew:
 
         topic = "crewchief/#"
 
-        self.firehose = Firehose(debug=debug)
-        self.mqtt = Mqtt(self.firehose, topic, replay=replay)
-
-        self.coach_watcher = CoachWatcher(self.firehose, replay=replay)
+        self.components = {}
+
+        self.spool_drainer = None
+        if shards > 1:
+            if spool:
+                raise ValueError("the spool doesn't support firehose shards")
+            # every shard process runs its own firehose and session saver
+            self.firehose = ShardedFirehose(
+                shards=shards,
+                save=save,
+                debug=debug,
+                session_ttl=session_ttl,
+                max_sessions=max_sessions,
+            )
+            self.session_saver = None
+        else:
+            self.firehose = Firehose(debug=debug, session_ttl=session_ttl, max_sessions=max_sessions)
+            if spool and save:
+                # laps are written to a local file first and drained into the database
+                spool = Spool(spool)
+                self.spool_drainer = SpoolDrainer(spool)
+            else:
+                spool = None
+            self.session_saver = SessionSaver(self.firehose, save=save, spool=spool)
+            # new sessions and finished laps are saved as they come, the sweep is a safety net
+            self.session_saver.sleep_time = 30
+
+        # the firehose only looks at a few fields of the telemetry, coaches get all of it
+        self.fanout = Fanout(self.firehose, fields=Firehose.TELEMETRY_FIELDS)
+        self.ingest = Ingest(self.fanout, max_queue_size=ingest_queue_size, drop_policy=drop_policy)
+        self.mqtt = Mqtt(self.ingest, topic, replay=replay, decoder=self.fanout.decoder)
+        # responses are sent off the ingest thread, coalesced per driver
+        self.publisher = Publisher(self.mqtt.publish)
+        self.fanout.publish = self.publisher.publish
+
+        self.coach_scheduler = None
+        self.coach_pool = None
+        if coach_processes > 0:
+            # the coaches run in worker processes, every process has its own GIL
+            self.coach_pool = CoachPool(workers=coach_processes, threads=coach_workers, debug=debug)
+            self.coach_pool.publish = self.publisher.publish
+        elif self.coach_scheduler_class:
+            # the work of all coaches is done by a fixed number of threads
+            self.coach_scheduler = self.coach_scheduler_class(workers=coach_workers)
+        self.coach_watcher = self.coach_watcher_class(
+            self.firehose, self.fanout, scheduler=self.coach_scheduler, pool=self.coach_pool
+        )
         self.coach_watcher.sleep_time = 3
 
-        self.session_saver = SessionSaver(self.firehose, save=save)
-        self.session_saver.sleep_time = 5
-
+        self.components["mqtt"] = self.mqtt
+        self.components["ingest"] = self.ingest
+        self.components["publisher"] = self.publisher
+        if self.coach_scheduler:
+            self.components["coach_scheduler"] = self.coach_scheduler
+        if self.coach_pool:
+            self.components["coach_pool"] = self.coach_pool
+        self.components["coach_watcher"] = self.coach_watcher
+        if self.session_saver:
+            self.components["session_saver"] = self.session_saver
+        else:
+            self.components["firehose"] = self.firehose
+        if self.spool_drainer:
+            self.components["spool_drainer"] = self.spool_drainer
+
+        self._processes_started = False
         self._stop_event = threading.Event()
         logging.debug("Crew initialized")
 
@@ -53,6 +135,37 @@ class Crew:
         if not self._ready:
             raise HealthError("not ready yet")
 
+    def metrics(self):
+        metrics = {}
+        for component in [self.ingest, self.fanout, self.publisher, self.firehose, dimensions, fast_laps]:
+            metrics.update(component.metrics())
+        if self.session_saver:
+            metrics.update(self.session_saver.metrics())
+        if self.spool_drainer:
+            metrics.update(self.spool_drainer.metrics())
+        if self.coach_scheduler:
+            metrics.update(self.coach_scheduler.metrics())
+        if self.coach_pool:
+            metrics.update(self.coach_pool.metrics())
+        return metrics
+
+    def start_processes(self):
+        """Fork the firehose shards and the coach workers, call this before starting any threads."""
+        if self._processes_started:
+            return
+        self._processes_started = True
+        if isinstance(self.firehose, ShardedFirehose):
+            self.firehose.start()
+        if self.coach_pool:
+            self.coach_pool.start()
+
+    def warm_up(self):
+        # new sessions resolve their driver, game, car and track without queries
+        try:
+            dimensions.warm_up()
+        except Exception as e:
+            logging.error(f"Error warming up the dimension cache: {e}")
+
     def run(self):
         # log my process id
         logging.info(f"starting Crew with pid {os.getpid()}")
@@ -60,19 +173,16 @@ class Crew:
         # add signal handling for SIGTERM
         signal.signal(signal.SIGTERM, self._handle_sigterm)
 
-        threads = []
-
-        t = threading.Thread(target=self.mqtt.run)
-        t.name = "mqtt"
-        threads.append(t)
+        # a no-op if the caller forked them before starting its own threads
+        self.start_processes()
 
-        t = threading.Thread(target=self.coach_watcher.run)
-        t.name = "coach_watcher"
-        threads.append(t)
+        self.warm_up()
 
-        t = threading.Thread(target=self.session_saver.run)
-        t.name = "session_saver"
-        threads.append(t)
+        threads = []
+        for name, component in self.components.items():
+            t = threading.Thread(target=component.run)
+            t.name = name
+            threads.append(t)
 
         for t in threads:
             logging.debug(f"starting Thread {t}")
@@ -80,7 +190,7 @@ class Crew:
 
         logging.debug("waiting for threads to be ready...")
         while True:
-            if self.mqtt.ready and self.coach_watcher.ready and self.session_saver.ready:
+            if all(component.ready for component in self.components.values()):
                 break
             time.sleep(1)
 
@@ -96,9 +206,8 @@ class Crew:
                     logging.error(f"Thread {t} died")
                     break
 
-        self.mqtt.stop()
-        self.coach_watcher.stop()
-        self.session_saver.stop()
+        for component in self.components.values():
+            component.stop()
 
         for t in threads:
             logging.debug(f"joining Thread {t}")
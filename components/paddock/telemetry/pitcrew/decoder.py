@@ -0,0 +1,48 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Decoder:
+    """Decode the telemetry of CrewChief MQTT payloads.
+
+    Uses orjson if it is installed and falls back to the json module of the stdlib.
+    If fields are given, only these keys of the telemetry are kept. The firehose only
+    needs a handful of fields for lap detection, no need to keep the rest around while
+    the message is queued or sent to another process.
+    If full_telemetry is given, it is called with the topic and the projection is skipped
+    for topics it returns True for.
+    """
+
+    BACKEND_JSON = "json"
+    BACKEND_ORJSON = "orjson"
+
+    def __init__(self, fields=None, backend=None, full_telemetry=None):
+        self.fields = tuple(fields) if fields else None
+        self.full_telemetry = full_telemetry
+        if backend is None:
+            backend = self.BACKEND_ORJSON if orjson else self.BACKEND_JSON
+
+        if backend == self.BACKEND_ORJSON:
+            if not orjson:
+                raise ValueError("orjson is not installed")
+            self._loads = orjson.loads
+        elif backend == self.BACKEND_JSON:
+            self._loads = json.loads
+        else:
+            raise ValueError(f"unknown backend {backend}")
+        self.backend = backend
+
+    def decode(self, payload: bytes, topic=None):
+        telemetry = self._loads(payload).get("telemetry")
+        if topic and self.full_telemetry and self.full_telemetry(topic):
+            return telemetry
+        return self.project(telemetry)
+
+    def project(self, telemetry):
+        if self.fields and telemetry:
+            return {field: telemetry[field] for field in self.fields if field in telemetry}
+        return telemetry
@@ -0,0 +1,137 @@
+import logging
+import threading
+from collections import deque
+
+from .decoder import Decoder
+
+
+def driver_name(topic):
+    frags = topic.split("/")
+    if len(frags) < 2:
+        return None
+    return frags[1]
+
+
+class CoachQueue:
+    """The telemetry of a coached driver waiting for the coach.
+
+    The fanout runs on the ingest thread, it only puts the telemetry into
+    the queue of the coach. The coach gets it on the worker the queue runs
+    on, like a History: a thread, the CoachScheduler or an asyncio task.
+    One slow coach doesn't hold up the telemetry of the other drivers. When
+    the coach falls behind, the oldest telemetry is dropped.
+    """
+
+    def __init__(self, fanout, coach, driver_name, max_size=600):
+        self.fanout = fanout
+        self.coach = coach
+        # the scheduler logs errors with the session_id
+        self.session_id = driver_name
+        self.queue = deque(maxlen=max_size)
+        self.do_run = True
+        self.threaded = False
+        self._wakeup_event = threading.Event()
+        # called on wakeup, lets an event loop schedule the work
+        self.wakeup_callback = None
+
+    def notify(self, topic, payload, now=None):
+        if len(self.queue) == self.queue.maxlen:
+            self.fanout.dropped += 1
+        self.queue.append((topic, payload, now))
+        self.wakeup()
+
+    def disconnect(self):
+        self.do_run = False
+        self.wakeup()
+
+    def wakeup(self):
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
+
+    def run(self):
+        self.threaded = True
+        while self.do_run:
+            self._wakeup_event.wait(timeout=1)
+            self._wakeup_event.clear()
+            self.step()
+
+    def step(self):
+        while self.queue and self.do_run:
+            topic, payload, now = self.queue.popleft()
+            self.fanout.notify_coach(self.coach, topic, payload, now)
+
+
+class Fanout:
+    """Dispatch the telemetry of the crew's crewchief/# subscription.
+
+    Every message is passed on to the firehose. If a coach is registered for the driver
+    of the topic, the coach gets the telemetry as well and its responses are published
+    through the shared MQTT client. Adding coaches doesn't add connections. Coaches
+    running in this process are registered with a CoachQueue, they don't run on the
+    ingest thread.
+
+    The decoder keeps only the firehose fields, except for topics of coached drivers,
+    which need the full telemetry.
+    """
+
+    def __init__(self, firehose, fields=None):
+        self.firehose = firehose
+        self.decoder = Decoder(fields=fields, full_telemetry=self.has_coach)
+        self.coaches = {}
+        # set to the publish method of the MQTT client
+        self.publish = None
+        self.responses = 0
+        self.errors = 0
+        # telemetry dropped by the queues of coaches that fell behind
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def register(self, driver_name, coach):
+        with self._lock:
+            self.coaches[driver_name] = coach
+
+    def unregister(self, driver_name):
+        with self._lock:
+            self.coaches.pop(driver_name, None)
+
+    def has_coach(self, topic):
+        return driver_name(topic) in self.coaches
+
+    def notify(self, topic, payload, now=None):
+        coach = self.coaches.get(driver_name(topic))
+        if coach is None:
+            self.firehose.notify(topic, payload, now)
+            return
+
+        self.firehose.notify(topic, self.decoder.project(payload), now)
+        self.notify_coach(coach, topic, payload, now)
+
+    def notify_coach(self, coach, topic, payload, now=None):
+        try:
+            response = coach.notify(topic, payload, now)
+        except Exception as e:
+            self.errors += 1
+            logging.exception(f"{topic}: Error in coach: {e}")
+            return
+
+        if response:
+            (r_topic, r_payload) = response
+            payloads = r_payload
+            if not isinstance(r_payload, list):
+                payloads = [r_payload]
+
+            for r_payload in payloads:
+                meters = payload.get("DistanceRoundTrack", 0)
+                logging.debug("r-->: %s: %s : %s", meters, r_topic, r_payload)
+                self.responses += 1
+                if self.publish:
+                    self.publish(r_topic, r_payload)
+
+    def metrics(self):
+        return {
+            "pitcrew_fanout_coaches": len(self.coaches),
+            "pitcrew_fanout_responses_total": self.responses,
+            "pitcrew_fanout_errors_total": self.errors,
+            "pitcrew_fanout_dropped_total": self.dropped,
+        }
@@ -0,0 +1,116 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from telemetry.models import FastLap
+
+from .lookup_table import LookupTable
+
+
+def _frame_bytes(df):
+    if isinstance(df, pd.DataFrame):
+        return int(df.memory_usage(deep=True).sum())
+    return 0
+
+
+class FastLapReference:
+    """The fast lap of a game, track and car, as loaded from the database.
+
+    The segments are templates, they are never handed out. Every History
+    gets copies sharing the features of the fast lap, with live data of
+    their own.
+    """
+
+    def __init__(self, fast_lap, track_length):
+        self.fast_lap = fast_lap
+        self.track_length = track_length
+        self.version = (fast_lap.pk, fast_lap.modified, track_length)
+        self.segments = fast_lap.data["segments"]
+        self.lookup_table = LookupTable(fast_lap.data.get("distance_time"), track_length)
+        self.size = self.approx_size()
+
+    def approx_size(self):
+        size = _frame_bytes(self.fast_lap.data.get("distance_time"))
+        size += sum(_frame_bytes(getattr(segment, "telemetry", None)) for segment in self.segments)
+        size += self.lookup_table.nbytes()
+        return size
+
+    def segments_for(self, history, depth=None):
+        segments = [segment.copy_for(history, depth=depth) for segment in self.segments]
+        for i, segment in enumerate(segments):
+            segment.previous_segment = segments[(i - 1) % len(segments)]
+            segment.next_segment = segments[(i + 1) % len(segments)]
+        return segments
+
+
+class FastLapCache:
+    """Process wide cache of the fast laps the coaches compare drivers to.
+
+    Every session start used to load and unpickle the fast lap and build its
+    lookup tables. The cache keeps one FastLapReference per game, track and
+    car. A start only asks the database for the id and modification time of
+    the fast lap, so a fast lap saved by manage.py analyze in another process
+    is picked up by the next session. The least recently used references
+    are evicted once there are more than max_size or they take more than
+    max_bytes.
+    """
+
+    def __init__(self, max_size=64, max_bytes=512 * 1024 * 1024):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        # (game pk, track pk, car pk) -> FastLapReference
+        self._references = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, game, track, car, track_length):
+        """The reference of the combo, None if there is no fast lap with segments."""
+        key = (game.pk, track.pk, car.pk)
+        fast_laps = FastLap.objects.filter(game=game, track=track, car=car, driver=None)
+        version = fast_laps.values_list("pk", "modified").first()
+        if version is None:
+            return None
+
+        with self._lock:
+            reference = self._references.get(key)
+            if reference and reference.version == (*version, track_length):
+                self._references.move_to_end(key)
+                self.hits += 1
+                return reference
+            self.misses += 1
+
+        fast_lap = fast_laps.filter(pk=version[0]).first()
+        if not fast_lap or not fast_lap.data or not fast_lap.data.get("segments"):
+            return None
+        logging.debug(f"loading fast lap {fast_lap} based on {fast_lap.laps.count()} laps")
+        reference = FastLapReference(fast_lap, track_length)
+
+        with self._lock:
+            self._references[key] = reference
+            self._references.move_to_end(key)
+            while len(self._references) > 1 and (
+                len(self._references) > self.max_size or self.bytes() > self.max_bytes
+            ):
+                self._references.popitem(last=False)
+        return reference
+
+    def bytes(self):
+        return sum(reference.size for reference in list(self._references.values()))
+
+    def clear(self):
+        with self._lock:
+            self._references.clear()
+
+    def metrics(self):
+        return {
+            "pitcrew_fast_lap_cache_hits_total": self.hits,
+            "pitcrew_fast_lap_cache_misses_total": self.misses,
+            "pitcrew_fast_lap_cache_references": len(self._references),
+            "pitcrew_fast_lap_cache_bytes": self.bytes(),
+        }
+
+
+fast_laps = FastLapCache()
@@ -0,0 +1,138 @@
+import statistics
+
+import numpy as np
+from scipy.stats import zscore
+
+
+class FeatureStats:
+    """Mean, variance and the mean without outliers of the values of a feature."""
+
+    def __init__(self, values, threshold=1, version=0):
+        # the version of the FeatureHistory the values were read from
+        self.version = version
+        self.values = values
+        self.count = len(values)
+        self.mean = None
+        self.variance = None
+        self.values_clean = []
+        # the mean without outliers, the first value if they all are outliers
+        self.avg = None
+        if not values:
+            return
+
+        self.mean = np.mean(values)
+        self.variance = np.var(values)
+        # 1. Using Z-score to remove outliers
+        z_scores = zscore(values)
+        self.values_clean = [x for x, z in zip(values, z_scores) if abs(z) < threshold]
+        if self.values_clean:
+            self.avg = statistics.mean(self.values_clean)
+        else:
+            # if values_clean is empty, either all values are the same or there is only one value
+            self.avg = values[0]
+
+
+class FeatureHistory:
+    """The last depth feature sets of a segment, oldest first.
+
+    A ring of feature dicts that reads like a list. Appending to a full ring
+    drops the oldest feature set, a segment keeps the same memory over a long
+    stint. The numeric features are also written into one array per feature
+    when a feature set is added, NaN where it is missing or 0, so the values
+    of a feature are read without going through the dicts.
+    """
+
+    def __init__(self, depth=20, features=()):
+        self.depth = depth
+        self.items = [None] * depth
+        # slot of the oldest feature set
+        self.start = 0
+        self.size = 0
+        # feature -> value in every slot
+        self.columns = {}
+        # incremented on every append, the statistics of older versions are stale
+        self.version = 0
+        # (feature, n) -> FeatureStats
+        self.statistics = {}
+        for feature_set in features:
+            self.append(feature_set)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("feature history index out of range")
+        return self.items[(self.start + index) % self.depth]
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.items[(self.start + index) % self.depth]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"FeatureHistory({list(self)!r})"
+
+    def append(self, features):
+        if self.size == self.depth:
+            slot = self.start
+            self.start = (self.start + 1) % self.depth
+        else:
+            slot = (self.start + self.size) % self.depth
+            self.size += 1
+        self.items[slot] = features
+
+        for column in self.columns.values():
+            column[slot] = np.nan
+        for feature, value in features.items():
+            if isinstance(value, (int, float, np.integer)) and not isinstance(value, bool):
+                if feature not in self.columns:
+                    self.columns[feature] = np.full(self.depth, np.nan)
+                self.columns[feature][slot] = value if value else np.nan
+        self.version += 1
+
+    def values(self, feature, n=0):
+        """The last n values of a feature that are set, newest first, all of them if n is 0.
+
+        The oldest feature set is never looked at. If there are less than n
+        values, there are none.
+        """
+        if n and self.size <= n:
+            return []
+
+        values = []
+        for i in range(-1, -self.size, -1):
+            value = self[i].get(feature)
+            if value and value is not None:
+                values.append(value)
+            if n and len(values) == n:
+                break
+
+        if n and len(values) < n:
+            return []
+        return values
+
+    def has_stats(self, feature, n=0):
+        stats = self.statistics.get((feature, n))
+        return stats is not None and stats.version == self.version
+
+    def stats(self, feature, n=0):
+        """The FeatureStats of values(feature, n), computed once per append."""
+        if not self.has_stats(feature, n):
+            self.statistics[(feature, n)] = FeatureStats(self.values(feature, n=n), version=self.version)
+        return self.statistics[(feature, n)]
+
+    def column(self, feature):
+        """The values of a numeric feature, newest first, NaN where it is not set.
+
+        Like values, the oldest feature set is left out.
+        """
+        column = self.columns.get(feature)
+        if column is None or self.size < 2:
+            return np.empty(0)
+        slots = (self.start + np.arange(self.size - 1, 0, -1)) % self.depth
+        return column[slots]
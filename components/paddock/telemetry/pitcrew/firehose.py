@@ -1,78 +1,163 @@
 import logging
+import threading
+from collections import OrderedDict
 
 import django.utils.timezone
 
+from .lap_detection import detect_laps, detect_laps_rbr
 from .session import Session
 from .session_rbr import SessionRbr
 
 
 class Firehose:
-    def __init__(self, debug=False):
+    TELEMETRY_FIELDS = Session.TELEMETRY_FIELDS + ("CarClass",)
+
+    def __init__(self, debug=False, session_ttl=600, max_sessions=1000):
         self.debug = debug
-        self.sessions = {}
+        # seconds without telemetry after which a session is deleted
+        self.session_ttl = session_ttl
+        # hard cap on live sessions, the least recently updated session is evicted
+        self.max_sessions = max_sessions
+        # ordered by last update, least recently updated first
+        self.sessions = OrderedDict()
+        self.evicted_sessions = 0
+        # time of the latest telemetry, replays run on their own clock
+        self.latest_update = None
+        # passed on to new sessions, see Session.event_callback
+        self.event_callback = None
+        self._lock = threading.Lock()
 
     def notify(self, topic, payload, now=None):
         now = now or django.utils.timezone.now()
-        if topic not in self.sessions:
-            try:
-                (
-                    prefix,
-                    driver,
-                    session_id,
-                    game,
-                    track,
-                    car,
-                    session_type,
-                ) = topic.split("/")
-            except ValueError:
-                # ignore invalid session
-                return
-
-            if game == "Richard Burns Rally":
-                session = SessionRbr(topic, start=now)
+        with self._lock:
+            if self.latest_update is None or now > self.latest_update:
+                self.latest_update = now
+            session = self.sessions.get(topic)
+            if session:
+                self.sessions.move_to_end(topic)
             else:
-                session = Session(topic, start=now)
-
-            session.driver = driver
-            session.session_id = session_id
-            logging.debug(f"New session: {topic}")
-            session.game_name = game
-            session.track = track
-            session.car = car
-            session.car_class = payload.get("CarClass", "")
-            session.session_type = session_type
-            self.sessions[topic] = session
-
-        session = self.sessions[topic]
+                session = self.new_session(topic, payload, now)
+                if not session:
+                    return
+
         session.signal(payload, now)
 
-    # TODO: clear sessions every now and then
-    def clear_sessions(self, now):
+    def new_session(self, topic, payload, now):
+        try:
+            (
+                prefix,
+                driver,
+                session_id,
+                game,
+                track,
+                car,
+                session_type,
+            ) = topic.split("/")
+        except ValueError:
+            # ignore invalid session
+            return
+
+        if game == "Richard Burns Rally":
+            session = SessionRbr(topic, start=now)
+        else:
+            session = Session(topic, start=now)
+
+        session.driver = driver
+        session.session_id = session_id
+        logging.debug(f"New session: {topic}")
+        session.game_name = game
+        session.track = track
+        session.car = car
+        session.car_class = payload.get("CarClass", "")
+        session.session_type = session_type
+        session.event_callback = self.event_callback
+
+        while len(self.sessions) >= self.max_sessions:
+            evicted_topic, evicted_session = self.sessions.popitem(last=False)
+            self.evicted_sessions += 1
+            unsaved = len(evicted_session.unsaved_laps())
+            if unsaved and evicted_session.event_callback:
+                # the session saver still gets the session through the event
+                logging.warning(f"{evicted_topic}\n\t evicting session, max_sessions reached, saving {unsaved} laps")
+                evicted_session.emit(Session.SESSION_EVICTED)
+            else:
+                logging.warning(f"{evicted_topic}\n\t evicting session, max_sessions reached, {unsaved} laps not saved")
+
+        self.sessions[topic] = session
+        session.emit(Session.SESSION_STARTED)
+        return session
+
+    def add_session_df(self, topic, df):
+        """Add a recorded session at once, for backfills.
+
+        The laps are found by the vectorized lap detection instead of feeding
+        the rows one by one through Session.analyze.
+        """
+        if df.empty:
+            return
+        start = df["_time"].iloc[0]
+        payload = {"CarClass": df["CarClass"].iloc[0] if "CarClass" in df.columns else ""}
+        with self._lock:
+            session = self.sessions.get(topic) or self.new_session(topic, payload, start)
+        if not session:
+            return
+
+        if isinstance(session, SessionRbr):
+            session.laps = detect_laps_rbr(df)
+        else:
+            session.laps = detect_laps(df)
+        laps = list(session.laps.values())
+        session.current_lap = laps[-1] if laps else None
+        session.previous_lap = laps[-2] if len(laps) > 1 else None
+        session.end = df["_time"].iloc[-1]
+        if self.latest_update is None or session.end > self.latest_update:
+            self.latest_update = session.end
+        for lap in laps:
+            if lap.finished:
+                session.emit(Session.LAP_FINISHED, lap)
+
+    def clear_sessions(self, now=None):
         """Clear inactive telemetry sessions.
 
         Loops through all sessions and deletes:
-        - Any session inactive for more than 10 minutes
-        - Any lap marked for deletion
+        - Any session inactive for more than session_ttl seconds
+        - Any lap that is persisted, except the current and previous lap,
+          which the lap detection still needs
 
         Args:
-            now (datetime): The current datetime
+            now (datetime): The current datetime, defaults to the time of the latest telemetry
 
         """
+        now = now or self.latest_update
+        if now is None:
+            return
 
         delete_sessions = []
-        for topic, session in self.sessions.items():
-            # Delete session without updates for 10 minutes
-            if (now - session["end"]).seconds > 600:
+        for topic, session in list(self.sessions.items()):
+            # Delete session without updates for session_ttl seconds
+            if (now - session.end).total_seconds() > self.session_ttl:
                 delete_sessions.append(topic)
+                continue
 
-            # Delete any lap marked for deletion
-            for i in range(len(session["laps"]) - 1, -1, -1):
-                lap = session["laps"][i]
-                if lap.get("delete", False):
-                    logging.debug(f"{topic}\n\t deleting lap {lap['number']}")
-                    del session["laps"][i]
+            for lap_number, lap in list(session.laps.items()):
+                if lap.persisted and lap is not session.current_lap and lap is not session.previous_lap:
+                    logging.debug(f"{topic}\n\t deleting lap {lap_number}")
+                    session.laps.pop(lap_number, None)
 
         # Delete all inactive sessions
-        for topic in delete_sessions:
-            del self.sessions[topic]
-            logging.debug(f"{topic}\n\t deleting inactive session")
+        with self._lock:
+            for topic in delete_sessions:
+                session = self.sessions.get(topic)
+                if session and (now - session.end).total_seconds() > self.session_ttl:
+                    del self.sessions[topic]
+                    unsaved = len(session.unsaved_laps())
+                    logging.debug(f"{topic}\n\t deleting inactive session, {unsaved} laps not saved")
+
+    def metrics(self):
+        sessions = list(self.sessions.values())
+        return {
+            "pitcrew_firehose_sessions": len(sessions),
+            "pitcrew_firehose_laps": sum(len(session.laps) for session in sessions),
+            "pitcrew_firehose_bytes": sum(session.approx_size() for session in sessions),
+            "pitcrew_firehose_evicted_sessions_total": self.evicted_sessions,
+        }
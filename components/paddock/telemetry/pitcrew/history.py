@@ -1,14 +1,17 @@
-import time
+import threading
 
 import numpy as np
 import pandas as pd
-from scipy.interpolate import interp1d
 
 from telemetry.analyzer import Analyzer
+from telemetry.dimensions import dimensions
 from telemetry.fast_lap_analyzer import FastLapAnalyzer
-from telemetry.models import Coach, Driver, FastLap, Game
+from telemetry.models import Coach
+from telemetry.pitcrew import segment_features
+from telemetry.pitcrew.fast_lap_cache import fast_laps
+from telemetry.pitcrew.live_features import LiveFeatureStore
 from telemetry.pitcrew.logging_mixin import LoggingMixin
-from telemetry.pitcrew.segment import Segment
+from telemetry.pitcrew.telemetry_buffer import TelemetryBuffer
 from telemetry.racing_stats import RacingStats
 
 
@@ -16,34 +19,64 @@ class History(LoggingMixin):
     def __init__(self):
         self._do_init = False
         self.segments = []
+        # index of the segment the driver is in
+        self.current_segment = 0
+        # meters -> index of the segment, -1 for meters outside of all segments
+        self.segment_index = np.full(0, -1, dtype=np.int32)
+        # the segment wrapping around the finish line also covers the meters outside of segment_index
+        self.wrap_segment = -1
         self.previous_update_meters = 0
         self._ready = False
         self._error = None
         self.do_run = True
         self.driver = None
         self.track_length = 0
-        self.telemetry = []
+        # the telemetry of the current segment
+        self.telemetry = TelemetryBuffer()
         self.analyzer = Analyzer()
         self.fast_lap_analyzer = FastLapAnalyzer()
         self.racing_stats = RacingStats()
         self.fast_lap = None
+        self.lookup_table = None
+        # the live features of the driver, the last driver_laps laps are loaded
+        self.live_features = None
+        self.driver_laps = 10
+        # the number of laps a segment keeps its live data for
+        self.segment_depth = 20
         self.process_segments = []
         self.threaded = False
         self.session_id = "NO_SESSION"
         self.coach_mode = Coach.MODE_DEFAULT
+        # set when there is something to do, the worker doesn't need to poll
+        self._wakeup_event = threading.Event()
+        # called on wakeup, lets an event loop schedule the work
+        self.wakeup_callback = None
 
     def disconnect(self):
         self.do_run = False
+        # the scheduler does not step a disconnected History, write the live features here
+        if self.live_features:
+            self.live_features.close()
+        self.wakeup()
+
+    def wakeup(self):
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
 
     def run(self):
         self.threaded = True
         while self.do_run:
-            time.sleep(0.1)
-            if self._ready:
-                self.do_work()
-            if self._do_init:
-                self.init()
-                self._do_init = False
+            self._wakeup_event.wait(timeout=1)
+            self._wakeup_event.clear()
+            self.step()
+
+    def step(self):
+        if self._ready:
+            self.do_work()
+        if self._do_init:
+            self.init()
+            self._do_init = False
 
     def set_filter(self, filter, coach_mode=Coach.MODE_DEFAULT):
         self._ready = False
@@ -51,6 +84,7 @@ class History(LoggingMixin):
         self.session_id = filter.get("SessionId", "NO_SESSION")
         self.coach_mode = coach_mode
         self._do_init = True
+        self.wakeup()
 
     def set_coach_mode(self, coach_mode):
         self.coach_mode = coach_mode
@@ -71,13 +105,14 @@ class History(LoggingMixin):
         self._ready = False
         self._error = None
         self.process_segments = []
-        self.telemetry = []
+        self.telemetry.clear()
+        self.flush_live_features()
 
         try:
-            self.driver = Driver.objects.get(name=self.filter["Driver"])
-            self.game = Game.objects.get(name=self.filter["GameName"])
-            self.car = self.game.cars.get(name=self.filter["CarModel"])
-            self.track = self.game.tracks.get(name=self.filter["TrackCode"])
+            self.driver = dimensions.driver(self.filter["Driver"])
+            self.game = dimensions.game(self.filter["GameName"])
+            self.car = dimensions.car(self.game, self.filter["CarModel"])
+            self.track = dimensions.track(self.game, self.filter["TrackCode"])
             self.track_length = self.track.length
         except Exception as e:
             error = f"Error init {self.filter['Driver']} / {self.filter['GameName']}"
@@ -92,9 +127,9 @@ class History(LoggingMixin):
                 return True
 
     def init_segments(self) -> bool:
-        """Load the segments from DB."""
-        fast_lap = FastLap.objects.filter(track=self.track, car=self.car, game=self.game).first()
-        if not fast_lap or not fast_lap.data or not fast_lap.data.get("segments"):
+        """Get the segments of the fast lap, shared with the other coaches on it."""
+        reference = fast_laps.get(self.game, self.track, self.car, self.track_length)
+        if not reference:
             error = f"no data found for game {self.filter['GameName']}"
             error += f" on track {self.filter['TrackCode']}"
             error += f" in car {self.filter['CarModel']}"
@@ -103,87 +138,91 @@ class History(LoggingMixin):
             return False
 
         self.log_debug("loading segments for %s %s - %s", self.game, self.track, self.car)
-        self.log_debug(f"  based on laps {fast_lap.laps.count()}")
-
-        self.segments = fast_lap.data.get("segments")
-
-        for i, segment in enumerate(self.segments):
-            next_index = (i + 1) % len(self.segments)
-            previous_index = (i - 1) % len(self.segments)
-            segment.previous_segment = self.segments[previous_index]
-            segment.next_segment = self.segments[next_index]
-            segment.history = self
-
-        self.fast_lap = fast_lap
-
-        self.build_lookup_tables()
+        self.segments = reference.segments_for(self, depth=self.segment_depth)
+        self.fast_lap = reference.fast_lap
+        self.lookup_table = reference.lookup_table
+        self.build_segment_index()
 
         # self.log_debug("loaded %s segments", len(self.segments))
         return True
 
     def init_driver(self):
-        self.driver_fast_lap, created = FastLap.objects.get_or_create(
-            car=self.car, track=self.track, game=self.game, driver=self.driver
-        )
+        self.live_features = LiveFeatureStore(self.driver, self.game, self.car, self.track, self.session_id)
+        if self.coach_mode == Coach.MODE_TRACK_GUIDE:
+            return True
 
-        driver_data = self.driver_fast_lap.data
-        if not driver_data:
-            segments = {}
-            for segment in self.segments:
-                driver_segment = Segment()
-                driver_segment.copy_from(segment)
-                segments[segment.turn] = driver_segment
-            driver_data = {
-                "segments": segments,
-            }
+        driver_segments = self.live_features.load(laps=self.driver_laps)
+        if not driver_segments:
             self.log_debug("no driver data found")
-            self.driver_fast_lap.data = driver_data
-
-        driver_segments = self.driver_fast_lap.data.get("segments", {})
-        empty_segment = Segment()
         for segment in self.segments:
-            driver_segment = driver_segments.get(segment.turn, empty_segment)
-            if self.coach_mode != Coach.MODE_TRACK_GUIDE:
-                segment.init_live_features_from_segment(driver_segment)
+            segment.init_live_features(driver_segments.get(segment.turn, {}))
 
         return True
 
+    def flush_live_features(self):
+        if self.live_features:
+            self.live_features.flush()
+
     def update(self, time, telemetry):
         meters = int(telemetry["DistanceRoundTrack"])
         if meters != self.previous_update_meters:
-            data = telemetry
-            data["_time"] = time
-            return self.update_telemetry(meters, data)
-
-    def update_telemetry(self, meters, data, depth=0):
-        if depth > len(self.segments):
-            self.log_debug(f"update_telemetry: meters: {meters} no segment found")
+            return self.update_telemetry(meters, time, telemetry)
+
+    def build_segment_index(self):
+        """Map every meter of the track to the index of its segment."""
+        self.current_segment = 0
+        self.wrap_segment = -1
+        length = max([max(segment.start, segment.end) for segment in self.segments], default=-1) + 1
+        self.segment_index = np.full(length, -1, dtype=np.int32)
+        # where segments overlap, the first one wins
+        for i, segment in reversed(list(enumerate(self.segments))):
+            if segment.start < segment.end:
+                self.segment_index[max(segment.start, 0) : segment.end + 1] = i
+            else:
+                self.segment_index[max(segment.start, 0) :] = i
+                self.segment_index[: max(segment.end + 1, 0)] = i
+                self.wrap_segment = i
+
+    def segment_at(self, meters):
+        """The index of the segment at meters, -1 if there is none."""
+        if 0 <= meters < len(self.segment_index):
+            return int(self.segment_index[meters])
+        return self.wrap_segment
+
+    def in_segment(self, segment, meters):
+        if segment.start < segment.end:
+            return segment.start <= meters <= segment.end
+        return meters >= segment.start or meters <= segment.end
+
+    def update_telemetry(self, meters, time, telemetry):
+        if not self.segments:
             return
 
-        segment = self.segments[0]
-        start = segment.start
-        end = segment.end
+        # the driver mostly stays in the current segment
+        segment = self.segments[self.current_segment]
+        if self.in_segment(segment, meters):
+            self.telemetry.append(time, telemetry)
+            self.previous_update_meters = meters
+            return
 
-        if start < end:
-            in_segment = start <= meters <= end
-        else:
-            in_segment = meters >= start or meters <= end
+        work_to_do = False
+        if len(self.telemetry) > 0:
+            segment.live_telemetry.append(self.telemetry.finish())
+            self.process_segments.append(segment)
+            work_to_do = True
+            if self.threaded:
+                self.wakeup()
 
-        if in_segment:
-            self.telemetry.append(data)
-            self.previous_update_meters = meters
-        else:
-            work_to_do = False
-            if len(self.telemetry) > 0:
-                segment.live_telemetry.append(self.telemetry)
-                self.process_segments.append(segment)
-                self.telemetry = []
-                work_to_do = True
-
-            self.segments.append(self.segments.pop(0))
-            self.update_telemetry(meters, data, depth + 1)
+        index = self.segment_at(meters)
+        if index < 0:
+            self.log_debug(f"update_telemetry: meters: {meters} no segment found")
             return work_to_do
 
+        self.current_segment = index
+        self.telemetry.append(time, telemetry)
+        self.previous_update_meters = meters
+        return work_to_do
+
     def do_work(self):
         # self.log_debug(f"do work")
         while len(self.process_segments) > 0:
@@ -193,22 +232,22 @@ class History(LoggingMixin):
                 self.log_error(f"{log_prefix} no telemetry for segment")
                 continue
 
-            telemetry = segment.live_telemetry.pop(0)
+            telemetry = segment.live_telemetry.popleft()
             if len(telemetry) == 0:
                 self.log_error(f"{log_prefix} no data in telemetry")
                 continue
 
-            # lap_number = telemetry[0].get("CurrentLap")
-            # self.log_debug(f"   lap: {lap_number}")
+            lap_number = telemetry["CurrentLap"][0]
+            lap_number = -1 if np.isnan(lap_number) else int(lap_number)
 
-            df = pd.DataFrame.from_records(telemetry)
-            df = self.fast_lap_analyzer.preprocess(df)
+            frame = self.fast_lap_analyzer.preprocess_frame(telemetry)
 
-            brake_features = self.fast_lap_analyzer.brake_features(df)
-            throttle_features = self.fast_lap_analyzer.throttle_features(df)
-            gear_features = self.fast_lap_analyzer.gear_features(df)
-            sector_time = self.analyzer.sector_time(df)
-            sector_lap_time = self.analyzer.sector_lap_time(df)
+            # the same features as the pandas implementations of the FastLapAnalyzer
+            brake_features = segment_features.brake_features(frame, brake_threshold=0.1)
+            throttle_features = segment_features.throttle_features(frame)
+            gear_features = segment_features.gear_features(frame)
+            sector_time = segment_features.sector_time(frame)
+            sector_lap_time = segment_features.sector_lap_time(frame)
             other_features = {
                 "sector_time": sector_time,
                 "sector_lap_time": sector_lap_time,
@@ -219,86 +258,42 @@ class History(LoggingMixin):
             segment.add_live_features(gear_features, type="gear")
             segment.add_live_features(other_features, type="other")
 
-            # FIXME: this produces a lot of large updates in the database
-            #        * refactor the DB design to store the data in a more efficient way
-            #        * store the data in a document database like MongoDB
-            driver_segment = self.driver_fast_lap.data["segments"][segment.turn]
-            driver_segment.add_live_features(brake_features, type="brake")
-            driver_segment.add_live_features(throttle_features, type="throttle")
-            driver_segment.add_live_features(gear_features, type="gear")
-            driver_segment.add_live_features(other_features, type="other")
-            self.driver_fast_lap.save()
-
-            segment.live_telemetry_frames.append(df)
-
-            self.log_debug(f"{log_prefix} driver delta: {segment.driver_delta()}")
-
-    def build_lookup_tables(self):
-        """Build lookup tables for fast lap data."""
-        df = self.fast_lap.data.get("distance_time")
-        # df is a pandas dataframe with CurrentLapTime, SpeedMs and DistanceRoundTrack as columns
-        # 1. round DistanceRoundTrack to integer
-        # 2. create a dictionary with DistanceRoundTrack as key and SpeedMs as value
-
-        min_distance = 0
-        max_distance = self.track_length
-        target_rows = max_distance + 1
-
-        new_distance_round_track = np.linspace(min_distance, max_distance, target_rows)
-        new_distance_round_track = np.round(new_distance_round_track, decimals=0).astype(int)
-
-        resampled_df = pd.DataFrame({"DistanceRoundTrack": new_distance_round_track})
-
-        for column in ["CurrentLapTime", "SpeedMs"]:
-            interp = interp1d(
-                df["DistanceRoundTrack"], df[column], kind="nearest", bounds_error=False, fill_value="extrapolate"
+            self.live_features.add(
+                segment.turn,
+                lap_number,
+                {
+                    "brake": brake_features,
+                    "throttle": throttle_features,
+                    "gear": gear_features,
+                    "other": other_features,
+                },
             )
-            interpolated_values = interp(new_distance_round_track)
-
-            if np.issubdtype(df[column].dtype, np.integer):
-                interpolated_values = np.round(interpolated_values).astype(int)
 
-            resampled_df[column] = interpolated_values
+            segment.add_live_telemetry_frame(frame)
 
-        df = resampled_df
-
-        # Create dictionary with DistanceRoundTrack as key and SpeedMs as value
-        self.map_distance_speed = dict(zip(df["DistanceRoundTrack"], df["SpeedMs"]))
-        # Create dictionary with DistanceRoundTrack as key and CurrentLapTime as value
-        self.map_distance_time = dict(zip(df["DistanceRoundTrack"], df["CurrentLapTime"]))
-        # Create dictionary with CurrentLapTime as key and DistanceRoundTrack as value
-        self.map_time_distance = dict(zip(df["CurrentLapTime"], df["DistanceRoundTrack"]))
-        self.map_time_distance_max = max(self.map_time_distance.keys())
+            self.log_debug(f"{log_prefix} driver delta: {segment.driver_delta()}")
 
     def lap_time_at_distance(self, distance):
-        lap_time = self.map_distance_time.get(distance, 0.0)
+        lap_time = self.lookup_table.lap_time_at(distance)
         if lap_time == 0.0:
-            self.log_error(f"no lap_time at {distance} - map: {self.map_distance_time}")
+            self.log_error(f"no lap_time at {distance}")
         return lap_time
 
     def speed_at_distance(self, distance):
-        speed = self.map_distance_speed.get(distance, 0.0)
+        speed = self.lookup_table.speed_at(distance)
         if speed == 0.0:
-            self.log_error(f"no speed at {distance} - map: {self.map_distance_speed}")
+            self.log_error(f"no speed at {distance}")
         return speed
 
     def distance_at_lap_time(self, lap_time):
-        distance = self.map_time_distance.get(lap_time, None)
-        if distance is None:
-            keys = self.map_time_distance.keys()
-            # get the closest key
-            # FIXME: this is probably too expensive, maybe have multiple lookup tables,
-            #        with different resolutions, 3 decimals, 2 decimals, 1 decimal, integer
-            closest_key = min(keys, key=lambda x: abs(x - lap_time))
-            distance = self.map_time_distance[closest_key]
-        return distance
+        return self.lookup_table.distance_at(lap_time)
 
     def distance_add(self, distance, meters):
         return (distance + meters) % self.track_length
 
     def distance_add_seconds(self, distance, seconds):
         time_at_distance = self.lap_time_at_distance(distance)
-        target_time = (time_at_distance + seconds) % self.map_time_distance_max
+        target_time = (time_at_distance + seconds) % self.lookup_table.max_lap_time
         return self.distance_at_lap_time(target_time)
 
     def offset_distance(self, distance, seconds=0.0):
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import django.utils.timezone
+
+
+class Ingest:
+    """Decouple receiving telemetry from processing it.
+
+    The MQTT network thread only appends messages to a bounded queue per topic,
+    a worker thread drains the queues in batches and notifies the observer.
+    If the observer falls behind, messages are dropped according to the drop policy:
+
+    - DROP_OLDEST: the oldest queued message of the topic is dropped for every new one
+    - KEEP_LATEST: the whole backlog of the topic is dropped, only the newest message is kept
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    KEEP_LATEST = "keep_latest"
+    DROP_POLICIES = [DROP_OLDEST, KEEP_LATEST]
+
+    def __init__(self, observer, max_queue_size=600, batch_size=100, drop_policy=DROP_OLDEST):
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"unknown drop policy {drop_policy}")
+
+        self.observer = observer
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.drop_policy = drop_policy
+        self.stats_interval = 60
+
+        self.queues = {}
+        self.queued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._wakeup_event = threading.Event()
+        # called on wakeup, lets an event loop schedule the work
+        self.wakeup_callback = None
+        self._stop_event = threading.Event()
+        self.ready = False
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def notify(self, topic, payload, now=None):
+        # timestamp the message on arrival, it might be processed a bit later
+        now = now or django.utils.timezone.now()
+        with self._lock:
+            queue = self.queues.get(topic)
+            if queue is None:
+                queue = deque()
+                self.queues[topic] = queue
+
+            if len(queue) >= self.max_queue_size:
+                if self.drop_policy == self.KEEP_LATEST:
+                    self.dropped += len(queue)
+                    queue.clear()
+                else:
+                    queue.popleft()
+                    self.dropped += 1
+
+            queue.append((payload, now))
+            self.queued += 1
+
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def next_batch(self):
+        """Take up to batch_size messages, spread fairly over all topics.
+
+        Messages of one topic stay in order, since there is only one worker.
+        """
+        batch = []
+        with self._lock:
+            if not self.queues:
+                return batch
+
+            per_topic = max(1, self.batch_size // len(self.queues))
+            for topic in list(self.queues.keys()):
+                queue = self.queues[topic]
+                for _ in range(min(per_topic, len(queue))):
+                    payload, now = queue.popleft()
+                    batch.append((topic, payload, now))
+                if not queue:
+                    # drop empty queues, topics come and go with sessions
+                    del self.queues[topic]
+                if len(batch) >= self.batch_size:
+                    break
+
+        return batch
+
+    def process(self, batch):
+        for topic, payload, now in batch:
+            try:
+                self.observer.notify(topic, payload, now)
+            except Exception as e:
+                self.errors += 1
+                logging.exception(f"{topic}: Error processing message: {e}")
+            self.processed += 1
+
+    def drain(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+            self.process(batch)
+
+    def log_stats(self):
+        logging.info(
+            f"ingest: queued {self.queued} processed {self.processed} dropped {self.dropped} "
+            + f"errors {self.errors} depth {self.queue_depth()}"
+        )
+
+    def metrics(self):
+        return {
+            "pitcrew_ingest_queued_total": self.queued,
+            "pitcrew_ingest_processed_total": self.processed,
+            "pitcrew_ingest_dropped_total": self.dropped,
+            "pitcrew_ingest_errors_total": self.errors,
+            "pitcrew_ingest_queue_depth": self.queue_depth(),
+        }
+
+    def run(self):
+        self.ready = True
+        next_stats = time.monotonic() + self.stats_interval
+        while not self.stopped():
+            self._wakeup_event.wait(timeout=1)
+            self._wakeup_event.clear()
+            self.drain()
+
+            if time.monotonic() > next_stats:
+                self.log_stats()
+                next_stats = time.monotonic() + self.stats_interval
+
+        # process whatever was received before we got stopped
+        self.drain()
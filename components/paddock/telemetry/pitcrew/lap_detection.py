@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+from .session import Lap, Session
+
+RBR_TELEMETRY_FIELDS = ("DistanceRoundTrack", "CurrentLap", "CurrentLapTime")
+
+
+def _value(column, row):
+    """The value of a row as the streaming lap detection sees it, NaN becomes None like a JSON null."""
+    value = column.iat[row]
+    return None if pd.isna(value) else value
+
+
+def _shift(values, first):
+    """The previous value of every row, first for the first row."""
+    shifted = np.empty_like(values)
+    shifted[0] = first
+    shifted[1:] = values[:-1]
+    return shifted
+
+
+def _run_lengths(flags):
+    """Number of consecutive True values up to and including every row."""
+    counts = np.cumsum(flags)
+    resets = np.maximum.accumulate(np.where(flags, 0, counts))
+    return counts - resets
+
+
+def _longest(column, rows, distance, start, end):
+    """The largest distance of the rows, -1 if there is none, like Lap.length."""
+    longest = start + distance[start:end].argmax()
+    return _value(column, rows[longest]) if distance[longest] > -1 else -1
+
+
+def valid_rows(df, fields, required):
+    """The positions of the rows the streaming lap detection doesn't skip."""
+    if df.empty or any(field not in df.columns for field in fields):
+        return None
+    mask = np.ones(len(df), dtype=bool)
+    for field in required:
+        mask &= df[field].notna().to_numpy()
+    return np.flatnonzero(mask)
+
+
+def detect_laps(df):
+    """Find the laps of a whole session at once, with the same result as Session.analyze.
+
+    The DataFrame holds the telemetry of one session sorted by _time, like the
+    dataframes returned by Influx.session_df. Returns a dict of lap number -> Lap,
+    in the order the laps were started.
+    """
+    # Session.analyze skips rows without these values, LapTimePrevious and PreviousLapWasValid can be None
+    required = ("DistanceRoundTrack", "CurrentLap", "CurrentLapTime", "CurrentLapIsValid")
+    rows = valid_rows(df, Session.TELEMETRY_FIELDS, required)
+    if rows is None or not len(rows):
+        return {}
+
+    times = df["_time"]
+    distance = df["DistanceRoundTrack"].to_numpy(dtype=float)[rows]
+    current_lap = df["CurrentLap"].to_numpy(dtype=float)[rows]
+
+    # the first lap starts when crossing the finish line
+    crossed_finish_line = (distance < _shift(distance, -1.0)) & (distance < 100)
+    if not crossed_finish_line.any():
+        return {}
+    first = np.flatnonzero(crossed_finish_line)[0]
+
+    # every time the lap number goes above all lap numbers seen so far, a new lap starts
+    highest = np.maximum.accumulate(current_lap[first:])
+    new_lap = np.ones(len(highest), dtype=bool)
+    new_lap[1:] = current_lap[first + 1 :] > highest[:-1]
+    starts = first + np.flatnonzero(new_lap)
+    ends = np.append(starts[1:] - 1, len(rows) - 1)
+
+    laps = {}
+    lap_list = []
+    for index, start in enumerate(starts):
+        number = _value(df["CurrentLap"], rows[start])
+        lap = Lap(number, start=times.iat[rows[start]], end=times.iat[rows[start]])
+        lap.length = _longest(df["DistanceRoundTrack"], rows, distance, start, ends[index] + 1)
+        lap.valid = _value(df["CurrentLapIsValid"], rows[ends[index]])
+        if index + 1 < len(starts):
+            lap.end = times.iat[rows[starts[index + 1]]]
+        laps[number] = lap
+        lap_list.append(lap)
+
+    # a change of LapTimePrevious finishes the lap before the current one
+    lap_time_previous = df["LapTimePrevious"].to_numpy(dtype=float)[rows]
+    missing = np.isnan(lap_time_previous)
+    previous = _shift(lap_time_previous, -1.0)
+    # None doesn't change to None
+    changed = (lap_time_previous != previous) & ~(missing & _shift(missing, False))
+    changed = np.flatnonzero(changed)
+    previous_lap = np.searchsorted(starts, changed, side="right") - 2
+    changed = changed[previous_lap >= 0]
+    previous_lap = previous_lap[previous_lap >= 0]
+    if len(changed):
+        # the last change wins
+        last = np.append(previous_lap[1:] != previous_lap[:-1], True)
+        for row, index in zip(changed[last], previous_lap[last]):
+            lap = lap_list[index]
+            lap.time = _value(df["LapTimePrevious"], rows[row])
+            lap.valid = _value(df["PreviousLapWasValid"], rows[row])
+            lap.finished = True
+
+    return laps
+
+
+def detect_laps_rbr(df):
+    """Find the lap of a Richard Burns Rally stage, with the same result as SessionRbr.analyze."""
+    rows = valid_rows(df, RBR_TELEMETRY_FIELDS, RBR_TELEMETRY_FIELDS)
+    if rows is None or not len(rows):
+        return {}
+
+    times = df["_time"]
+    distance = df["DistanceRoundTrack"].to_numpy(dtype=float)[rows]
+    lap_time = df["CurrentLapTime"].to_numpy(dtype=float)[rows]
+
+    number = _value(df["CurrentLap"], rows[0])
+    lap = Lap(number, start=times.iat[rows[0]], end=times.iat[rows[0]])
+    lap.valid = True
+    lap.length = _longest(df["DistanceRoundTrack"], rows, distance, 0, len(rows))
+    lap.time = _value(df["CurrentLapTime"], rows[-1])
+
+    # at the end of the stage the lap time stops, but the distance keeps increasing
+    time_not_updated = _run_lengths(lap_time == _shift(lap_time, -1.0))
+    distance_updated = _run_lengths(_shift(distance, 100_000_000.0) < distance)
+    finished = np.flatnonzero((time_not_updated > 10) & (distance_updated > 10))
+    if len(finished):
+        lap.finished = True
+        lap.end = times.iat[rows[finished[-1]]]
+
+    return {number: lap}
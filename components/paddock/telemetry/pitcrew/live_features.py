@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from telemetry.models import FastLap, LiveFeatures
+
+FEATURE_TYPES = ["brake", "throttle", "gear", "other"]
+
+
+class LiveFeatureStore:
+    """Append only store of the live features of a driver on a game, track and car.
+
+    Every processed segment adds one row. Rows are written in batches, when a
+    new lap starts, every flush_interval seconds and on flush. Nothing is ever
+    updated, the features of a lap are not pickled again with every segment.
+    Once closed, every row is written right away.
+    """
+
+    def __init__(self, driver, game, car, track, session_id="NO_SESSION", flush_interval=10):
+        self.driver = driver
+        self.game = game
+        self.car = car
+        self.track = track
+        self.session_id = session_id
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lap = None
+        self.last_flush = time.monotonic()
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.closed = False
+        # the History worker adds rows, disconnect closes the store from another thread
+        self._lock = threading.Lock()
+
+    def add(self, turn, lap, features):
+        lap_end = self.lap is not None and lap != self.lap
+        self.lap = lap
+        if lap_end:
+            self.flush()
+        row = LiveFeatures(
+            driver=self.driver,
+            game=self.game,
+            car=self.car,
+            track=self.track,
+            session_id=self.session_id,
+            turn=turn,
+            lap=lap,
+            features=features,
+        )
+        with self._lock:
+            self.pending.append(row)
+        if self.closed or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def close(self):
+        self.closed = True
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            self.last_flush = time.monotonic()
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        # the rows are not retried, a failing database does not pile them up or stop the coach
+        try:
+            LiveFeatures.objects.bulk_create(pending)
+        except Exception as e:
+            self.rows_dropped += len(pending)
+            logging.error(f"{self.driver}: dropped live features of {len(pending)} segments: {e}")
+            return
+        self.rows_written += len(pending)
+        logging.debug(f"{self.driver}: saved live features of {len(pending)} segments")
+
+    def rows(self):
+        return LiveFeatures.objects.filter(driver=self.driver, game=self.game, car=self.car, track=self.track)
+
+    def backfill(self):
+        """Copy the live features kept in the driver FastLap before there was a table for them.
+
+        The feature sets of the types are matched up from the last one. Returns the number of rows.
+        """
+        fast_lap = FastLap.objects.filter(driver=self.driver, game=self.game, car=self.car, track=self.track).first()
+        segments = (fast_lap.data or {}).get("segments", {}) if fast_lap else {}
+        rows = []
+        for turn, segment in segments.items():
+            live_features = {type: list(features) for type, features in getattr(segment, "live_features", {}).items()}
+            laps = max([len(features) for features in live_features.values()], default=0)
+            for i in range(laps):
+                features = {}
+                for type, type_features in live_features.items():
+                    index = i - (laps - len(type_features))
+                    if index >= 0:
+                        features[type] = type_features[index]
+                rows.append(
+                    LiveFeatures(
+                        driver=self.driver,
+                        game=self.game,
+                        car=self.car,
+                        track=self.track,
+                        session_id="",
+                        turn=int(turn),
+                        features=features,
+                    )
+                )
+        LiveFeatures.objects.bulk_create(rows, batch_size=1000)
+        if rows:
+            logging.info(f"{self.driver}: copied live features of {len(rows)} segments from {fast_lap}")
+        return len(rows)
+
+    def load(self, laps=10):
+        """The features of the last laps through every segment, turn -> type -> oldest first."""
+        if not self.rows().exists():
+            try:
+                self.backfill()
+            except Exception as e:
+                logging.error(f"{self.driver}: could not copy the live features of the driver fast lap: {e}")
+        rows = (
+            self.rows()
+            .annotate(row=Window(RowNumber(), partition_by=[F("turn")], order_by=F("id").desc()))
+            .filter(row__lte=laps)
+            .order_by("turn", "id")
+        )
+        segments = {}
+        for row in rows:
+            segment = segments.setdefault(row.turn, {type: [] for type in FEATURE_TYPES})
+            for type, features in (row.features or {}).items():
+                segment.setdefault(type, []).append(features)
+        return segments
@@ -2,6 +2,8 @@ import logging
 
 
 class LoggingMixin:
+    __slots__ = ()
+
     def log(self, level, msg, *args, **kwargs):
         msg = f"{self.session_id}: {msg}"
         logging.log(level, msg, *args, **kwargs)
@@ -0,0 +1,81 @@
+import numpy as np
+from scipy.interpolate import interp1d
+
+
+class LookupTable:
+    """Lap time and speed of a fast lap at every meter of the track, and back.
+
+    The values are resampled to one row per meter, so the lap time and speed
+    at a distance are read by index. The distance at a lap time is found with
+    a binary search over the sorted lap times. The arrays are read only, the
+    table of a fast lap is shared by all coaches on it.
+    """
+
+    def __init__(self, distance_time, track_length):
+        self.track_length = track_length
+        distances = np.round(np.linspace(0, track_length, track_length + 1), decimals=0).astype(int)
+        self.distances = distances
+
+        columns = {}
+        for column in ["CurrentLapTime", "SpeedMs"]:
+            interp = interp1d(
+                distance_time["DistanceRoundTrack"],
+                distance_time[column],
+                kind="nearest",
+                bounds_error=False,
+                fill_value="extrapolate",
+            )
+            values = interp(distances)
+            if np.issubdtype(distance_time[column].dtype, np.integer):
+                values = np.round(values).astype(int)
+            columns[column] = values
+        self.lap_times = columns["CurrentLapTime"]
+        self.speeds = columns["SpeedMs"]
+
+        # the distances of equal lap times, the furthest one wins
+        reversed_times = self.lap_times[::-1]
+        self.sorted_lap_times, first = np.unique(reversed_times, return_index=True)
+        self.sorted_distances = distances[::-1][first]
+        self.max_lap_time = self.sorted_lap_times[-1]
+
+        for array in [self.distances, self.lap_times, self.speeds, self.sorted_lap_times, self.sorted_distances]:
+            array.flags.writeable = False
+
+    def _index(self, distance):
+        # like a dict with int keys, 12.0 is found, 12.5 is not
+        if distance != distance or distance % 1 or not 0 <= distance <= self.track_length:
+            return None
+        return int(distance)
+
+    def nbytes(self):
+        arrays = [self.distances, self.lap_times, self.speeds, self.sorted_lap_times, self.sorted_distances]
+        return sum(array.nbytes for array in arrays)
+
+    def lap_time_at(self, distance, default=0.0):
+        index = self._index(distance)
+        return default if index is None else self.lap_times[index]
+
+    def speed_at(self, distance, default=0.0):
+        index = self._index(distance)
+        return default if index is None else self.speeds[index]
+
+    def distance_at(self, lap_time):
+        return self.distances_at(np.array([lap_time]))[0]
+
+    def distances_at(self, lap_times):
+        """The distances of the closest lap times, the smaller one on a tie."""
+        lap_times = np.asarray(lap_times, dtype=float)
+        right = np.searchsorted(self.sorted_lap_times, lap_times).clip(1, len(self.sorted_lap_times) - 1)
+        left = right - 1
+        if len(self.sorted_lap_times) == 1:
+            return np.full(len(lap_times), self.sorted_distances[0])
+        use_left = np.abs(lap_times - self.sorted_lap_times[left]) <= np.abs(self.sorted_lap_times[right] - lap_times)
+        return np.where(use_left, self.sorted_distances[left], self.sorted_distances[right])
+
+    def lap_times_at(self, distances):
+        """The lap times at integer distances, wrapped around the track."""
+        return self.lap_times[np.asarray(distances, dtype=int) % (self.track_length + 1)]
+
+    def speeds_at(self, distances):
+        """The speeds at integer distances, wrapped around the track."""
+        return self.speeds[np.asarray(distances, dtype=int) % (self.track_length + 1)]
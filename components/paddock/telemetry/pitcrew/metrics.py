@@ -0,0 +1,11 @@
+def generate_metrics(metrics):
+    """Render a dict of metric name -> value in the prometheus text format.
+
+    Metrics ending in _total are exported as counters, everything else as gauges.
+    """
+    lines = []
+    for name, value in metrics.items():
+        metric_type = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import json
 import logging
 import threading
 
@@ -8,6 +7,8 @@ import paho.mqtt.client as mqtt
 
 from telemetry.utils import get_mqtt_config
 
+from .decoder import Decoder
+
 _LOGGER = logging.getLogger(__name__)
 
 (
@@ -19,7 +20,7 @@ _LOGGER = logging.getLogger(__name__)
 
 
 class Mqtt:
-    def __init__(self, observer, topic, replay: bool = False, debug=False):
+    def __init__(self, observer, topic, replay: bool = False, debug=False, decoder=None):
         mqttc = mqtt.Client()
         mqttc.on_message = self.on_message
         mqttc.on_connect = self.on_connect
@@ -34,6 +35,7 @@ class Mqtt:
         self._stop_event = threading.Event()
         self.ready = False
         self.debug = debug
+        self.decoder = decoder or Decoder()
 
     # def __del__(self):
     #     # disconnect from broker
@@ -72,7 +74,7 @@ class Mqtt:
             topic = topic[7:]
 
         try:
-            payload = json.loads(msg.payload.decode("utf-8")).get("telemetry")
+            payload = self.decoder.decode(msg.payload, topic)
         except Exception as e:
             logging.error("Error decoding payload: %s", e)
             return
@@ -89,6 +91,9 @@ class Mqtt:
                 logging.debug("r-->: %s: %s : %s", meters, r_topic, r_payload)
                 mqttc.publish(r_topic, r_payload)
 
+    def publish(self, topic, payload):
+        self.mqttc.publish(topic, payload)
+
     def on_connect(self, mqttc, obj, flags, rc):
         _LOGGER.debug("on_connect rc: %s", str(rc))
         if rc == mqtt.MQTT_ERR_SUCCESS:
@@ -0,0 +1,140 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+def is_json_object(payload):
+    try:
+        return isinstance(json.loads(payload), dict)
+    except (TypeError, ValueError):
+        return False
+
+
+def coalesce(payloads):
+    """The packets to send for the responses of one topic.
+
+    CrewChief accepts a list of json responses, the json objects are merged
+    into one list where the first of them was. Plain text responses of the
+    legacy coach are sent as they are.
+    """
+    if len(payloads) == 1:
+        return payloads
+    packets = []
+    objects = []
+    for payload in payloads:
+        if is_json_object(payload):
+            if not objects:
+                packets.append(objects)
+            objects.append(payload)
+        else:
+            packets.append(payload)
+    if len(objects) == 1:
+        return [objects[0] if packet is objects else packet for packet in packets]
+    return ["[" + ",".join(objects) + "]" if packet is objects else packet for packet in packets]
+
+
+class Publisher:
+    """Publish the responses of the coaches off the receiving thread.
+
+    Responses are queued, the worker waits linger seconds after the first one
+    and then sends all responses queued for a topic as one message.
+    """
+
+    def __init__(self, publish, max_queue_size=1000, linger=0.01):
+        self._publish = publish
+        self.max_queue_size = max_queue_size
+        self.linger = linger
+
+        self.queue = deque()
+        self.queued = 0
+        self.published = 0
+        self.packets = 0
+        self.dropped = 0
+        self.errors = 0
+        # seconds from queueing to sending of the latest responses
+        self.latencies = deque(maxlen=1000)
+
+        self._lock = threading.Lock()
+        self._wakeup_event = threading.Event()
+        # called on wakeup, lets an event loop schedule the work
+        self.wakeup_callback = None
+        self._stop_event = threading.Event()
+        self.ready = False
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def publish(self, topic, payload):
+        with self._lock:
+            if len(self.queue) >= self.max_queue_size:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append((topic, payload, time.monotonic()))
+            self.queued += 1
+
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def flush(self):
+        with self._lock:
+            queue = self.queue
+            self.queue = deque()
+
+        if not queue:
+            return
+
+        topics = OrderedDict()
+        for topic, payload, queued_at in queue:
+            topics.setdefault(topic, []).append((payload, queued_at))
+
+        for topic, responses in topics.items():
+            try:
+                for packet in coalesce([payload for payload, queued_at in responses]):
+                    self._publish(topic, packet)
+                    self.packets += 1
+            except Exception as e:
+                self.errors += 1
+                logging.exception(f"{topic}: Error publishing {len(responses)} responses: {e}")
+                continue
+            now = time.monotonic()
+            self.latencies.extend(now - queued_at for payload, queued_at in responses)
+            self.published += len(responses)
+
+    def metrics(self):
+        latencies = list(self.latencies)
+        p50 = float(np.percentile(latencies, 50)) if latencies else 0.0
+        p99 = float(np.percentile(latencies, 99)) if latencies else 0.0
+        return {
+            "pitcrew_publisher_queued_total": self.queued,
+            "pitcrew_publisher_published_total": self.published,
+            "pitcrew_publisher_packets_total": self.packets,
+            "pitcrew_publisher_dropped_total": self.dropped,
+            "pitcrew_publisher_errors_total": self.errors,
+            "pitcrew_publisher_queue_depth": self.queue_depth(),
+            "pitcrew_publisher_latency_p50_seconds": p50,
+            "pitcrew_publisher_latency_p99_seconds": p99,
+        }
+
+    def run(self):
+        self.ready = True
+        while not self.stopped():
+            self._wakeup_event.wait(timeout=1)
+            self._wakeup_event.clear()
+            if self.linger:
+                # collect the responses of this tick
+                self._stop_event.wait(self.linger)
+            self.flush()
+
+        self.flush()
@@ -1,13 +1,19 @@
-import statistics
+import copy
+from collections import deque
 
 import pandas as pd
 
+from .feature_history import FeatureHistory
+
 # import numpy as np
-from scipy.stats import zscore
+
+
+# the number of laps the live data of a segment is kept for
+DEPTH = 20
 
 
 class Segment:
-    def __init__(self, history=None, **kwargs):
+    def __init__(self, history=None, depth=DEPTH, **kwargs):
         self.telemetry_features = []
         # for key, value in kwargs.items():
         #     self[key] = value
@@ -27,14 +33,19 @@ class Segment:
         self.previous_segment = None
         self.next_segment = None
 
-        # added by history to store live data
-        self.live_telemetry = []
-        self.live_telemetry_frames = []
+        # added by history to store live data, of the last depth laps
+        self.depth = depth
+        self.init_live_data()
+
+    def init_live_data(self):
+        self.live_telemetry = deque(maxlen=self.depth)
+        self.live_telemetry_frames = deque(maxlen=self.depth)
+        self.live_laps = 0
         self.live_features = {
-            "brake": [],
-            "throttle": [],
-            "gear": [],
-            "other": [],
+            "brake": FeatureHistory(self.depth),
+            "throttle": FeatureHistory(self.depth),
+            "gear": FeatureHistory(self.depth),
+            "other": FeatureHistory(self.depth),
         }
 
     def log_debug(self, msg):
@@ -57,6 +68,18 @@ class Segment:
     def end(self, value):
         self._end = int(value)
 
+    def copy_for(self, history, depth=None):
+        """A copy sharing the features of this segment, with live data of its own."""
+        segment = copy.copy(self)
+        segment.history = history
+        segment.previous_segment = None
+        segment.next_segment = None
+        # segments pickled before the live data was bounded have no depth
+        segment.depth = depth or getattr(self, "depth", DEPTH)
+        segment.init_live_data()
+        segment.init_live_features(getattr(self, "live_features", {}))
+        return segment
+
     def copy_from(self, segment):
         self.start = segment.start
         self.end = segment.end
@@ -84,16 +107,19 @@ class Segment:
         else:
             raise ValueError(f"unknown type {type}")
 
-    def init_live_features_from_segment(self, segment):
-        for type, features in segment.live_features.items():
-            self.live_features[type] = features
-            # self.add_live_features(features, type=type)
+    def init_live_features(self, live_features):
+        for type, features in live_features.items():
+            self.live_features[type] = FeatureHistory(self.depth, features)
 
     def add_live_features(self, features, type):
         if type not in self.live_features:
-            self.live_features[type] = []
+            self.live_features[type] = FeatureHistory(self.depth)
         self.live_features[type].append(features)
 
+    def add_live_telemetry_frame(self, frame):
+        self.live_telemetry_frames.append(frame)
+        self.live_laps += 1
+
     def type_brake(self):
         return self.type == "brake"
 
@@ -255,17 +281,17 @@ class Segment:
         return avg_sector_lap_time - self.time
 
     def driver_delta(self):
-        sector_lap_times = self.feature_values(feature="sector_lap_time", type="other")
-        # remove 0 values
-        sector_lap_times = [x for x in sector_lap_times if x > 0.0]
+        if "other" not in self.live_features:
+            return 10_000
+        sector_lap_times = self.live_features["other"].column("sector_lap_time")
 
-        # remove outliers
+        # remove 0 values and outliers, NaN is neither
         low_threshold = self.time * 0.9
-        filtered_sector_lap_times = [x for x in sector_lap_times if x >= low_threshold]
+        filtered_sector_lap_times = sector_lap_times[(sector_lap_times > 0.0) & (sector_lap_times >= low_threshold)]
 
         if len(filtered_sector_lap_times) == 0:
             return 10_000
-        min_sector_lap_time = min(filtered_sector_lap_times)
+        min_sector_lap_time = filtered_sector_lap_times.min()
 
         # return avg_sector_lap_time
         delta = min_sector_lap_time - self.time
@@ -275,52 +301,24 @@ class Segment:
         if type not in self.live_features:
             self.log_debug(f"no {type} features")
             return []
-        features = self.live_features[type]
-        if n and len(features) <= n:
-            return []
-
-        values = []
-        for i in range(-1, -len(features), -1):
-            value = features[i].get(feature)
-            if value and value is not None:
-                values.append(value)
-            if n and len(values) == n:
-                break
-
-        if n and len(values) < n:
-            return []
-        return values
+        return self.live_features[type].values(feature, n=n)
 
     def avg_feature(self, n=0, feature="feature_to_query", type="type_of_feature_set"):
-        values = self.feature_values(n=n, feature=feature, type=type)
-        self.log_debug(f"{type} {feature} values: {values}")
-
-        if len(values) == 0:
+        if type not in self.live_features:
+            self.log_debug(f"no {type} features")
             return None
-
-        # 1. Using Z-score to remove outliers
-        z_scores = zscore(values)
-        threshold = 1  # ChatGPT suggested 3
-        values_clean = [x for x, z in zip(values, z_scores) if abs(z) < threshold]
-
-        # 2. Using IQR to remove outliers
-        # Q1 = np.percentile(values, 25)
-        # Q3 = np.percentile(values, 75)
-        # IQR = Q3 - Q1
-        # lower_bound = Q1 - (1.5 * IQR)
-        # upper_bound = Q3 + (1.5 * IQR)
-        # values_clean = [x for x in values if x >= lower_bound and x <= upper_bound]
-
-        self.log_debug(f"{type} {feature} values wo/outliers: {values_clean}")
-        # return mean gear
-        if values_clean:
-            return statistics.mean(values_clean)
-        else:
-            # if values_clean is empty, either all values are the same or there is only one value
-            return values[0]
+        features = self.live_features[type]
+        # the statistics are computed once per lap, avg_feature is called many times per tick
+        computed = features.has_stats(feature, n)
+        stats = features.stats(feature, n=n)
+        if not computed:
+            self.log_debug(f"{type} {feature} values: {stats.values}")
+            if stats.values:
+                self.log_debug(f"{type} {feature} values wo/outliers: {stats.values_clean}")
+        return stats.avg
 
     def session_laps(self):
-        return len(self.live_telemetry_frames)
+        return self.live_laps
 
     def brake_point_diff(self):
         bp = self.brake_point()
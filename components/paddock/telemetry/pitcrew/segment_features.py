@@ -0,0 +1,179 @@
+"""Features of a live segment, computed on numpy arrays.
+
+The functions take the resampled telemetry of a segment, as returned by
+FastLapAnalyzer.preprocess_frame, and return the same values as the pandas
+implementations in Analyzer and FastLapAnalyzer they are named after.
+"""
+import numpy as np
+
+# the bins of Analyzer.top_bin, the first one includes 0
+BINS = np.array([x / 10 for x in range(11)])
+# the edges of the bins as pd.cut labels them
+BIN_LEFT = np.append(-0.001, BINS[1:-1])
+BIN_RIGHT = BINS[1:]
+
+
+def _min(values):
+    # like Series.min, NaN is skipped
+    values = values[~np.isnan(values)]
+    return values.min() if len(values) else np.nan
+
+
+def _max(values):
+    values = values[~np.isnan(values)]
+    return values.max() if len(values) else np.nan
+
+
+def _mean(values):
+    values = values[~np.isnan(values)]
+    return values.mean() if len(values) else np.nan
+
+
+def _take(frame, rows):
+    return {name: frame[name][rows] for name in ["DistanceRoundTrack", "Brake", "Throttle", "SpeedMs"]}
+
+
+def section(frame, start, end):
+    """The rows between start and end, like Analyzer.section_df."""
+    distance = frame["DistanceRoundTrack"]
+    if end < start:
+        max_distance = _max(distance)
+        first_part = np.flatnonzero((distance >= start) & (distance <= max_distance))
+        second_part = np.flatnonzero((distance >= 0) & (distance <= end))
+        return _take(frame, np.concatenate([first_part, second_part]))
+    return _take(frame, (distance >= start) & (distance <= end))
+
+
+def value_at_distance(frame, meters, column="SpeedMs"):
+    """The value of the row closest to meters, the first one on a tie."""
+    distance = frame["DistanceRoundTrack"]
+    diff = np.abs(distance - meters)
+    return frame[column][np.nanargmin(diff)]
+
+
+def window(frame, outside, inside):
+    """Start and end of the first window of rows inside a threshold.
+
+    The window starts at the first row inside and ends at the first row
+    outside after it, or at the last row.
+    """
+    distance = frame["DistanceRoundTrack"]
+    if not inside.any():
+        return None, None
+    start = distance[inside.argmax()]
+    if not outside.any():
+        return start, None
+    end_section = outside & (distance > start)
+    if end_section.any():
+        end = distance[end_section.argmax()]
+    else:
+        end = distance[-1]
+    return start, end
+
+
+def top_bin(values, column="Brake"):
+    """The range of the two most used tenths of the pedal, like Analyzer.top_bin."""
+    # like pd.cut, the bins are closed on the right, values outside of them are not counted
+    index = np.searchsorted(BINS, values, side="left") - 1
+    index[values == 0] = 0
+    index = index[(index >= 0) & (index < len(BIN_RIGHT)) & ~np.isnan(values)]
+    counts = np.bincount(index, minlength=len(BIN_RIGHT))
+
+    bins = np.arange(len(BIN_RIGHT))
+    if column == "Brake":
+        bins = bins[1:]
+    else:
+        bins = bins[:-1]
+    # the two largest counts, on a tie the lower bin
+    largest = bins[np.argsort(-counts[bins], kind="stable")[:2]]
+    ascending = column == "Throttle"
+    first_bin, second_bin = sorted(largest, reverse=not ascending)
+    first_count, second_count = counts[first_bin], counts[second_bin]
+
+    if first_count and second_count:
+        if BIN_LEFT[first_bin] == BIN_RIGHT[second_bin]:
+            # both top bins are adjacent
+            return BIN_LEFT[second_bin], BIN_RIGHT[first_bin]
+        else:
+            # top bins are not adjacent
+            return BIN_LEFT[first_bin], BIN_RIGHT[first_bin]
+    elif first_count:
+        return BIN_LEFT[first_bin], BIN_RIGHT[first_bin]
+    elif second_count:
+        return BIN_LEFT[second_bin], BIN_RIGHT[second_bin]
+    else:
+        if column == "Brake":
+            return 0, 0.1
+        return 0.9, 1
+
+
+def _peak_features(frame, column, start, end):
+    features = {"start": start, "end": end}
+    pedal_section = section(frame, start, end)
+    values = pedal_section[column]
+    min_force, max_force = top_bin(values, column=column)
+    peak = (values >= min_force) & (values <= max_force)
+    peak_values = values[peak]
+
+    features["max_start"] = _min(pedal_section["DistanceRoundTrack"][peak])
+    features["max_end"] = _max(pedal_section["DistanceRoundTrack"][peak])
+    features["max_high"] = round(_max(peak_values), 2)
+    features["max_low"] = round(_min(peak_values), 2)
+    features["force"] = round(_mean(peak_values), 2)
+    features["approach_speed"] = round(value_at_distance(frame, start, column="SpeedMs"), 2)
+    features["min_speed"] = round(_min(pedal_section["SpeedMs"]), 2)
+    return features
+
+
+def brake_features(frame, brake_threshold=0.1):
+    brake = frame["Brake"]
+    start, end = window(frame, brake <= brake_threshold, brake > brake_threshold)
+    if start and end:
+        return _peak_features(frame, "Brake", start, end)
+    return {}
+
+
+def throttle_features(frame, threshold=None):
+    throttle = frame["Throttle"]
+    if threshold is None:
+        threshold = _max(throttle) * 0.98
+    start, end = window(frame, throttle > threshold, throttle <= threshold)
+    if start and end:
+        features = _peak_features(frame, "Throttle", start, end)
+        features["max_low"] = abs(features["max_low"])
+        features["force"] = abs(features["force"])
+        return features
+    return {}
+
+
+def gear_features(frame):
+    gear_values = frame["Gear"]
+    gear = _min(gear_values)
+    # every row where the gear is not the one of the row before, NaN is never equal
+    changes = np.ones(len(gear_values), dtype=bool)
+    changes[1:] = gear_values[1:] != gear_values[:-1]
+    distances = [int(round(x)) for x in frame["DistanceRoundTrack"][changes]]
+    gears = [int(x) for x in gear_values[changes]]
+    return {
+        "gear": int(gear) if not np.isnan(gear) else 0,
+        "distance_gear": dict(zip(distances, gears)),
+    }
+
+
+def sector_time(frame):
+    if not len(frame):
+        return 0
+    # the rows of a DataFrame are floats, so is the Time of Analyzer.sector_time
+    times = frame["Time"]
+    section_time = np.float64(times[-1]) - np.float64(times[0])
+    return section_time / 1_000_000_000
+
+
+def sector_lap_time(frame):
+    if not len(frame):
+        return 0
+    end_lap_time = frame["CurrentLapTime"][-1]
+    start_lap_time = frame["CurrentLapTime"][0]
+    if end_lap_time < start_lap_time:
+        start_lap_time = 0
+    return end_lap_time - start_lap_time
@@ -1,3 +1,5 @@
+import sys
+
 import django.utils.timezone
 
 from telemetry.models import Game
@@ -5,6 +7,8 @@ from telemetry.pitcrew.logging_mixin import LoggingMixin
 
 
 class Lap:
+    __slots__ = ("number", "start", "end", "length", "time", "finished", "valid", "persisted")
+
     def __init__(
         self,
         number,
@@ -30,8 +34,53 @@ class Lap:
     def __repr__(self):
         return self.__str__()
 
+    def approx_size(self):
+        return sys.getsizeof(self)
+
 
 class Session(LoggingMixin):
+    # events passed to the event_callback
+    SESSION_STARTED = "session_started"
+    LAP_FINISHED = "lap_finished"
+    # dropped by the firehose with laps that are not saved yet
+    SESSION_EVICTED = "session_evicted"
+
+    # the telemetry fields used for lap detection
+    TELEMETRY_FIELDS = (
+        "DistanceRoundTrack",
+        "CurrentLap",
+        "CurrentLapTime",
+        "LapTimePrevious",
+        "CurrentLapIsValid",
+        "PreviousLapWasValid",
+    )
+
+    # there is one Session per driver stint, keep them small
+    __slots__ = (
+        "id",
+        "start",
+        "end",
+        "laps",
+        "driver",
+        "session_id",
+        "_game",
+        "game_name",
+        "track",
+        "car",
+        "car_class",
+        "session_type",
+        "record",
+        "current_lap_time",
+        "distance_round_track",
+        "current_lap",
+        "previous_lap",
+        "previous_distance",
+        "previous_lap_time",
+        "previous_lap_time_previous",
+        "telemetry_valid",
+        "event_callback",
+    )
+
     def __init__(self, id, start=None):
         self.id = id
         self.start = start or django.utils.timezone.now()
@@ -39,7 +88,7 @@ class Session(LoggingMixin):
         self.laps = {}
         self.driver = ""
         self.session_id = ""
-        self.game = Game()
+        self._game = None
         self.game_name = ""
         self.track = ""
         self.car = ""
@@ -55,12 +104,37 @@ class Session(LoggingMixin):
         self.previous_lap_time = -1
         self.previous_lap_time_previous = -1
         self.telemetry_valid = True
+        # called with (event, session, lap), the session saver stores laps as soon as they finish
+        self.event_callback = None
+
+    @property
+    def game(self):
+        # the Game is only needed once the session is saved
+        if self._game is None:
+            self._game = Game()
+        return self._game
+
+    @game.setter
+    def game(self, value):
+        self._game = value
 
     def signal(self, telemetry, now=None):
         now = now or django.utils.timezone.now()
         self.end = now
         self.analyze(telemetry, now)
 
+    def emit(self, event, lap=None):
+        if self.event_callback:
+            self.event_callback(event, self, lap)
+
+    def unsaved_laps(self):
+        return [lap for lap in list(self.laps.values()) if lap.finished and not lap.persisted]
+
+    def approx_size(self):
+        """Approximate memory held by the session and its laps in bytes."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.laps)
+        return size + sum(lap.approx_size() for lap in list(self.laps.values()))
+
     def log_laps(self):
         for lap in self.laps:
             self.log_debug(
@@ -128,12 +202,15 @@ class Session(LoggingMixin):
 
         if lap_time_previous != self.previous_lap_time_previous:
             if self.previous_lap:
+                finished = self.previous_lap.finished
                 self.previous_lap.time = lap_time_previous
                 self.previous_lap.valid = previous_lap_was_valid
                 self.previous_lap.finished = True
                 self.log_debug(
                     f"lap {self.previous_lap.number} time {lap_time_previous} valid {previous_lap_was_valid}"
                 )
+                if not finished:
+                    self.emit(self.LAP_FINISHED, self.previous_lap)
 
         self.previous_distance = distance
         self.previous_lap_time = lap_time
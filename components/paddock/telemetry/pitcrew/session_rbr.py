@@ -2,6 +2,13 @@ from .session import Session
 
 
 class SessionRbr(Session):
+    __slots__ = (
+        "previous_tick_time",
+        "previous_tick_distance",
+        "counter_time_not_updated",
+        "counter_distance_updated",
+    )
+
     def __init__(self, session_id, start=None):
         super().__init__(session_id, start=start)
 
@@ -50,8 +57,11 @@ class SessionRbr(Session):
             self.counter_distance_updated = 0
 
         if self.counter_time_not_updated > 10 and self.counter_distance_updated > 10:
+            finished = self.current_lap.finished
             self.current_lap.finished = True
             self.current_lap.end = now
+            if not finished:
+                self.emit(self.LAP_FINISHED, self.current_lap)
 
         self.previous_tick_time = lap_time
         self.previous_tick_distance = distance
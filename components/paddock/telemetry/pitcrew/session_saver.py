@@ -1,48 +1,129 @@
 import logging
 import threading
 import time
+from collections import deque
 
-from django.db import IntegrityError
+import django.utils.timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
 
-from telemetry.models import Driver, Game, Session, SessionType
+from telemetry.dimensions import dimensions
+from telemetry.models import Lap, Session, Track
 
 
 class SessionSaver:
-    def __init__(self, firehose, save=True):
+    """Persist the sessions of the firehose and their laps.
+
+    Sessions report when they start and when a lap finishes, the saver stores
+    them right away. Every sleep_time seconds all sessions are swept, to catch
+    anything the events missed and to expire idle sessions.
+
+    With a spool, the saver doesn't touch the database: finished laps and
+    the header of their session are written to the spool and a SpoolDrainer
+    saves them, creating the session record with the first lap. A slow
+    database doesn't hold back the saver and the laps survive a restart.
+    """
+
+    def __init__(self, firehose, save=True, spool=None):
         self.firehose = firehose
         self.sleep_time = 10
         self.save = save
+        self.spool = spool
+
+        # (event, session, lap) reported by the sessions
+        self.events = deque()
+        self.processed_events = 0
+        self._lock = threading.Lock()
+        self._wakeup_event = threading.Event()
+        # called on wakeup, lets an event loop schedule the work
+        self.wakeup_callback = None
+        self.firehose.event_callback = self.notify
 
         self._stop_event = threading.Event()
         self.ready = False
 
     def stop(self):
         self._stop_event.set()
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
 
     def stopped(self):
         return self._stop_event.is_set()
 
+    def notify(self, event, session, lap=None):
+        with self._lock:
+            self.events.append((event, session, lap))
+        self._wakeup_event.set()
+        if self.wakeup_callback:
+            self.wakeup_callback()
+
+    def process_events(self):
+        with self._lock:
+            events = self.events
+            self.events = deque()
+        if not events:
+            return
+
+        # a dict keeps the order the sessions reported in
+        sessions = {id(session): session for event, session, lap in events}
+        sessions = list(sessions.values())
+        if self.save:
+            self.save_sessions(sessions)
+        else:
+            self.fetch_sessions(sessions)
+        self.processed_events += len(events)
+
+    def metrics(self):
+        return {
+            "pitcrew_session_saver_events_total": self.processed_events,
+            "pitcrew_session_saver_queue_depth": len(self.events),
+        }
+
     def save_sessions_loop(self):
-        while True and not self.stopped():
-            if self.save:
-                self.save_sessions()
-            else:
-                self.fetch_sessions()
-            self.ready = True
-            time.sleep(self.sleep_time)
-
-    def fetch_sessions(self):
+        next_sweep = time.monotonic()
+        while not self.stopped():
+            if time.monotonic() >= next_sweep:
+                self.save_and_clear_sessions()
+                self.ready = True
+                next_sweep = time.monotonic() + self.sleep_time
+
+            self._wakeup_event.wait(timeout=max(next_sweep - time.monotonic(), 0))
+            self._wakeup_event.clear()
+            self.process_events()
+
+    def save_and_clear_sessions(self):
+        if self.save:
+            self.save_sessions()
+        else:
+            self.fetch_sessions()
+        # expire idle sessions and drop persisted laps only after they got the chance to be saved
+        self.firehose.clear_sessions()
+
+    def all_sessions(self):
+        sessions = []
         session_ids = list(self.firehose.sessions.keys())
         for session_id in session_ids:
             session = self.firehose.sessions.get(session_id)
+            if session:
+                sessions.append(session)
+        return sessions
+
+    def fetch_sessions(self, sessions=None):
+        if sessions is None:
+            sessions = self.all_sessions()
+        for session in sessions:
+            session_id = session.id
             if not session.record:
                 try:
-                    session.driver = Driver.objects.get(name=session.driver)
-                    session.game = Game.objects.get(name=session.game_name)
-                    session.session_type = SessionType.objects.get(type=session.session_type)
-                    session.car = session.game.cars.get(name=session.car)
-                    session.car.car_class = session.game.car_classes.get(name=session.car_class)
-                    session.track = session.game.tracks.get(name=session.track)
+                    session.driver = dimensions.driver(session.driver)
+                    session.game = dimensions.game(session.game_name)
+                    session.session_type = dimensions.session_type(session.session_type)
+                    session.car = dimensions.car(session.game, session.car)
+                    # the car is shared through the dimension cache, the class stays on the session
+                    session.car_class = dimensions.car_class(session.game, str(session.car_class))
+                    session.track = dimensions.track(session.game, session.track)
                     session.record = session.driver.sessions.filter(
                         session_id=session.session_id,
                         session_type=session.session_type,
@@ -60,89 +141,144 @@ class SessionSaver:
                     logging.error(f"{session.session_id}: Error fetching session {session_id}: {e}")
                     continue
 
-    def save_sessions(self):
-        session_ids = list(self.firehose.sessions.keys())
-        for session_id in session_ids:
-            session = self.firehose.sessions.get(session_id)
+    def save_sessions(self, sessions=None):
+        if sessions is None:
+            sessions = self.all_sessions()
+        if self.spool is not None:
+            for session in sessions:
+                self.spool_laps(session)
+            return
+
+        saved_sessions = []
+        for session in sessions:
+            session_id = session.id
 
             # save session to database
             # TODO: update session details if they change (e.g. end time)
             if not session.record:
                 try:
-                    session.driver, created = Driver.objects.get_or_create(name=session.driver)
-                    session.game, created = Game.objects.get_or_create(name=session.game_name)
-                    (
-                        session.session_type,
-                        created,
-                    ) = SessionType.objects.get_or_create(type=session.session_type)
-                    session.car, created = session.game.cars.get_or_create(name=session.car)
-                    session.car.car_class, created = session.game.car_classes.get_or_create(name=session.car_class)
-                    session.track, created = session.game.tracks.get_or_create(name=session.track)
-                    (
-                        session.record,
-                        created,
-                    ) = session.driver.sessions.get_or_create(
-                        session_id=session.session_id,
-                        session_type=session.session_type,
-                        game=session.game,
-                        defaults={"start": session.start, "end": session.end},
-                    )
+                    self.save_session(session)
                     logging.debug(f"{session.session_id}: Saving session {session_id}")
                 except Exception as e:
                     # TODO add error to session to expire
                     logging.error(f"{session.session_id}: Error saving session {session_id}: {e}")
                     continue
 
-            lap_numbers = list(session.laps.keys())
-            for lap_number in lap_numbers:
-                lap = session.laps.get(lap_number)
-                if session.record and lap.finished and not lap.persisted:
-                    # check if lap length is within 98% of the track length
-                    track = session.track
-
-                    # track_length = track.length
-                    # if lap.length < track_length * 0.98:
-                    #     lstring = (
-                    #         f"{lap.number}: {lap.time}s {lap.length}m"
-                    #     )
-                    #     logging.info(
-                    #         f"{session.session_id}: Discard lap {lstring} - track length {track_length}m"
-                    #     )
-                    #     # FIXME: this is a hack to prevent the lap from being saved again
-                    #     lap.persisted = True
-                    #     continue
-
-                    try:
-                        lap_record = session.record.laps.create(
-                            number=lap.number,
-                            car=session.car,
-                            track=track,
-                            start=lap.start,
-                            end=lap.end,
-                            length=lap.length,
-                            valid=lap.valid,
-                            time=lap.time,
-                        )
-                        logging.info(f"{session.session_id}: Saving lap {lap_record}")
-                        session.record.end = session.end
-                        session.record.save_dirty_fields()
-                        lap.persisted = True
-                    except IntegrityError as e:
-                        logging.error(f"{session.session_id}: Error saving lap {lap.number}: {e}")
-                        lap.persisted = True
-                    except Exception as e:
-                        logging.error(f"{session.session_id}: Error saving lap {lap.number}: {e}")
-
-                    lap_length = int(lap.length)
-                    if lap_length > track.length:
-                        track.refresh_from_db()
-                        if lap_length > track.length:
-                            logging.info(
-                                f"{session.session_id}: updating {track.name} "
-                                + f"length from {track.length} to {lap_length}"
-                            )
-                            track.length = lap_length
-                            track.save()
+            saved_sessions.append(session)
+
+        self.save_laps(saved_sessions)
+
+    def spool_laps(self, session):
+        laps = session.unsaved_laps()
+        if not laps:
+            return
+        try:
+            self.spool.append(session, laps)
+        except Exception as e:
+            logging.error(f"{session.session_id}: Error spooling {len(laps)} laps: {e}")
+            return
+        for lap in laps:
+            logging.debug(f"{session.session_id}: Spooled lap {lap}")
+            lap.persisted = True
+
+    def save_session(self, session):
+        session.driver = dimensions.driver(session.driver, create=True)
+        session.game = dimensions.game(session.game_name, create=True)
+        session.session_type = dimensions.session_type(session.session_type, create=True)
+        session.car = dimensions.car(session.game, session.car, create=True)
+        session.car_class = dimensions.car_class(session.game, str(session.car_class), create=True)
+        session.track = dimensions.track(session.game, session.track, create=True)
+        (
+            session.record,
+            created,
+        ) = session.driver.sessions.get_or_create(
+            session_id=session.session_id,
+            session_type=session.session_type,
+            game=session.game,
+            defaults={"start": session.start, "end": session.end},
+        )
+
+    def save_laps(self, sessions):
+        """Save the finished laps of all sessions in one transaction.
+
+        The laps are inserted with a single bulk_create, laps that are already
+        saved for the session and start are skipped. Sessions get their new end
+        and tracks the length of their longest lap, both in one query.
+        """
+        laps = []
+        records = []
+        for session in sessions:
+            for lap in session.unsaved_laps():
+                laps.append((session, lap))
+                records.append(
+                    Lap(
+                        session=session.record,
+                        number=lap.number,
+                        car=session.car,
+                        track=session.track,
+                        start=lap.start,
+                        end=lap.end,
+                        length=lap.length,
+                        valid=lap.valid,
+                        time=lap.time,
+                    )
+                )
+        if not records:
+            return
+
+        now = django.utils.timezone.now()
+        updated_sessions = {}
+        track_lengths = {}
+        for session, lap in laps:
+            session.record.end = session.end
+            session.record.modified = now
+            updated_sessions[session.record.pk] = session.record
+            track_lengths[session.track.pk] = max(track_lengths.get(session.track.pk, 0), int(lap.length))
+
+        try:
+            with transaction.atomic():
+                Lap.objects.bulk_create(records, ignore_conflicts=True)
+                Session.objects.bulk_update(updated_sessions.values(), ["end", "modified"])
+                # only ever increase the track length
+                Track.objects.filter(pk__in=track_lengths.keys()).update(
+                    length=Case(
+                        *[
+                            When(pk=pk, then=Greatest(F("length"), Value(length)))
+                            for pk, length in track_lengths.items()
+                        ],
+                        default=F("length"),
+                    )
+                )
+        except Exception as e:
+            logging.error(f"Error saving {len(records)} laps, saving them one by one: {e}")
+            self.save_laps_one_by_one(laps, records)
+            return
+
+        for (session, lap), record in zip(laps, records):
+            logging.info(f"{session.session_id}: Saving lap {record}")
+            lap.persisted = True
+            if track_lengths[session.track.pk] > session.track.length:
+                logging.info(
+                    f"{session.session_id}: updating {session.track.name} "
+                    + f"length from {session.track.length} to {track_lengths[session.track.pk]}"
+                )
+                session.track.length = track_lengths[session.track.pk]
+
+    def save_laps_one_by_one(self, laps, records):
+        """Fallback for a batch with a broken lap, skip the laps the database rejects."""
+        for (session, lap), record in zip(laps, records):
+            try:
+                with transaction.atomic():
+                    record.save()
+                    session.record.save(update_fields=["end", "modified"])
+                    Track.objects.filter(pk=session.track.pk, length__lt=int(lap.length)).update(length=int(lap.length))
+                logging.info(f"{session.session_id}: Saving lap {record}")
+                lap.persisted = True
+            except IntegrityError as e:
+                logging.error(f"{session.session_id}: Error saving lap {lap.number}: {e}")
+                lap.persisted = True
+            except Exception as e:
+                logging.error(f"{session.session_id}: Error saving lap {lap.number}: {e}")
 
     def run(self):
         self.save_sessions_loop()
@@ -0,0 +1,200 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+import django.utils.timezone
+
+from telemetry.models import Driver
+
+from .firehose import Firehose
+from .session_saver import SessionSaver
+from .worker_processes import WorkerProcesses
+
+
+def shard_key(topic):
+    """The part of the topic that identifies a session: driver/session_id."""
+    frags = topic.split("/")
+    return "/".join(frags[1:3])
+
+
+def shard_for(topic, shards):
+    # crc32 is stable across processes and restarts, unlike hash()
+    return zlib.crc32(shard_key(topic).encode("utf-8")) % shards
+
+
+class ShardSession:
+    """A summary of a Session living in one of the shard processes."""
+
+    def __init__(self, topic, shard, driver=None, end=None, laps=0, persisted_laps=0, size=0):
+        self.topic = topic
+        self.shard = shard
+        self.driver = driver
+        self.end = end
+        self.laps = laps
+        self.persisted_laps = persisted_laps
+        self.size = size
+
+    @classmethod
+    def from_session(cls, session, shard):
+        driver = session.driver
+        if isinstance(driver, Driver):
+            driver = (driver.pk, driver.name)
+        return cls(
+            session.id,
+            shard,
+            driver=driver,
+            end=session.end,
+            laps=len(session.laps),
+            persisted_laps=len([lap for lap in session.laps.values() if lap.persisted]),
+            size=session.approx_size(),
+        )
+
+    def resolve(self):
+        # resolved drivers are sent as (pk, name), the CoachWatcher expects a Driver
+        if isinstance(self.driver, tuple):
+            pk, name = self.driver
+            self.driver = Driver(pk=pk, name=name)
+        return self
+
+
+def run_shard(shard, inbox, outbox, save=True, sleep_time=5, debug=False, session_ttl=600, max_sessions=1000):
+    """Main loop of a shard process.
+
+    Feeds the telemetry of the shard into its own Firehose and persists new sessions
+    and finished laps as they come, like the SessionSaver thread of a single process
+    crew. Every sleep_time seconds all sessions are swept and reported back to the
+    dispatcher.
+    """
+    firehose = Firehose(debug=debug, session_ttl=session_ttl, max_sessions=max_sessions)
+    session_saver = SessionSaver(firehose, save=save)
+    logging.info(f"firehose shard {shard} started")
+
+    def save_and_report():
+        try:
+            session_saver.save_and_clear_sessions()
+        except Exception as e:
+            logging.exception(f"firehose shard {shard}: Error saving sessions: {e}")
+        sessions = [ShardSession.from_session(session, shard) for session in firehose.sessions.values()]
+        outbox.put((shard, sessions))
+
+    next_save = time.monotonic() + sleep_time
+    while True:
+        try:
+            message = inbox.get(timeout=1)
+        except queue.Empty:
+            message = False
+
+        if message is None:
+            break
+
+        if message:
+            topic, payload, now = message
+            try:
+                firehose.notify(topic, payload, now)
+            except Exception as e:
+                logging.exception(f"{topic}: Error processing message: {e}")
+
+        if session_saver.events:
+            try:
+                session_saver.process_events()
+            except Exception as e:
+                logging.exception(f"firehose shard {shard}: Error saving sessions: {e}")
+
+        if time.monotonic() > next_save:
+            save_and_report()
+            next_save = time.monotonic() + sleep_time
+
+    save_and_report()
+    logging.info(f"firehose shard {shard} stopped")
+
+
+class ShardedFirehose:
+    """Spread the Firehose over several processes.
+
+    Every shard process owns the sessions of a stable hash range of topics (driver/session_id)
+    and saves them itself. This object only dispatches telemetry to the shards and merges
+    the session summaries they report back into self.sessions.
+    """
+
+    def __init__(self, shards=2, save=True, debug=False, session_ttl=600, max_sessions=1000):
+        self.shards = shards
+        self.save = save
+        self.debug = debug
+        self.session_ttl = session_ttl
+        # the cap on live sessions is split evenly over the shards
+        self.max_sessions_per_shard = -(-max_sessions // shards)
+        self.sleep_time = 5
+        self.sessions = {}
+        self._shard_sessions = [{} for _ in range(shards)]
+
+        self.workers = WorkerProcesses()
+        self.inboxes = [self.workers.inbox(shard) for shard in range(shards)]
+
+        self._stop_event = threading.Event()
+        self.ready = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def start(self):
+        """Fork the shard processes, call this before starting any threads."""
+        for shard in range(self.shards):
+            self.workers.start(
+                shard,
+                f"firehose-shard-{shard}",
+                run_shard,
+                save=self.save,
+                sleep_time=self.sleep_time,
+                debug=self.debug,
+                session_ttl=self.session_ttl,
+                max_sessions=self.max_sessions_per_shard,
+            )
+
+    def notify(self, topic, payload, now=None):
+        now = now or django.utils.timezone.now()
+        self.inboxes[shard_for(topic, self.shards)].put((topic, payload, now))
+
+    def receive(self, report):
+        shard, sessions = report
+        self.merge(shard, sessions)
+
+    def merge(self, shard, sessions):
+        self._shard_sessions[shard] = {session.topic: session.resolve() for session in sessions}
+        merged = {}
+        for shard_sessions in self._shard_sessions:
+            merged.update(shard_sessions)
+        self.sessions = merged
+
+    def metrics(self):
+        sessions = list(self.sessions.values())
+        return {
+            "pitcrew_firehose_shards": len(self.workers.alive()),
+            "pitcrew_firehose_sessions": len(sessions),
+            "pitcrew_firehose_laps": sum(session.laps for session in sessions),
+            "pitcrew_firehose_bytes": sum(session.size for session in sessions),
+        }
+
+    def run(self):
+        if not self.workers.processes:
+            self.start()
+        self.ready = True
+        try:
+            while not self.stopped():
+                try:
+                    self.receive(self.workers.outbox.get(timeout=1))
+                except queue.Empty:
+                    pass
+
+                dead = self.workers.dead()
+                if dead:
+                    logging.error(f"firehose shards died: {', '.join(p.name for p in dead.values())}")
+                    return
+        finally:
+            # the final reports of the shards
+            self.workers.stop(self.receive)
+            logging.info("ShardedFirehose stopped")
@@ -0,0 +1,225 @@
+import datetime
+import logging
+import sqlite3
+import threading
+
+from django.db import connection
+
+from .firehose import Firehose
+from .session import Lap
+from .session_saver import SessionSaver
+
+
+def _isoformat(value):
+    # pandas timestamps can have nanoseconds, datetime.fromisoformat doesn't read them
+    if hasattr(value, "to_pydatetime"):
+        value = value.to_pydatetime()
+    return value.isoformat()
+
+
+class Spool:
+    """Append only local store for laps that are not in the database yet.
+
+    The SessionSaver writes the finished laps and the header of their session
+    here right away, the SpoolDrainer moves them to the database in batches.
+    The spool is a SQLite file in WAL mode, it survives a restart of the pod.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                topic TEXT PRIMARY KEY,
+                car_class TEXT,
+                start TEXT,
+                end TEXT
+            )
+            """
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS laps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT,
+                number INTEGER,
+                start TEXT,
+                end TEXT,
+                length REAL,
+                valid INTEGER,
+                time REAL
+            )
+            """
+        )
+
+    def append(self, session, laps):
+        with self._lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.execute(
+                    """
+                    INSERT INTO sessions (topic, car_class, start, end) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (topic) DO UPDATE SET end = excluded.end
+                    """,
+                    (session.id, str(session.car_class), _isoformat(session.start), _isoformat(session.end)),
+                )
+                self.db.executemany(
+                    "INSERT INTO laps (topic, number, start, end, length, valid, time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            session.id,
+                            int(lap.number),
+                            _isoformat(lap.start),
+                            _isoformat(lap.end),
+                            float(lap.length),
+                            None if lap.valid is None else bool(lap.valid),
+                            None if lap.time is None else float(lap.time),
+                        )
+                        for lap in laps
+                    ],
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def pending(self, limit=500):
+        """The oldest laps with the header of their session."""
+        with self._lock:
+            return self.db.execute(
+                """
+                SELECT laps.id, laps.topic, sessions.car_class, sessions.start, sessions.end,
+                    laps.number, laps.start, laps.end, laps.length, laps.valid, laps.time
+                FROM laps JOIN sessions ON laps.topic = sessions.topic
+                ORDER BY laps.id LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+
+    def delete(self, ids):
+        with self._lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM laps WHERE id = ?", [(id,) for id in ids])
+            # sessions without laps are only needed while their laps are spooled
+            self.db.execute("DELETE FROM sessions WHERE topic NOT IN (SELECT topic FROM laps)")
+            self.db.execute("COMMIT")
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM laps").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+class SpoolDrainer:
+    """Move the laps of the spool to the database.
+
+    Laps are saved in batches with the SessionSaver. If the database is down or
+    rejects a batch, the drainer backs off exponentially and tries again, the
+    laps stay in the spool until they are saved.
+    """
+
+    def __init__(self, spool, batch_size=500, interval=1, max_backoff=60):
+        self.spool = spool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.backoff = 0
+
+        # the sessions of the spooled laps, keeps their database records between batches
+        self.firehose = Firehose()
+        self.saver = SessionSaver(self.firehose)
+        # the drainer saves the sessions itself
+        self.firehose.event_callback = None
+
+        self.drained = 0
+        self.errors = 0
+        self._stop_event = threading.Event()
+        self.ready = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def drain(self):
+        """Save one batch, returns the seconds to wait before the next one."""
+        rows = self.spool.pending(self.batch_size)
+        if not rows:
+            self.firehose.clear_sessions()
+            return self.interval
+
+        laps = {}
+        sessions = {}
+        for id, topic, car_class, session_start, session_end, number, start, end, length, valid, time in rows:
+            session_start = datetime.datetime.fromisoformat(session_start)
+            session = self.firehose.sessions.get(topic) or self.firehose.new_session(
+                topic, {"CarClass": car_class}, session_start
+            )
+            if not session:
+                logging.error(f"{topic}: Dropping spooled lap {number} of invalid session")
+                laps[id] = Lap(number, finished=True)
+                laps[id].persisted = True
+                continue
+            session.end = max(session.end, datetime.datetime.fromisoformat(session_end))
+            # the laps of the drainer sessions are keyed by spool id, a lap number can be spooled
+            # again, e.g. after a restart of the session, a retried row keeps its lap
+            lap = session.laps.get(id)
+            if not lap:
+                lap = Lap(
+                    number,
+                    time=time,
+                    valid=None if valid is None else bool(valid),
+                    length=length,
+                    start=datetime.datetime.fromisoformat(start),
+                    end=datetime.datetime.fromisoformat(end),
+                    finished=True,
+                )
+                session.laps[id] = lap
+            laps[id] = lap
+            sessions[topic] = session
+
+        self.saver.save_sessions(list(sessions.values()))
+        self.firehose.latest_update = max(session.end for session in self.firehose.sessions.values())
+
+        saved = [id for id, lap in laps.items() if lap.persisted]
+        self.spool.delete(saved)
+        self.drained += len(saved)
+        if len(saved) < len(rows):
+            self.errors += 1
+            # the connection might be broken, let django open a new one
+            connection.close_if_unusable_or_obsolete()
+            self.backoff = min(max(self.backoff * 2, self.interval), self.max_backoff)
+            logging.warning(f"Saved {len(saved)} of {len(rows)} spooled laps, retrying in {self.backoff}s")
+            return self.backoff
+
+        self.backoff = 0
+        # more laps might be waiting
+        return 0 if len(rows) == self.batch_size else self.interval
+
+    def metrics(self):
+        return {
+            "pitcrew_spool_laps": len(self.spool),
+            "pitcrew_spool_drained_total": self.drained,
+            "pitcrew_spool_errors_total": self.errors,
+            "pitcrew_spool_backoff_seconds": self.backoff,
+        }
+
+    def run(self):
+        self.ready = True
+        while not self.stopped():
+            try:
+                wait = self.drain()
+            except Exception as e:
+                logging.exception(f"Error draining the spool: {e}")
+                self.errors += 1
+                self.backoff = min(max(self.backoff * 2, self.interval), self.max_backoff)
+                wait = self.backoff
+            self._stop_event.wait(wait)
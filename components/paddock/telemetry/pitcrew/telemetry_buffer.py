@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# the channels the feature extraction of a segment needs, Time is the _time of the row in ns
+CHANNELS = {
+    "DistanceRoundTrack": np.float64,
+    "Brake": np.float64,
+    "SpeedMs": np.float64,
+    "Throttle": np.float64,
+    "Gear": np.float64,
+    "CurrentLapTime": np.float64,
+    "SteeringAngle": np.float64,
+    "CurrentLap": np.float64,
+    "Time": np.int64,
+}
+
+
+def _nanoseconds(time):
+    # like DataFrame["_time"].astype("int64"), also for datetime and None
+    return pd.Timestamp(time).value
+
+
+class TelemetryFrame:
+    """The telemetry of a segment, a read only view of a TelemetryBuffer block."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["Time"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def to_df(self):
+        return pd.DataFrame(self.columns)
+
+
+class TelemetryBuffer:
+    """Columnar store for the telemetry of the segment a driver is in.
+
+    Rows are written into preallocated typed arrays, one per channel. A
+    finished segment is handed off as a TelemetryFrame of views, nothing is
+    copied. When a block is full, the rows of the current segment move to a
+    new block. Blocks are not reused, a handed off frame might still be
+    waiting for the History worker, it keeps its block alive.
+    """
+
+    def __init__(self, channels=CHANNELS, capacity=8192):
+        self.channels = channels
+        self.capacity = capacity
+        self.blocks = 0
+        self._new_block()
+
+    def _new_block(self, keep=0):
+        columns = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self.channels.items()}
+        if keep:
+            for name, column in columns.items():
+                column[:keep] = self.columns[name][self.start : self.end]
+        self.columns = columns
+        self.start = 0
+        self.end = keep
+        self.blocks += 1
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, time, telemetry):
+        if self.end == self.capacity:
+            if len(self) == self.capacity:
+                # a segment longer than a block
+                self.capacity *= 2
+            self._new_block(keep=len(self))
+        row = self.end
+        for name, column in self.columns.items():
+            if name == "Time":
+                column[row] = _nanoseconds(time)
+            else:
+                value = telemetry.get(name)
+                column[row] = np.nan if value is None else value
+        self.end += 1
+
+    def finish(self):
+        """Hand off the rows of the current segment and start the next one."""
+        views = {}
+        for name, column in self.columns.items():
+            view = column[self.start : self.end]
+            view.flags.writeable = False
+            views[name] = view
+        self.start = self.end
+        return TelemetryFrame(views)
+
+    def clear(self):
+        self.start = self.end
@@ -0,0 +1,80 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+
+from django import db
+
+
+def run_worker(target, *args, **kwargs):
+    # the parent owns the shutdown, it sends None to stop the worker
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target(*args, **kwargs)
+
+
+class WorkerProcesses:
+    """Worker processes forked from the crew.
+
+    Every worker runs target(key, inbox, outbox, **kwargs): it reads its own
+    inbox until it gets None and sends its results to the outbox shared by
+    all workers. Start the workers before starting any threads.
+    """
+
+    def __init__(self):
+        self.context = multiprocessing.get_context("fork")
+        self.outbox = self.context.Queue()
+        # key -> queue of the worker
+        self.inboxes = {}
+        # key -> process of the worker
+        self.processes = {}
+
+    def inbox(self, key):
+        """The inbox of a worker, messages put in before it is started are waiting for it."""
+        if key not in self.inboxes:
+            self.inboxes[key] = self.context.Queue()
+        return self.inboxes[key]
+
+    def start(self, key, name, target, **kwargs):
+        # every process needs its own database connection
+        db.connections.close_all()
+        p = self.context.Process(
+            target=run_worker,
+            args=(target, key, self.inbox(key), self.outbox),
+            kwargs=kwargs,
+            name=name,
+            daemon=True,
+        )
+        p.start()
+        self.processes[key] = p
+        logging.debug(f"started {p.name} with pid {p.pid}")
+        return self.inboxes[key]
+
+    def remove(self, key):
+        self.inboxes.pop(key, None)
+        return self.processes.pop(key, None)
+
+    def alive(self):
+        return [p for p in self.processes.values() if p.is_alive()]
+
+    def dead(self):
+        return {key: p for key, p in self.processes.items() if not p.is_alive()}
+
+    def stop(self, receive, timeout=60):
+        """Stop the workers, every result they still send is passed to receive."""
+        for inbox in self.inboxes.values():
+            inbox.put(None)
+        # keep reading, a worker can't exit with unread data in its queue
+        deadline = time.monotonic() + timeout
+        while self.alive() and time.monotonic() < deadline:
+            try:
+                receive(self.outbox.get(timeout=1))
+            except queue.Empty:
+                pass
+        # what was sent right before the workers exited
+        while True:
+            try:
+                receive(self.outbox.get(timeout=0.1))
+            except queue.Empty:
+                break
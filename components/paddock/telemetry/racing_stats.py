@@ -3,7 +3,8 @@ from datetime import datetime, timedelta
 from django.db import connection
 from django.db.models import CharField, Count, Max, Q, Value
 
-from telemetry.models import FastLap, Game, Lap, Track
+from telemetry.dimensions import dimensions
+from telemetry.models import FastLap, Lap, Track
 
 
 class RacingStats:
@@ -135,7 +136,7 @@ class RacingStats:
         where = []
         filter_game = None
         if game:
-            filter_game = Game.objects.get(name=game)
+            filter_game = dimensions.game(game)
         if track:
             track = Track.objects.get(name=track)
             where.append(f" track_id={track.pk}")
@@ -0,0 +1,55 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from telemetry.coach_feed import coach_feed
+from telemetry.dimensions import dimensions
+from telemetry.models import Car, CarClass, Coach, Driver, Game, SessionType, Track
+
+
+@receiver(post_save, sender=Driver, dispatch_uid="dimension_cache_driver_save_receiver")
+@receiver(post_delete, sender=Driver, dispatch_uid="dimension_cache_driver_delete_receiver")
+@receiver(post_save, sender=Game, dispatch_uid="dimension_cache_game_save_receiver")
+@receiver(post_delete, sender=Game, dispatch_uid="dimension_cache_game_delete_receiver")
+@receiver(post_save, sender=Car, dispatch_uid="dimension_cache_car_save_receiver")
+@receiver(post_delete, sender=Car, dispatch_uid="dimension_cache_car_delete_receiver")
+@receiver(post_save, sender=CarClass, dispatch_uid="dimension_cache_car_class_save_receiver")
+@receiver(post_delete, sender=CarClass, dispatch_uid="dimension_cache_car_class_delete_receiver")
+@receiver(post_save, sender=Track, dispatch_uid="dimension_cache_track_save_receiver")
+@receiver(post_delete, sender=Track, dispatch_uid="dimension_cache_track_delete_receiver")
+@receiver(post_save, sender=SessionType, dispatch_uid="dimension_cache_session_type_save_receiver")
+@receiver(post_delete, sender=SessionType, dispatch_uid="dimension_cache_session_type_delete_receiver")
+def dimension_cache_receiver(sender, instance, **kwargs):
+    """Drop changed drivers, games, cars, car classes, tracks and session types from the dimension cache."""
+    dimensions.invalidate(sender, instance.pk)
+
+
+@receiver(post_init, sender=Coach, dispatch_uid="coach_feed_init_receiver")
+def coach_feed_init_receiver(sender, instance, **kwargs):
+    # coaches save their status all the time, only changes of these fields are published
+    # deferred fields are not loaded, they must not cause a query
+    instance._feed_state = (instance.__dict__.get("enabled"), instance.__dict__.get("mode"))
+
+
+@receiver(post_save, sender=Coach, dispatch_uid="coach_feed_save_receiver")
+def coach_feed_save_receiver(sender, instance, created, **kwargs):
+    """Publish changes of Coach.enabled and Coach.mode to the coach watchers."""
+    state = (instance.enabled, instance.mode)
+    if created or state != instance._feed_state:
+        instance._feed_state = state
+        publish_coach_change(instance, instance.enabled)
+
+
+@receiver(post_delete, sender=Coach, dispatch_uid="coach_feed_delete_receiver")
+def coach_feed_delete_receiver(sender, instance, **kwargs):
+    publish_coach_change(instance, False)
+
+
+def publish_coach_change(coach, enabled):
+    coach_feed.publish(
+        {
+            "driver_id": coach.pk,
+            "driver": coach.driver.name,
+            "enabled": enabled,
+            "mode": coach.mode,
+        }
+    )
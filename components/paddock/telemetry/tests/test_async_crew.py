@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from telemetry.pitcrew.async_crew import AsyncCoachWatcher
+from telemetry.pitcrew.history import History
+
+
+class StepHistory(History):
+    def __init__(self):
+        super().__init__()
+        self.steps = []
+
+    def step(self):
+        self.steps.append(threading.current_thread().name)
+
+
+class TestAsyncCrew(TestCase):
+    def test_history_task(self):
+        history = StepHistory()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            watcher = AsyncCoachWatcher(firehose=None, fanout=None)
+            watcher.loop = loop
+            watcher.executor = executor
+
+            # coaches are started from the executor
+            worker = await loop.run_in_executor(executor, watcher.start_history, "jim", history)
+            self.assertTrue(history.threaded)
+            await asyncio.sleep(0.1)
+            self.assertTrue(watcher.is_alive(worker))
+            # the queued work is picked up right away
+            self.assertEqual(len(history.steps), 1)
+
+            # woken up from another thread, no polling
+            threading.Thread(target=history.wakeup).start()
+            await asyncio.sleep(0.1)
+            self.assertEqual(len(history.steps), 2)
+
+            history.disconnect()
+            await asyncio.wait_for(asyncio.wrap_future(worker), 1)
+            self.assertFalse(watcher.is_alive(worker))
+
+        asyncio.run(main())
+        executor.shutdown()
+        self.assertTrue(all(name.startswith("db") for name in history.steps))
+
+    def test_scheduler_is_rejected(self):
+        with self.assertRaises(ValueError):
+            AsyncCoachWatcher(firehose=None, fanout=None, scheduler=object())
+        with self.assertRaises(CommandError):
+            call_command("pitcrew", "--asyncio", "--coach-processes", "2")
@@ -0,0 +1,45 @@
+from django.test import TestCase
+
+from telemetry.models import Driver, FastLap, TrackGuide
+from telemetry.pitcrew.benchmark import features_benchmark, memory_benchmark, saver_benchmark, throughput_benchmark
+
+
+class TestBenchmark(TestCase):
+    def test_throughput_firehose(self):
+        results = throughput_benchmark(target="firehose", drivers=3, session_ids=["1673613558"], limit=100)
+        self.assertEqual(results["messages"], 300)
+        self.assertEqual(results["errors"], 0)
+        self.assertGreater(results["messages_per_second"], 0)
+        self.assertLessEqual(results["p50_us"], results["p99_us"])
+
+    def test_throughput_coach_rolls_back(self):
+        results = throughput_benchmark(target="coach", drivers=2, session_ids=["1673613558"], limit=10)
+        self.assertEqual(results["messages"], 20)
+        # the fast lap is seeded from the recording
+        self.assertEqual(results["coaches_ready"], 2)
+        self.assertFalse(Driver.objects.filter(name__startswith="benchmark-").exists())
+        self.assertFalse(FastLap.objects.exists())
+
+    def test_throughput_track_guide(self):
+        results = throughput_benchmark(target="track_guide", drivers=2, session_ids=["1673613558"], limit=100)
+        self.assertEqual(results["errors"], 0)
+        self.assertEqual(results["coaches_ready"], 2)
+        self.assertFalse(TrackGuide.objects.exists())
+
+    def test_memory(self):
+        results = memory_benchmark(sessions=100, laps=5)
+        # the slotted objects without a Game are smaller than the ones they replace
+        self.assertGreater(results["saved_bytes_per_session"], 0)
+        self.assertGreater(results["saved_bytes_per_lap"], 0)
+
+    def test_features(self):
+        results = features_benchmark(session_id="1673613558", limit=2000)
+        self.assertGreater(results["segments"], 1)
+        self.assertGreater(results["pandas_us_per_segment"], 0)
+        self.assertGreater(results["numpy_us_per_segment"], 0)
+
+    def test_saver_queries_do_not_grow_with_laps(self):
+        few = saver_benchmark(sessions=3, laps=1)
+        many = saver_benchmark(sessions=3, laps=10)
+        self.assertEqual(few["cycle_queries"], many["cycle_queries"])
+        self.assertFalse(Driver.objects.filter(name__startswith="benchmark-").exists())
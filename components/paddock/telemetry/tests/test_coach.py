@@ -4,7 +4,7 @@ from pprint import pprint  # noqa
 
 from django.test import TransactionTestCase
 
-from telemetry.models import Coach, Driver
+from telemetry.models import Coach, Driver, LiveFeatures
 from telemetry.pitcrew.coach import Coach as PitCrewCoach
 from telemetry.pitcrew.history import History
 
@@ -58,10 +58,8 @@ class TestCoach(TransactionTestCase):
             history.init()
             history._do_init = False
 
-        # get the fast lap for the driver
-        fast_lap = driver.fast_laps.get(game=history.game, track=history.track, car=history.car)
-        driver_segments = fast_lap.data
-        self.assertIsNone(driver_segments)
+        # no live features of the driver yet
+        self.assertFalse(LiveFeatures.objects.filter(driver=driver).exists())
 
         captured_responses = []
         try:
@@ -84,11 +82,11 @@ class TestCoach(TransactionTestCase):
         # pprint(captured_responses, width=200)
         self.assertEqual(captured_responses, expected_responses)
 
-        # get the fast lap for the driver
-        fast_lap.refresh_from_db()
-        driver_segments = fast_lap.data["segments"]
-        self.assertEqual(len(driver_segments), 8)
-        self.assertEqual(len(driver_segments[1].live_features["brake"]), 16)
+        # the live features of the driver
+        history.flush_live_features()
+        live_features = LiveFeatures.objects.filter(driver=driver, game=history.game, track=history.track)
+        self.assertEqual(len(set(live_features.values_list("turn", flat=True))), 8)
+        self.assertEqual(live_features.filter(turn=1).count(), 16)
 
     def test_track_guide(self):
         # Automobilista 2 / BMW M4 GT4/  Monza:Monza_2020
@@ -0,0 +1,131 @@
+import queue
+from unittest import mock
+
+from django.test import TestCase
+
+from telemetry.models import Coach, Driver
+from telemetry.pitcrew.coach_pool import CoachPool, HashRing, run_coach_worker
+from telemetry.pitcrew.coach_watcher import CoachWatcher
+from telemetry.pitcrew.fanout import Fanout
+from telemetry.pitcrew.firehose import Firehose
+
+from .test_firehose import topic
+
+
+class FakeCoach:
+    def __init__(self, history, coach_model, debug=False):
+        self.history = history
+
+    def notify(self, topic, payload, now=None):
+        return ("/coach/jim", [f"{payload['n']}a", f"{payload['n']}b"])
+
+
+class TestCoachPool(TestCase):
+    def messages(self, inbox):
+        messages = []
+        while not inbox.empty():
+            messages.append(inbox.get_nowait())
+        return messages
+
+    def test_hash_ring(self):
+        ring = HashRing()
+        for node in range(4):
+            ring.add(node)
+        drivers = [f"driver{i}" for i in range(1000)]
+        owners = {driver: ring.node_for(driver) for driver in drivers}
+        # stable across processes and spread over all nodes
+        other = HashRing()
+        for node in reversed(range(4)):
+            other.add(node)
+        self.assertEqual(owners, {driver: other.node_for(driver) for driver in drivers})
+        self.assertEqual(set(owners.values()), {0, 1, 2, 3})
+
+        # only the drivers of the node that left move
+        ring.remove(2)
+        for driver in drivers:
+            if owners[driver] != 2:
+                self.assertEqual(ring.node_for(driver), owners[driver])
+            else:
+                self.assertIn(ring.node_for(driver), {0, 1, 3})
+
+        # only drivers move to the node that joined
+        ring.add(4)
+        moved = [driver for driver in drivers if ring.node_for(driver) == 4]
+        self.assertTrue(0 < len(moved) < 500)
+        for driver in drivers:
+            if driver not in moved and owners[driver] != 2:
+                self.assertEqual(ring.node_for(driver), owners[driver])
+
+    def test_rebalance(self):
+        pool = CoachPool()
+        inboxes = [queue.Queue() for _ in range(3)]
+        pool.join(0, inboxes[0])
+        coaches = {}
+        for i in range(30):
+            driver = Driver.objects.create(name=f"driver{i}")
+            coaches[driver.name] = Coach.objects.create(driver=driver)
+            pool.register(driver.name, coaches[driver.name])
+        self.assertEqual(len(self.messages(inboxes[0])), 30)
+
+        pool.join(1, inboxes[1])
+        moved = self.messages(inboxes[0])
+        started = self.messages(inboxes[1])
+        self.assertTrue(moved)
+        self.assertEqual([("stop", message[1]) for message in started], moved)
+        self.assertEqual(pool.rebalanced, len(moved))
+
+        # the telemetry goes to the owner
+        driver = started[0][1]
+        pool.notify(topic(driver), {"n": 1})
+        self.assertEqual(self.messages(inboxes[1]), [("telemetry", topic(driver), {"n": 1}, None)])
+
+        # the coaches of a worker that died are started on the other one
+        pool.leave(1)
+        self.assertEqual(sorted(message[1] for message in self.messages(inboxes[0])), sorted(m[1] for m in started))
+        self.assertTrue(all(owner == 0 for owner in pool.owners.values()))
+        self.assertTrue(pool.is_alive(driver))
+
+        pool.unregister(driver)
+        self.assertEqual(self.messages(inboxes[0]), [("stop", driver)])
+        self.assertFalse(pool.is_alive(driver))
+
+    @mock.patch("telemetry.pitcrew.coach_pool.create_coach", FakeCoach)
+    def test_run_coach_worker(self):
+        driver = Driver.objects.create(name="jim")
+        coach = Coach.objects.create(driver=driver)
+        inbox = queue.Queue()
+        outbox = queue.Queue()
+        inbox.put(("start", "jim", coach.pk, False))
+        inbox.put(("telemetry", topic("jim"), {"n": 1}, None))
+        # telemetry of drivers without coach is ignored
+        inbox.put(("telemetry", topic("joe"), {"n": 2}, None))
+        inbox.put(("stop", "jim"))
+        inbox.put(("telemetry", topic("jim"), {"n": 3}, None))
+        inbox.put(None)
+
+        run_coach_worker(0, inbox, outbox)
+
+        self.assertEqual(self.messages(outbox), [("/coach/jim", "1a"), ("/coach/jim", "1b")])
+
+    def test_coach_watcher_with_pool(self):
+        firehose = Firehose()
+        fanout = Fanout(firehose, fields=Firehose.TELEMETRY_FIELDS)
+        pool = CoachPool()
+        inbox = queue.Queue()
+        pool.join(0, inbox)
+        watcher = CoachWatcher(firehose, fanout, pool=pool)
+
+        driver = Driver.objects.create(name="jim")
+        coach = Coach.objects.create(driver=driver)
+        watcher.start_coach("jim", coach)
+        self.assertTrue(fanout.has_coach(topic("jim")))
+        watcher.check_active_coaches()
+        self.assertFalse(watcher.stopped())
+
+        fanout.notify(topic("jim"), {"n": 1})
+        watcher.stop_coaches()
+        self.assertFalse(fanout.has_coach(topic("jim")))
+        self.assertEqual(
+            [message[0] for message in self.messages(inbox)],
+            ["start", "telemetry", "stop"],
+        )
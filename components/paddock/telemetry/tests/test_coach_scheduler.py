@@ -0,0 +1,81 @@
+import threading
+import time
+
+from django.test import TestCase
+
+from telemetry.pitcrew.coach_scheduler import CoachScheduler
+from telemetry.pitcrew.history import History
+
+
+class SlowHistory(History):
+    def __init__(self, name, log):
+        super().__init__()
+        self.name = name
+        self.log = log
+        self.running = 0
+        self.overlaps = 0
+
+    def step(self):
+        self.running += 1
+        if self.running > 1:
+            self.overlaps += 1
+        self.log.append(self.name)
+        time.sleep(0.01)
+        self.running -= 1
+
+
+class TestCoachScheduler(TestCase):
+    def setUp(self):
+        self.scheduler = CoachScheduler(workers=3)
+        self.scheduler.start()
+        self.addCleanup(self.scheduler.stop)
+
+    def wait_idle(self):
+        for _ in range(200):
+            if not self.scheduler.queue and not self.scheduler._states:
+                return
+            time.sleep(0.01)
+        self.fail("scheduler didn't get idle")
+
+    def test_history_runs_one_job_at_a_time(self):
+        log = []
+        histories = [SlowHistory(f"driver{i}", log) for i in range(5)]
+        for history in histories:
+            self.scheduler.add(history)
+        self.wait_idle()
+        self.assertEqual(sorted(log), sorted(history.name for history in histories))
+
+        # wakeups from many threads while the job is running
+        threads = [threading.Thread(target=histories[0].wakeup) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wait_idle()
+
+        self.assertTrue(all(history.threaded for history in histories))
+        self.assertEqual(sum(history.overlaps for history in histories), 0)
+        # the wakeups are coalesced, but the last one is never lost
+        self.assertGreaterEqual(log.count("driver0"), 2)
+        self.assertLessEqual(log.count("driver0"), 21)
+
+        metrics = self.scheduler.metrics()
+        self.assertEqual(metrics["pitcrew_coach_scheduler_jobs_total"], len(log))
+        self.assertEqual(metrics["pitcrew_coach_scheduler_queue_depth"], 0)
+        self.assertGreater(metrics["pitcrew_coach_scheduler_job_p50_seconds"], 0)
+
+    def test_errors_do_not_stop_the_workers(self):
+        history = History()
+        history.step = lambda: 1 / 0
+        self.scheduler.add(history)
+        self.wait_idle()
+        self.assertEqual(self.scheduler.errors, 1)
+        self.assertTrue(self.scheduler.is_alive())
+
+    def test_disconnected_history_is_not_run(self):
+        log = []
+        history = SlowHistory("driver", log)
+        history.do_run = False
+        self.scheduler.add(history)
+        self.wait_idle()
+        self.assertEqual(log, [])
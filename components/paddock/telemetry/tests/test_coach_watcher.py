@@ -0,0 +1,83 @@
+from unittest import mock
+
+import django.utils.timezone
+from django.test import TestCase
+
+from telemetry.models import Coach, Driver
+from telemetry.pitcrew.coach_watcher import CoachWatcher
+from telemetry.pitcrew.fanout import CoachQueue, Fanout
+from telemetry.pitcrew.firehose import Firehose
+
+from .test_firehose import topic
+
+
+class TestCoachWatcher(TestCase):
+    def setUp(self):
+        self.firehose = Firehose()
+        self.fanout = Fanout(self.firehose, fields=Firehose.TELEMETRY_FIELDS)
+        self.watcher = CoachWatcher(self.firehose, self.fanout)
+        self.watcher.listen()
+        # no History threads
+        patcher = mock.patch.object(CoachWatcher, "start_history")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.watcher.stop_coaches)
+
+        self.driver = Driver.objects.create(name="jim")
+        self.coach = Coach.objects.create(driver=self.driver)
+        session = self.firehose.new_session(topic("jim"), {}, django.utils.timezone.now())
+        session.driver = self.driver
+
+    def save_coach(self, **fields):
+        for name, value in fields.items():
+            setattr(self.coach, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coach.save()
+
+    def test_new_driver_is_looked_up_once(self):
+        with self.assertNumQueries(1):
+            self.watcher.watch_once()
+        with self.assertNumQueries(0):
+            self.watcher.watch_once()
+        self.assertEqual(self.watcher.active_coaches, {})
+
+    def test_coach_changes(self):
+        self.watcher.watch_once()
+
+        self.save_coach(enabled=True)
+        self.watcher.watch_once()
+        self.assertTrue(self.fanout.has_coach(topic("jim")))
+        # the coach runs off the ingest thread
+        coach_queue = self.watcher.active_coaches["jim"][1]
+        self.assertIsInstance(coach_queue, CoachQueue)
+        self.assertEqual(len(self.watcher.active_coaches["jim"][2]), 2)
+
+        # status updates of the coach are no changes
+        self.save_coach(status="running")
+        self.assertEqual(len(self.watcher.changes), 0)
+
+        self.save_coach(mode=Coach.MODE_DEBUG)
+        self.watcher.watch_once()
+        self.assertEqual(self.watcher.active_coaches["jim"][3].mode, Coach.MODE_DEBUG)
+
+        self.save_coach(enabled=False)
+        with self.assertNumQueries(0):
+            self.watcher.watch_once()
+        self.assertFalse(self.fanout.has_coach(topic("jim")))
+        self.assertFalse(coach_queue.do_run)
+
+    def test_coach_of_driver_without_session_is_not_started(self):
+        driver = Driver.objects.create(name="joe")
+        coach = Coach.objects.create(driver=driver)
+        with self.captureOnCommitCallbacks(execute=True):
+            coach.enabled = True
+            coach.save()
+        self.watcher.watch_once()
+        self.assertNotIn("joe", self.watcher.active_coaches)
+
+    def test_driver_of_unsaved_session_is_looked_up(self):
+        # with a spool the session saver leaves the driver name in the session
+        self.firehose.new_session(topic("joe"), {}, django.utils.timezone.now())
+        self.firehose.new_session(topic("new"), {}, django.utils.timezone.now())
+        driver = Driver.objects.create(name="joe")
+        self.assertEqual(self.watcher.drivers(), {self.driver, driver})
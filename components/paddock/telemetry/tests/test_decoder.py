@@ -0,0 +1,46 @@
+import json
+
+from django.test import TestCase
+
+from telemetry.pitcrew.decoder import Decoder, orjson
+from telemetry.pitcrew.firehose import Firehose
+
+
+class TestDecoder(TestCase):
+    payload = json.dumps(
+        {
+            "time": 1673613558000,
+            "telemetry": {
+                "DistanceRoundTrack": 12.5,
+                "CurrentLap": 2,
+                "CurrentLapTime": 3.25,
+                "Brake": 0.0,
+                "Throttle": 1.0,
+                "CarClass": None,
+            },
+        }
+    ).encode("utf-8")
+
+    def test_full(self):
+        telemetry = Decoder(backend=Decoder.BACKEND_JSON).decode(self.payload)
+        self.assertEqual(telemetry["Throttle"], 1.0)
+        self.assertEqual(len(telemetry), 6)
+
+    def test_fields(self):
+        telemetry = Decoder(fields=Firehose.TELEMETRY_FIELDS, backend=Decoder.BACKEND_JSON).decode(self.payload)
+        # missing fields are left out, the session uses .get()
+        self.assertEqual(
+            telemetry, {"DistanceRoundTrack": 12.5, "CurrentLap": 2, "CurrentLapTime": 3.25, "CarClass": None}
+        )
+
+    def test_backends_agree(self):
+        if not orjson:
+            self.skipTest("orjson is not installed")
+        for fields in [None, Firehose.TELEMETRY_FIELDS]:
+            self.assertEqual(
+                Decoder(fields=fields, backend=Decoder.BACKEND_JSON).decode(self.payload),
+                Decoder(fields=fields, backend=Decoder.BACKEND_ORJSON).decode(self.payload),
+            )
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, Decoder, backend="yaml")
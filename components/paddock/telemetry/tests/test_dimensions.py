@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from telemetry.dimensions import DimensionCache, dimensions
+from telemetry.models import Driver, Game, SessionType
+
+
+class TestDimensionCache(TestCase):
+    def setUp(self):
+        self.cache = DimensionCache()
+
+    def test_lookup_is_cached_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            game = self.cache.game("iRacing", create=True)
+            track = self.cache.track(game, "spa", create=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.game("iRacing"), game)
+            self.assertEqual(self.cache.track(game, "spa"), track)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_rolled_back_rows_are_not_cached(self):
+        # the callbacks of a transaction that rolls back never run
+        with self.captureOnCommitCallbacks(execute=False):
+            self.cache.driver("rolled-back", create=True)
+        self.assertEqual(self.cache.metrics()["pitcrew_dimensions_rows"], 0)
+
+    def test_missing_row_raises(self):
+        with self.assertRaises(Game.DoesNotExist):
+            self.cache.game("unknown")
+
+    def test_save_invalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            driver = dimensions.driver("driver", create=True)
+        driver = Driver.objects.get(pk=driver.pk)
+        driver.name = "renamed"
+        driver.save()
+
+        with self.assertRaises(Driver.DoesNotExist):
+            dimensions.driver("driver")
+
+    def test_only_dimensions_invalidate(self):
+        with mock.patch.object(dimensions, "invalidate") as invalidate:
+            driver = Driver.objects.create(name="driver")
+            game = Game.objects.create(name="iRacing")
+            session_type = SessionType.objects.create(type="Race")
+            driver.sessions.create(session_id="1", game=game, session_type=session_type)
+        # saving the session doesn't touch the cache
+        self.assertEqual([call.args[0] for call in invalidate.call_args_list], [Driver, Game, SessionType])
+
+    def test_bounded(self):
+        cache = DimensionCache(max_size=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ["a", "b", "c"]:
+                cache.game(name, create=True)
+        self.assertEqual(cache.metrics()["pitcrew_dimensions_rows"], 2)
+
+    def test_warm_up(self):
+        game = Game.objects.create(name="iRacing")
+        game.tracks.create(name="spa")
+        game.cars.create(name="car")
+        self.cache.warm_up()
+
+        with self.assertNumQueries(0):
+            game = self.cache.game("iRacing")
+            self.cache.track(game, "spa")
+            self.cache.car(game, "car")
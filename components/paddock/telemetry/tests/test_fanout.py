@@ -0,0 +1,86 @@
+import json
+
+import django.utils.timezone
+from django.test import TestCase
+
+from telemetry.pitcrew.fanout import CoachQueue, Fanout
+from telemetry.pitcrew.firehose import Firehose
+
+from .test_firehose import telemetry, topic
+
+
+class EchoCoach:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.received = []
+
+    def notify(self, topic, telemetry, now=None):
+        if self.fail:
+            raise ValueError("coach failed")
+        self.received.append(telemetry)
+        return (f"/coach/{topic.split('/')[1]}", ["one", "two"])
+
+
+class TestFanout(TestCase):
+    def setUp(self):
+        self.firehose = Firehose()
+        self.fanout = Fanout(self.firehose, fields=Firehose.TELEMETRY_FIELDS)
+        self.published = []
+        self.fanout.publish = lambda r_topic, r_payload: self.published.append((r_topic, r_payload))
+
+    def payload(self):
+        data = telemetry()
+        data["SpeedMs"] = 42.0
+        return json.dumps({"time": 1, "telemetry": data}).encode("utf-8")
+
+    def test_dispatch_by_driver(self):
+        coach = EchoCoach()
+        self.fanout.register("jim", coach)
+        now = django.utils.timezone.now()
+
+        for driver in ["jim", "joe"]:
+            payload = self.fanout.decoder.decode(self.payload(), topic(driver))
+            self.fanout.notify(topic(driver), payload, now)
+
+        # only the coached driver gets the full telemetry
+        self.assertEqual(len(coach.received), 1)
+        self.assertEqual(coach.received[0]["SpeedMs"], 42.0)
+        self.assertEqual(self.published, [("/coach/jim", "one"), ("/coach/jim", "two")])
+        self.assertEqual(set(self.firehose.sessions.keys()), {topic("jim"), topic("joe")})
+
+        self.fanout.unregister("jim")
+        self.fanout.notify(topic("jim"), telemetry(), now)
+        self.assertEqual(len(coach.received), 1)
+        self.assertEqual(self.fanout.metrics()["pitcrew_fanout_coaches"], 0)
+        self.assertEqual(self.fanout.metrics()["pitcrew_fanout_responses_total"], 2)
+
+    def test_projection(self):
+        payload = self.fanout.decoder.decode(self.payload(), topic("joe"))
+        self.assertNotIn("SpeedMs", payload)
+
+    def test_coach_error(self):
+        self.fanout.register("jim", EchoCoach(fail=True))
+        self.fanout.notify(topic("jim"), telemetry())
+        # the firehose still gets the telemetry
+        self.assertEqual(list(self.firehose.sessions.keys()), [topic("jim")])
+        self.assertEqual(self.fanout.errors, 1)
+        self.assertEqual(self.published, [])
+
+    def test_coach_queue(self):
+        coach = EchoCoach()
+        coach_queue = CoachQueue(self.fanout, coach, "jim", max_size=2)
+        self.fanout.register("jim", coach_queue)
+        for n in range(3):
+            self.fanout.notify(topic("jim"), {"n": n})
+        # the ingest thread only queues the telemetry
+        self.assertEqual(coach.received, [])
+        self.assertEqual(self.fanout.metrics()["pitcrew_fanout_dropped_total"], 1)
+
+        coach_queue.step()
+        self.assertEqual(coach.received, [{"n": 1}, {"n": 2}])
+        self.assertEqual(len(self.published), 4)
+
+        coach_queue.disconnect()
+        self.fanout.notify(topic("jim"), {"n": 3})
+        coach_queue.step()
+        self.assertEqual(len(coach.received), 2)
@@ -0,0 +1,84 @@
+from django.test import TestCase
+
+from telemetry.models import Driver, FastLap, Game
+from telemetry.pitcrew.fast_lap_cache import FastLapCache
+from telemetry.pitcrew.history import History
+from telemetry.pitcrew.segment import Segment
+
+from .test_lookup_table import distance_time
+
+
+def segments():
+    result = []
+    for turn, (start, end) in enumerate([(0, 299), (300, 699), (700, 1000)], 1):
+        segment = Segment()
+        segment.turn = turn
+        segment.start = start
+        segment.end = end
+        segment.add_features({"start": start + 50}, type="brake")
+        result.append(segment)
+    return result
+
+
+class TestFastLapCache(TestCase):
+    def setUp(self):
+        self.cache = FastLapCache()
+        self.game = Game.objects.create(name="iRacing")
+        self.track = self.game.tracks.create(name="spa", length=1000)
+        self.car = self.game.cars.create(name="car")
+        self.fast_lap = FastLap.objects.create(
+            game=self.game,
+            track=self.track,
+            car=self.car,
+            data={"segments": segments(), "distance_time": distance_time()},
+        )
+
+    def get(self):
+        return self.cache.get(self.game, self.track, self.car, 1000)
+
+    def test_reference_is_shared(self):
+        reference = self.get()
+        # the id and modification time of the fast lap are checked
+        with self.assertNumQueries(1):
+            self.assertIs(self.get(), reference)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertGreater(self.cache.metrics()["pitcrew_fast_lap_cache_bytes"], 0)
+
+        # a saved fast lap is loaded again
+        self.fast_lap.save()
+        self.assertIsNot(self.get(), reference)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_segments_are_copies(self):
+        reference = self.get()
+        history = History()
+        other = History()
+        segments = reference.segments_for(history)
+        other_segments = reference.segments_for(other)
+
+        self.assertEqual([segment.turn for segment in segments], [1, 2, 3])
+        self.assertEqual(segments[0].previous_segment, segments[2])
+        self.assertEqual(segments[2].next_segment, segments[0])
+        self.assertIs(segments[0].history, history)
+        # the features of the fast lap are shared, the live data is not
+        self.assertEqual(segments[1].brake_feature("start"), 350)
+        self.assertIs(segments[1].brake_features(), other_segments[1].brake_features())
+        segments[1].add_live_features({"start": 360}, type="brake")
+        self.assertEqual(other_segments[1].live_features["brake"], [])
+        self.assertEqual(reference.segments[1].live_features["brake"], [])
+        self.assertIsNone(reference.segments[1].history)
+
+    def test_driver_fast_laps_are_ignored(self):
+        FastLap.objects.filter(pk=self.fast_lap.pk).update(driver=Driver.objects.create(name="jim"))
+        self.assertIsNone(self.get())
+
+    def test_eviction(self):
+        reference = self.get()
+        self.cache.max_bytes = reference.size
+        track = self.game.tracks.create(name="monza", length=1000)
+        FastLap.objects.create(
+            game=self.game, track=track, car=self.car, data={"segments": segments(), "distance_time": distance_time()}
+        )
+        self.cache.get(self.game, track, self.car, 1000)
+        self.assertEqual(self.cache.metrics()["pitcrew_fast_lap_cache_references"], 1)
+        self.assertIsNot(self.get(), reference)
@@ -0,0 +1,115 @@
+import statistics
+
+import numpy as np
+from django.test import TestCase
+from scipy.stats import zscore
+
+from telemetry.pitcrew.feature_history import FeatureHistory
+from telemetry.pitcrew.segment import Segment
+
+
+def list_values(features, feature, n=0):
+    # feature values of a segment as they were read from a list
+    if n and len(features) <= n:
+        return []
+    values = []
+    for i in range(-1, -len(features), -1):
+        value = features[i].get(feature)
+        if value and value is not None:
+            values.append(value)
+        if n and len(values) == n:
+            break
+    if n and len(values) < n:
+        return []
+    return values
+
+
+def list_avg(features, feature, n=0):
+    # avg_feature of a segment as it was computed on every call
+    values = list_values(features, feature, n=n)
+    if len(values) == 0:
+        return None
+    z_scores = zscore(values)
+    values_clean = [x for x, z in zip(values, z_scores) if abs(z) < 1]
+    if values_clean:
+        return statistics.mean(values_clean)
+    return values[0]
+
+
+class TestFeatureHistory(TestCase):
+    def test_ring(self):
+        history = FeatureHistory(depth=3)
+        self.assertEqual(history, [])
+        for lap in range(1, 6):
+            history.append({"start": lap})
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history, [{"start": 3}, {"start": 4}, {"start": 5}])
+        self.assertEqual(history[-1], {"start": 5})
+        self.assertEqual(history[0], {"start": 3})
+        with self.assertRaises(IndexError):
+            history[3]
+        self.assertEqual(history.version, 5)
+
+    def test_values_like_a_list(self):
+        features = []
+        history = FeatureHistory(depth=50)
+        for lap in range(12):
+            feature_set = {"start": [0, 120, None, 130.5, 125][lap % 5], "gear": 3}
+            features.append(feature_set)
+            history.append(feature_set)
+            for n in [0, 1, 2, 3, 5]:
+                # the oldest feature set is never used
+                self.assertEqual(history.values("start", n=n), list_values(features, "start", n=n))
+                self.assertEqual(history.values("gear", n=n), list_values(features, "gear", n=n))
+            column = history.column("start")
+            expected = [value if value else np.nan for value in [f["start"] for f in features][:0:-1]]
+            np.testing.assert_array_equal(column, expected)
+
+    def test_segment_live_data_is_bounded(self):
+        template = Segment()
+        template.time = 10.0
+        # segments pickled before the live data was bounded
+        del template.depth
+        template.live_features = {"brake": [], "throttle": [], "gear": [], "other": [{"sector_lap_time": 10.5}]}
+
+        segment = template.copy_for(None, depth=4)
+        self.assertEqual(segment.live_features["other"], [{"sector_lap_time": 10.5}])
+        for sector_lap_time in [10.2, 0.0, 8.0, 11.0, 10.4]:
+            segment.add_live_features({"sector_lap_time": sector_lap_time}, type="other")
+            segment.add_live_telemetry_frame(None)
+        self.assertEqual(len(segment.live_features["other"]), 4)
+        self.assertEqual(len(segment.live_telemetry_frames), 4)
+        self.assertEqual(segment.session_laps(), 5)
+        # 10.5 and 10.2 are dropped, 0.0 is the oldest one kept, 8.0 is an outlier
+        self.assertAlmostEqual(segment.driver_delta(), 0.4)
+
+        segment.add_live_features({"sector_lap_time": 10.1}, type="other")
+        self.assertAlmostEqual(segment.driver_delta(), 0.1)
+        self.assertEqual(Segment().driver_delta(), 10_000)
+
+    def test_stats(self):
+        segment = Segment()
+        features = []
+        for lap, force in enumerate([0.5, 0.6, 0.55, 0.9, 0.55, 0.58, 0.1, 0.6, 0.6, 0.6]):
+            feature_set = {"force": force, "gear": [3, 3, 4][lap % 3]}
+            features.append(feature_set)
+            segment.add_live_features(feature_set, type="brake")
+            for n in [0, 3]:
+                self.assertEqual(
+                    segment.avg_feature(n=n, feature="force", type="brake"), list_avg(features, "force", n=n)
+                )
+                self.assertEqual(
+                    segment.avg_feature(n=n, feature="gear", type="brake"), list_avg(features, "gear", n=n)
+                )
+
+        # computed once until the next lap
+        stats = segment.live_features["brake"].stats("force")
+        self.assertIs(segment.live_features["brake"].stats("force"), stats)
+        self.assertEqual(stats.count, 9)
+        self.assertAlmostEqual(stats.mean, np.mean([f["force"] for f in features[1:]]))
+        self.assertAlmostEqual(stats.variance, np.var([f["force"] for f in features[1:]]))
+        segment.add_live_features({"force": 0.6}, type="brake")
+        self.assertFalse(segment.live_features["brake"].has_stats("force"))
+        self.assertIsNot(segment.live_features["brake"].stats("force"), stats)
+        self.assertEqual(segment.live_features["brake"].stats("force").version, 11)
+        self.assertIsNone(segment.avg_feature(feature="force", type="unknown"))
@@ -0,0 +1,75 @@
+import datetime
+
+import django.utils.timezone
+from django.test import TestCase
+
+from telemetry.pitcrew.firehose import Firehose
+
+from .utils import get_session_df
+
+
+def topic(driver, session_id=1):
+    return f"crewchief/{driver}/{session_id}/game/track/car/Practice"
+
+
+def telemetry(distance=10.0, lap=1, lap_time=1.0, lap_time_previous=-1.0):
+    return {
+        "DistanceRoundTrack": distance,
+        "CurrentLap": lap,
+        "CurrentLapTime": lap_time,
+        "LapTimePrevious": lap_time_previous,
+        "CurrentLapIsValid": True,
+        "PreviousLapWasValid": True,
+    }
+
+
+class TestFirehose(TestCase):
+    def test_session_ttl(self):
+        firehose = Firehose(session_ttl=600)
+        now = django.utils.timezone.now()
+        firehose.notify(topic("jim"), telemetry(), now)
+        firehose.notify(topic("joe"), telemetry(), now + datetime.timedelta(seconds=500))
+
+        firehose.clear_sessions(now + datetime.timedelta(seconds=601))
+        self.assertEqual(list(firehose.sessions.keys()), [topic("joe")])
+
+        # without a time given, the clock of the telemetry is used
+        firehose.notify(topic("joe"), telemetry(), now + datetime.timedelta(seconds=1200))
+        firehose.clear_sessions()
+        self.assertEqual(list(firehose.sessions.keys()), [topic("joe")])
+
+    def test_max_sessions(self):
+        firehose = Firehose(max_sessions=2)
+        now = django.utils.timezone.now()
+        firehose.notify(topic("jim"), telemetry(), now)
+        firehose.notify(topic("joe"), telemetry(), now)
+        # jim is now the most recently updated session
+        firehose.notify(topic("jim"), telemetry(), now)
+        firehose.notify(topic("jack"), telemetry(), now)
+
+        self.assertEqual(list(firehose.sessions.keys()), [topic("jim"), topic("jack")])
+        self.assertEqual(firehose.evicted_sessions, 1)
+
+    def test_clear_persisted_laps(self):
+        session_df = get_session_df("1673613558")
+        firehose = Firehose()
+        for _, row in session_df.iterrows():
+            row = row.to_dict()
+            firehose.notify(row["topic"], row, row["_time"])
+
+        session = list(firehose.sessions.values())[0]
+        self.assertEqual(len(session.laps), 16)
+        self.assertEqual(len(session.unsaved_laps()), 15)
+        size = firehose.metrics()["pitcrew_firehose_bytes"]
+
+        for lap in session.laps.values():
+            lap.persisted = lap.finished
+
+        firehose.clear_sessions()
+
+        # the previous and the current lap are still used by the lap detection
+        self.assertEqual(list(session.laps.keys()), [16, 17])
+        metrics = firehose.metrics()
+        self.assertEqual(metrics["pitcrew_firehose_sessions"], 1)
+        self.assertEqual(metrics["pitcrew_firehose_laps"], 2)
+        self.assertLess(metrics["pitcrew_firehose_bytes"], size)
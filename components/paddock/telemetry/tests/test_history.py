@@ -1,10 +1,11 @@
 from pprint import pprint  # noqa
 
-from django.test import TransactionTestCase
+from django.test import TestCase, TransactionTestCase
 
 from telemetry.models import Driver
 from telemetry.pitcrew.coach import Coach as PitCrewCoach
 from telemetry.pitcrew.history import History
+from telemetry.pitcrew.segment import Segment
 
 from .utils import get_session_df
 
@@ -38,3 +39,65 @@ class TestHistory(TransactionTestCase):
         history.init()
 
         self.assertEqual(history.track_length, 4460)
+
+
+class TestHistorySegments(TestCase):
+    def history(self, bounds):
+        history = History()
+        for turn, (start, end) in enumerate(bounds, 1):
+            segment = Segment()
+            segment.turn = turn
+            segment.start = start
+            segment.end = end
+            history.segments.append(segment)
+        history.build_segment_index()
+        return history
+
+    def test_segment_at(self):
+        # the last segment wraps around the finish line
+        history = self.history([(100, 999), (1000, 2499), (2500, 3999), (4000, 99)])
+        self.assertEqual(history.segment_at(0), 3)
+        self.assertEqual(history.segment_at(99), 3)
+        self.assertEqual(history.segment_at(100), 0)
+        self.assertEqual(history.segment_at(1000), 1)
+        self.assertEqual(history.segment_at(3999), 2)
+        self.assertEqual(history.segment_at(4000), 3)
+        # beyond the end of the last segment and before the finish line
+        self.assertEqual(history.segment_at(4500), 3)
+        self.assertEqual(history.segment_at(-3), 3)
+
+        history = self.history([(0, 999), (1500, 2000)])
+        self.assertEqual(history.segment_at(1200), -1)
+        self.assertEqual(history.segment_at(2001), -1)
+        self.assertEqual(history.segment_at(-1), -1)
+
+    def update(self, history, meters):
+        return history.update_telemetry(meters, meters * 1000, {"DistanceRoundTrack": meters, "Gear": 3})
+
+    def test_update_telemetry(self):
+        history = self.history([(100, 999), (1000, 2499), (2500, 3999), (4000, 99)])
+        segments = list(history.segments)
+
+        self.assertFalse(self.update(history, 4000))
+        self.assertFalse(self.update(history, 50))
+        self.assertEqual(history.current_segment, 3)
+
+        # a jump across the track finishes the current segment
+        self.assertTrue(self.update(history, 3000))
+        self.assertEqual(history.current_segment, 2)
+        self.assertEqual(history.process_segments, [segments[3]])
+        frame = segments[3].live_telemetry[0]
+        self.assertEqual(list(frame["DistanceRoundTrack"]), [4000, 50])
+        self.assertEqual(list(frame["Time"]), [4000_000, 50_000])
+        self.assertEqual(len(history.telemetry), 1)
+        # the segments are not reordered
+        self.assertEqual(history.segments, segments)
+
+        # telemetry outside of all segments is dropped
+        history = self.history([(0, 999), (1500, 2000)])
+        self.update(history, 500)
+        self.assertTrue(self.update(history, 1200))
+        self.assertEqual(len(history.telemetry), 0)
+        self.assertEqual(history.previous_update_meters, 500)
+        self.assertFalse(self.update(history, 1600))
+        self.assertEqual(history.current_segment, 1)
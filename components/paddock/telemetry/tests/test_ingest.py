@@ -0,0 +1,85 @@
+import threading
+
+from django.test import TestCase
+
+from telemetry.pitcrew.ingest import Ingest
+
+
+class Observer:
+    def __init__(self):
+        self.messages = []
+
+    def notify(self, topic, payload, now=None):
+        self.messages.append((topic, payload))
+
+
+class TestIngest(TestCase):
+    def test_drop_oldest(self):
+        observer = Observer()
+        ingest = Ingest(observer, max_queue_size=3, drop_policy=Ingest.DROP_OLDEST)
+        for i in range(5):
+            ingest.notify("a", i)
+
+        ingest.drain()
+
+        self.assertEqual(observer.messages, [("a", 2), ("a", 3), ("a", 4)])
+        self.assertEqual(ingest.queued, 5)
+        self.assertEqual(ingest.dropped, 2)
+        self.assertEqual(ingest.processed, 3)
+
+    def test_keep_latest(self):
+        observer = Observer()
+        ingest = Ingest(observer, max_queue_size=3, drop_policy=Ingest.KEEP_LATEST)
+        for i in range(5):
+            ingest.notify("a", i)
+
+        ingest.drain()
+
+        self.assertEqual(observer.messages, [("a", 3), ("a", 4)])
+        self.assertEqual(ingest.dropped, 3)
+        self.assertEqual(ingest.processed, 2)
+
+    def test_batches_are_fair_and_ordered(self):
+        observer = Observer()
+        ingest = Ingest(observer, batch_size=4)
+        for i in range(4):
+            ingest.notify("a", i)
+            ingest.notify("b", i)
+
+        batch = ingest.next_batch()
+        self.assertEqual([(topic, payload) for topic, payload, now in batch], [("a", 0), ("a", 1), ("b", 0), ("b", 1)])
+
+        ingest.process(batch)
+        ingest.drain()
+        self.assertEqual([payload for topic, payload in observer.messages if topic == "a"], [0, 1, 2, 3])
+        self.assertEqual([payload for topic, payload in observer.messages if topic == "b"], [0, 1, 2, 3])
+        self.assertEqual(ingest.queues, {})
+        self.assertEqual(ingest.queue_depth(), 0)
+
+    def test_observer_errors(self):
+        class FailingObserver:
+            def notify(self, topic, payload, now=None):
+                raise ValueError("boom")
+
+        ingest = Ingest(FailingObserver())
+        ingest.notify("a", 1)
+        ingest.notify("a", 2)
+        ingest.drain()
+
+        self.assertEqual(ingest.errors, 2)
+        self.assertEqual(ingest.processed, 2)
+
+    def test_worker(self):
+        observer = Observer()
+        ingest = Ingest(observer)
+        t = threading.Thread(target=ingest.run)
+        t.start()
+        for i in range(100):
+            ingest.notify(f"topic/{i % 3}", i)
+
+        ingest.stop()
+        t.join(timeout=5)
+        ingest.drain()
+
+        self.assertEqual(len(observer.messages), 100)
+        self.assertEqual(ingest.metrics()["pitcrew_ingest_processed_total"], 100)
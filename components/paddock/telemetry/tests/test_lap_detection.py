@@ -0,0 +1,59 @@
+from django.test import TestCase
+
+from telemetry.pitcrew.firehose import Firehose
+from telemetry.pitcrew.lap_detection import detect_laps, detect_laps_rbr
+from telemetry.pitcrew.session import Session
+from telemetry.pitcrew.session_rbr import SessionRbr
+
+from .utils import get_session_df
+
+
+def lap_records(laps):
+    return [(lap.number, lap.start, lap.end, lap.length, lap.time, lap.finished, lap.valid) for lap in laps.values()]
+
+
+class TestLapDetection(TestCase):
+    def assert_parity(self, session_id, session_class, detect):
+        session_df = get_session_df(session_id)
+        session = session_class(session_df["topic"].iloc[0])
+        for _, row in session_df.iterrows():
+            row = row.to_dict()
+            session.signal(row, row["_time"])
+
+        laps = detect(session_df)
+        self.assertEqual(lap_records(laps), lap_records(session.laps))
+        return laps
+
+    def test_parity(self):
+        for session_id in [
+            "1673613558",
+            "1680321341",
+            "1681021274",
+            "1683388042",
+            "1690362827",
+            "1692140843",
+            "1692949947",
+            "1694266648",
+        ]:
+            with self.subTest(session_id=session_id):
+                self.assert_parity(session_id, Session, detect_laps)
+
+    def test_parity_rbr(self):
+        laps = self.assert_parity("1703706617", SessionRbr, detect_laps_rbr)
+        self.assertEqual(len(laps), 1)
+
+    def test_missing_fields(self):
+        # older recordings don't have LapTimePrevious, the streaming lap detection ignores them as well
+        self.assertEqual(detect_laps(get_session_df("1672395579")), {})
+
+    def test_firehose(self):
+        session_df = get_session_df("1673613558")
+        topic = session_df["topic"].iloc[0]
+        firehose = Firehose()
+        firehose.add_session_df(topic, session_df)
+
+        session = firehose.sessions[topic]
+        self.assertEqual(len(session.laps), 16)
+        self.assertEqual(session.current_lap.number, 17)
+        self.assertEqual(session.previous_lap.number, 16)
+        self.assertEqual(firehose.latest_update, session_df["_time"].iloc[-1])
@@ -0,0 +1,136 @@
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+
+from telemetry.models import Coach, Driver, FastLap, Game, LiveFeatures
+from telemetry.pitcrew.coach_scheduler import CoachScheduler
+from telemetry.pitcrew.history import History
+from telemetry.pitcrew.live_features import LiveFeatureStore
+from telemetry.pitcrew.segment import Segment
+
+
+def features(lap):
+    return {"brake": {"start": 100 + lap}, "throttle": {}, "gear": {"gear": 3}, "other": {"sector_lap_time": lap}}
+
+
+class TestLiveFeatureStore(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(name="iRacing")
+        self.track = self.game.tracks.create(name="spa", length=1000)
+        self.car = self.game.cars.create(name="car")
+        self.driver = Driver.objects.create(name="jim")
+
+    def store(self, **kwargs):
+        return LiveFeatureStore(self.driver, self.game, self.car, self.track, "1", **kwargs)
+
+    def test_batches(self):
+        store = self.store(flush_interval=3600)
+        with self.assertNumQueries(0):
+            store.add(1, 1, features(1))
+            store.add(2, 1, features(1))
+        # the first segment of the next lap writes the batch of the last one
+        with self.assertNumQueries(1):
+            store.add(1, 2, features(2))
+        self.assertEqual(LiveFeatures.objects.count(), 2)
+        self.assertEqual(len(store.pending), 1)
+
+        store.flush()
+        self.assertEqual(store.rows_written, 3)
+        with self.assertNumQueries(0):
+            store.flush()
+
+        store = self.store(flush_interval=0)
+        store.add(2, 2, features(2))
+        self.assertEqual(LiveFeatures.objects.count(), 4)
+
+    def test_failed_batch_is_dropped(self):
+        store = self.store(flush_interval=3600)
+        store.add(1, 1, features(1))
+        store.add(2, 1, features(1))
+        with mock.patch.object(LiveFeatures.objects, "bulk_create", side_effect=OperationalError("gone")):
+            store.add(1, 2, features(2))
+        self.assertEqual(store.rows_dropped, 2)
+        self.assertEqual(store.rows_written, 0)
+
+        store.flush()
+        self.assertEqual(store.rows_written, 1)
+        self.assertEqual(LiveFeatures.objects.count(), 1)
+
+    def test_load_last_laps(self):
+        store = self.store()
+        for lap in range(1, 6):
+            store.add(1, lap, features(lap))
+        store.add(2, 5, features(5))
+        store.flush()
+
+        segments = store.load(laps=3)
+        self.assertEqual(sorted(segments.keys()), [1, 2])
+        self.assertEqual([f["start"] for f in segments[1]["brake"]], [103, 104, 105])
+        self.assertEqual([f["sector_lap_time"] for f in segments[1]["other"]], [3, 4, 5])
+        self.assertEqual(segments[2]["gear"], [{"gear": 3}])
+
+        # other combos are not loaded
+        track = self.game.tracks.create(name="monza", length=1000)
+        self.assertEqual(LiveFeatureStore(self.driver, self.game, self.car, track).load(), {})
+
+    def test_backfill_from_driver_fast_lap(self):
+        # the live features as History kept them in the driver FastLap
+        segment = Segment()
+        segment.turn = 1
+        segment.live_features = {
+            "brake": [{"start": 101}, {"start": 102}, {"start": 103}],
+            "throttle": [{}, {}, {}],
+            "gear": [{"gear": 3}, {"gear": 4}],
+            "other": [],
+        }
+        data = {"segments": {1: segment}}
+        FastLap.objects.create(game=self.game, track=self.track, car=self.car, driver=self.driver, data=data)
+
+        segments = self.store().load(laps=2)
+        self.assertEqual(segments[1]["brake"], [{"start": 102}, {"start": 103}])
+        self.assertEqual(segments[1]["gear"], [{"gear": 3}, {"gear": 4}])
+        self.assertEqual(self.store().rows().count(), 3)
+        # copied once
+        self.store().load()
+        self.assertEqual(self.store().rows().count(), 3)
+
+    def test_history_init_driver(self):
+        self.store(flush_interval=0).add(2, 1, features(1))
+
+        history = History()
+        history.driver, history.game, history.car, history.track = self.driver, self.game, self.car, self.track
+        for turn in [1, 2]:
+            segment = Segment()
+            segment.turn = turn
+            history.segments.append(segment)
+        history.init_driver()
+        self.assertEqual(history.segments[0].live_features["brake"], [])
+        self.assertEqual(history.segments[1].live_features["brake"], [{"start": 101}])
+
+        history = History()
+        history.driver, history.game, history.car, history.track = self.driver, self.game, self.car, self.track
+        history.coach_mode = Coach.MODE_TRACK_GUIDE
+        segment = Segment()
+        segment.turn = 2
+        history.segments.append(segment)
+        history.init_driver()
+        self.assertEqual(segment.live_features["brake"], [])
+
+    def test_disconnect_writes_pending_rows(self):
+        scheduler = CoachScheduler(workers=1)
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+
+        history = History()
+        history.live_features = self.store(flush_interval=3600)
+        scheduler.add(history)
+        history.live_features.add(1, 1, features(1))
+        self.assertEqual(LiveFeatures.objects.count(), 0)
+
+        # the scheduler doesn't step a disconnected History
+        history.disconnect()
+        self.assertEqual(LiveFeatures.objects.count(), 1)
+        # rows of a segment still being processed are written right away
+        history.live_features.add(2, 1, features(1))
+        self.assertEqual(LiveFeatures.objects.count(), 2)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from telemetry.pitcrew.lookup_table import LookupTable
+
+
+def distance_time(track_length=1000):
+    # a lap of 60 seconds, slower in the middle, sampled every few meters
+    distance = np.arange(0, track_length + 1, 3.7)
+    speed = 30 - 10 * np.sin(distance / track_length * np.pi)
+    lap_time = np.cumsum(np.append(0, np.diff(distance) / speed[1:]))
+    return pd.DataFrame({"DistanceRoundTrack": distance, "CurrentLapTime": lap_time, "SpeedMs": speed})
+
+
+class TestLookupTable(TestCase):
+    def test_lookups(self):
+        table = LookupTable(distance_time(), 1000)
+        map_distance_time = dict(zip(table.distances, table.lap_times))
+        map_time_distance = dict(zip(table.lap_times, table.distances))
+
+        self.assertEqual(table.lap_time_at(500), map_distance_time[500])
+        self.assertEqual(table.lap_time_at(500.0), map_distance_time[500])
+        self.assertGreater(table.speed_at(0), 0)
+        # no value between the meters and off the track
+        self.assertEqual(table.lap_time_at(500.5), 0.0)
+        self.assertEqual(table.speed_at(1001, None), None)
+        self.assertEqual(table.speed_at(-1), 0.0)
+        self.assertEqual(table.max_lap_time, max(map_time_distance.keys()))
+
+        # the same distance as a scan for the closest lap time
+        for lap_time in np.append(np.random.default_rng(1).uniform(-5, 70, 500), table.lap_times[::7]):
+            closest = min(map_time_distance.keys(), key=lambda x: abs(x - lap_time))
+            self.assertEqual(table.distance_at(lap_time), map_time_distance[closest])
+
+        lap_times = table.lap_times[[10, 20, 30]]
+        self.assertEqual(list(table.distances_at(lap_times)), [map_time_distance[t] for t in lap_times])
+        self.assertEqual(list(table.lap_times_at([10, 1011])), [table.lap_times[10], table.lap_times[10]])
+        self.assertEqual(list(table.speeds_at([20])), [table.speeds[20]])
+
+        with self.assertRaises(ValueError):
+            table.speeds[0] = 1
+
+    def test_equal_lap_times(self):
+        df = pd.DataFrame({"DistanceRoundTrack": [0, 1, 2, 3], "CurrentLapTime": [0, 0, 1, 2], "SpeedMs": [1, 1, 1, 1]})
+        table = LookupTable(df, 3)
+        # like a dict of lap time -> distance, the furthest distance wins
+        self.assertEqual(table.distance_at(0), 1)
+        # on a tie the smaller lap time wins
+        self.assertEqual(table.distance_at(0.5), 1)
+        self.assertEqual(table.distance_at(1.6), 3)
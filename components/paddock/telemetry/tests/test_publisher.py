@@ -0,0 +1,57 @@
+import json
+
+from django.test import TestCase
+
+from telemetry.pitcrew.publisher import Publisher, coalesce
+
+
+class TestPublisher(TestCase):
+    def setUp(self):
+        self.packets = []
+        self.publisher = Publisher(lambda topic, payload: self.packets.append((topic, payload)), max_queue_size=3)
+
+    def test_coalesce(self):
+        brake = json.dumps({"distance": 580, "message": "brake"})
+        lift = json.dumps({"distance": 600, "message": "lift"})
+        self.assertEqual(coalesce([brake]), [brake])
+        self.assertEqual(coalesce(["say"]), ["say"])
+        self.assertEqual(coalesce([brake, lift]), [f"[{brake},{lift}]"])
+        # plain text, json strings and lists are sent as they are
+        self.assertEqual(
+            coalesce(["say", brake, "{next", '"text"', lift, "[1]"]),
+            ["say", f"[{brake},{lift}]", "{next", '"text"', "[1]"],
+        )
+        self.assertEqual(coalesce(["say", brake, "next"]), ["say", brake, "next"])
+
+    def test_flush_per_topic(self):
+        self.publisher.publish("/coach/jim", '{"message": "one"}')
+        self.publisher.publish("/coach/joe", "two")
+        self.publisher.publish("/coach/jim", '{"message": "three"}')
+        self.publisher.flush()
+
+        self.assertEqual(
+            self.packets, [("/coach/jim", '[{"message": "one"},{"message": "three"}]'), ("/coach/joe", "two")]
+        )
+        metrics = self.publisher.metrics()
+        self.assertEqual(metrics["pitcrew_publisher_published_total"], 3)
+        self.assertEqual(metrics["pitcrew_publisher_packets_total"], 2)
+        self.assertEqual(metrics["pitcrew_publisher_queue_depth"], 0)
+
+    def test_drop_oldest(self):
+        for payload in ["one", "two", "three", "four"]:
+            self.publisher.publish("/coach/jim", payload)
+        self.publisher.flush()
+
+        self.assertEqual(self.packets, [("/coach/jim", "two"), ("/coach/jim", "three"), ("/coach/jim", "four")])
+        self.assertEqual(self.publisher.dropped, 1)
+        self.assertEqual(self.publisher.packets, 3)
+
+    def test_publish_error(self):
+        def fail(topic, payload):
+            raise ConnectionError("broker gone")
+
+        publisher = Publisher(fail)
+        publisher.publish("/coach/jim", "one")
+        publisher.flush()
+        self.assertEqual(publisher.errors, 1)
+        self.assertEqual(publisher.published, 0)
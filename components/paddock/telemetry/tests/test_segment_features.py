@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from telemetry.analyzer import Analyzer
+from telemetry.fast_lap_analyzer import FastLapAnalyzer
+from telemetry.pitcrew import segment_features
+from telemetry.pitcrew.telemetry_buffer import TelemetryBuffer
+
+from .utils import get_session_df
+
+
+class TestSegmentFeatures(TestCase):
+    def segment_frames(self, session_id, length=300):
+        # the session split into segments of a fixed length, as History hands them off
+        analyzer = FastLapAnalyzer()
+        buffer = TelemetryBuffer()
+        segment = None
+        for _, row in get_session_df(session_id).iterrows():
+            row = row.to_dict()
+            if row["DistanceRoundTrack"] is None:
+                continue
+            current = int(row["DistanceRoundTrack"] // length)
+            if segment is not None and current != segment:
+                yield analyzer.preprocess_frame(buffer.finish())
+            segment = current
+            buffer.append(row["_time"], row)
+        yield analyzer.preprocess_frame(buffer.finish())
+
+    def assert_features_equal(self, features, expected):
+        self.assertEqual(features.keys(), expected.keys())
+        for key, value in expected.items():
+            if isinstance(value, float) and np.isnan(value):
+                self.assertTrue(np.isnan(features[key]), key)
+            else:
+                self.assertEqual(features[key], value, key)
+
+    def test_same_features_as_pandas(self):
+        analyzer = Analyzer()
+        fast_lap_analyzer = FastLapAnalyzer()
+        for session_id in ["1673613558", "1672395579", "1680321341"]:
+            segments = 0
+            for frame in self.segment_frames(session_id):
+                df = frame.to_df()
+                self.assert_features_equal(
+                    segment_features.brake_features(frame, brake_threshold=0.1),
+                    fast_lap_analyzer.brake_features(df),
+                )
+                self.assert_features_equal(
+                    segment_features.throttle_features(frame), fast_lap_analyzer.throttle_features(df)
+                )
+                self.assertEqual(segment_features.gear_features(frame), fast_lap_analyzer.gear_features(df))
+                self.assertEqual(segment_features.sector_time(frame), analyzer.sector_time(df))
+                self.assertEqual(segment_features.sector_lap_time(frame), analyzer.sector_lap_time(df))
+                segments += 1
+            self.assertGreater(segments, 10)
+
+    def test_top_bin(self):
+        analyzer = Analyzer()
+        for values in [
+            [0, 0, 0.2, 0.2, 1.0],
+            [0.1, 0.2, 0.2, 0.3, 0.3, np.nan],
+            [0.05, 0.55, 0.55, 0.95, 0.95],
+            [1.0, 1.0, 0.9, 0.9],
+            [np.nan, np.nan],
+            [],
+        ]:
+            values = np.array(values, dtype=float)
+            df = pd.DataFrame({"Brake": values, "Throttle": values})
+            for column in ["Brake", "Throttle"]:
+                self.assertEqual(
+                    segment_features.top_bin(values, column=column),
+                    analyzer.top_bin(df, column=column),
+                    (values, column),
+                )
@@ -0,0 +1,124 @@
+import datetime
+
+import django.utils.timezone
+from django.test import TestCase
+
+from telemetry.models import Lap, Track
+from telemetry.pitcrew.firehose import Firehose
+from telemetry.pitcrew.session_saver import SessionSaver
+
+
+class TestSessionSaver(TestCase):
+    def setUp(self):
+        self.now = django.utils.timezone.now()
+        self.firehose = Firehose()
+        self.session = self.firehose.new_session("crewchief/driver/1/game/track/car/Race", {}, self.now)
+        self.saver = SessionSaver(self.firehose)
+
+    def finish_lap(self, number, length=1000, time=60.0):
+        lap = self.session.new_lap(self.now + datetime.timedelta(minutes=number), number)
+        lap.finished = True
+        lap.length = length
+        lap.time = time
+        return lap
+
+    def test_save_laps(self):
+        self.finish_lap(1, length=1000)
+        self.finish_lap(2, length=1200)
+        self.saver.save_sessions()
+
+        self.assertEqual(Lap.objects.count(), 2)
+        self.assertTrue(all(lap.persisted for lap in self.session.laps.values()))
+        self.assertEqual(Track.objects.get(name="track").length, 1200)
+
+        # the track length never shrinks
+        self.finish_lap(3, length=900)
+        self.saver.save_sessions()
+        self.assertEqual(Track.objects.get(name="track").length, 1200)
+
+    def test_car_class_is_not_shared(self):
+        other = self.firehose.new_session("crewchief/other/2/game/track/car/Race", {"CarClass": "GT3"}, self.now)
+        self.session.car_class = "GT4"
+        self.saver.save_sessions()
+
+        self.assertEqual(str(self.session.car_class), "GT4")
+        self.assertEqual(str(other.car_class), "GT3")
+        # the car, shared through the dimension cache, is not changed
+        self.assertIsNone(self.session.car.car_class_id)
+        self.assertIsNone(other.car.car_class_id)
+
+    def test_conflicting_lap_is_skipped(self):
+        lap = self.finish_lap(1)
+        self.saver.save_sessions()
+        lap.persisted = False
+        self.finish_lap(2)
+        self.saver.save_sessions()
+
+        self.assertEqual(Lap.objects.count(), 2)
+        self.assertTrue(lap.persisted)
+
+    def test_broken_lap_does_not_block_the_batch(self):
+        broken = self.finish_lap(1, time=None)
+        self.finish_lap(2)
+        self.saver.save_sessions()
+
+        self.assertEqual(list(Lap.objects.values_list("number", flat=True)), [2])
+        self.assertTrue(broken.persisted)
+
+
+class TestSessionSaverEvents(TestCase):
+    def setUp(self):
+        self.now = django.utils.timezone.now()
+        self.firehose = Firehose()
+        self.saver = SessionSaver(self.firehose)
+        self.topic = "crewchief/driver/1/game/track/car/Race"
+
+    def telemetry(self, distance, lap, lap_time_previous):
+        return {
+            "DistanceRoundTrack": distance,
+            "CurrentLap": lap,
+            "CurrentLapTime": 10.0,
+            "LapTimePrevious": lap_time_previous,
+            "CurrentLapIsValid": True,
+            "PreviousLapWasValid": True,
+        }
+
+    def test_lap_is_saved_when_it_finishes(self):
+        self.firehose.notify(self.topic, self.telemetry(500, 0, -1), self.now)
+        self.assertEqual(len(self.saver.events), 1)
+        self.saver.process_events()
+        session = self.firehose.sessions[self.topic]
+        self.assertIsNotNone(session.record)
+
+        self.firehose.notify(self.topic, self.telemetry(10, 1, -1), self.now + datetime.timedelta(seconds=1))
+        self.firehose.notify(self.topic, self.telemetry(1000, 1, -1), self.now + datetime.timedelta(seconds=60))
+        self.firehose.notify(self.topic, self.telemetry(10, 2, 60.0), self.now + datetime.timedelta(seconds=61))
+        self.assertEqual(len(self.saver.events), 1)
+        self.saver.process_events()
+
+        self.assertEqual(list(Lap.objects.values_list("number", "time")), [(1, 60.0)])
+        self.assertEqual(self.saver.metrics()["pitcrew_session_saver_events_total"], 2)
+        self.assertEqual(self.saver.metrics()["pitcrew_session_saver_queue_depth"], 0)
+
+    def test_laps_of_evicted_session_are_saved(self):
+        self.firehose.max_sessions = 1
+        self.firehose.notify(self.topic, self.telemetry(500, 0, -1), self.now)
+        self.saver.process_events()
+        session = self.firehose.sessions[self.topic]
+        lap = session.new_lap(self.now, 1)
+        lap.finished = True
+        lap.length = 1000
+
+        # the saver is behind, the session is evicted before its lap is saved
+        self.firehose.notify(self.topic.replace("/1/", "/2/"), self.telemetry(500, 0, -1), self.now)
+        self.assertNotIn(self.topic, self.firehose.sessions)
+        self.saver.process_events()
+        self.assertTrue(lap.persisted)
+        self.assertEqual(Lap.objects.count(), 1)
+
+    def test_no_events_without_changes(self):
+        self.firehose.notify(self.topic, self.telemetry(500, 0, -1), self.now)
+        self.saver.process_events()
+        for second in range(1, 10):
+            self.firehose.notify(self.topic, self.telemetry(500 + second, 0, -1), self.now)
+        self.assertEqual(len(self.saver.events), 0)
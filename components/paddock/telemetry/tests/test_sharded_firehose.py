@@ -0,0 +1,60 @@
+import queue
+from unittest import mock
+
+from django.test import TestCase
+
+from telemetry.pitcrew.crew import Crew
+from telemetry.pitcrew.sharded_firehose import ShardedFirehose, ShardSession, run_shard, shard_for, shard_key
+
+from .utils import get_session_df
+
+
+class TestShardedFirehose(TestCase):
+    def test_shard_for(self):
+        topic = "crewchief/durandom/1681021274/iRacing/fuji nochicane/Ferrari 488 GT3 Evo 2020/Practice"
+        self.assertEqual(shard_key(topic), "durandom/1681021274")
+        # all topics of a session end up in the same shard, also in other processes
+        self.assertEqual(shard_for(topic, 4), shard_for(topic.replace("Practice", "Race"), 4))
+        self.assertEqual(shard_for(topic, 4), 0)
+
+        shards = set(shard_for(f"crewchief/driver{i}/{i}/game/track/car/type", 4) for i in range(100))
+        self.assertEqual(shards, {0, 1, 2, 3})
+
+    def test_run_shard(self):
+        session_df = get_session_df("1673613558")
+        inbox = queue.Queue()
+        outbox = queue.Queue()
+        for _, row in session_df.iterrows():
+            row = row.to_dict()
+            inbox.put((row["topic"], row, row["_time"]))
+        inbox.put(None)
+
+        run_shard(0, inbox, outbox, save=False)
+
+        shard, sessions = outbox.get_nowait()
+        self.assertEqual(shard, 0)
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(sessions[0].laps, 16)
+        self.assertEqual(sessions[0].persisted_laps, 0)
+
+    def test_merge(self):
+        firehose = ShardedFirehose(shards=2)
+        firehose.merge(0, [ShardSession("a", 0, driver=(1, "jim")), ShardSession("b", 0)])
+        firehose.merge(1, [ShardSession("c", 1)])
+        self.assertEqual(sorted(firehose.sessions.keys()), ["a", "b", "c"])
+        self.assertEqual(firehose.sessions["a"].driver.name, "jim")
+        self.assertEqual(firehose.sessions["a"].driver.pk, 1)
+
+        # the latest report of a shard replaces the previous one
+        firehose.merge(0, [ShardSession("b", 0)])
+        self.assertEqual(sorted(firehose.sessions.keys()), ["b", "c"])
+
+    def test_crew_forks_the_shards_once(self):
+        crew = Crew(shards=2, coach_processes=2)
+        with mock.patch.object(crew.firehose, "start") as start, mock.patch.object(
+            crew.coach_pool, "start"
+        ) as pool_start:
+            crew.start_processes()
+            crew.start_processes()
+        start.assert_called_once()
+        pool_start.assert_called_once()
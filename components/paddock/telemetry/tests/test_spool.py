@@ -0,0 +1,113 @@
+import datetime
+import os
+import tempfile
+from unittest import mock
+
+import django.utils.timezone
+from django.test import TestCase
+
+from telemetry.models import Lap, Session
+from telemetry.pitcrew.crew import Crew
+from telemetry.pitcrew.firehose import Firehose
+from telemetry.pitcrew.session_saver import SessionSaver
+from telemetry.pitcrew.spool import Spool, SpoolDrainer
+
+
+class TestSpool(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "spool.sqlite")
+        self.now = django.utils.timezone.now()
+        self.firehose = Firehose()
+        self.spool = Spool(self.path)
+        self.saver = SessionSaver(self.firehose, spool=self.spool)
+        self.session = self.firehose.new_session("crewchief/driver/1/game/track/car/Race", {}, self.now)
+        self.saver.process_events()
+
+    def tearDown(self):
+        self.spool.close()
+        self.tmpdir.cleanup()
+
+    def finish_lap(self, number, minutes=None):
+        minutes = number if minutes is None else minutes
+        lap = self.session.new_lap(self.now + datetime.timedelta(minutes=minutes), number)
+        lap.finished = True
+        lap.length = 1000
+        lap.time = 60.0
+        self.session.emit(self.session.LAP_FINISHED, lap)
+        return lap
+
+    def test_laps_are_spooled_then_drained(self):
+        lap = self.finish_lap(1)
+        with mock.patch.object(self.saver, "save_laps") as save_laps, mock.patch.object(
+            self.saver, "save_session", side_effect=Exception("database is down")
+        ) as save_session:
+            self.saver.process_events()
+            self.saver.save_and_clear_sessions()
+            self.assertTrue(lap.persisted)
+            # the saver doesn't wait for the database
+            save_laps.assert_not_called()
+            save_session.assert_not_called()
+        self.assertIsNone(self.session.record)
+        self.assertEqual(len(self.spool), 1)
+        self.assertEqual(Lap.objects.count(), 0)
+        self.assertEqual(Session.objects.count(), 0)
+
+        drainer = SpoolDrainer(self.spool)
+        self.assertEqual(drainer.drain(), drainer.interval)
+        self.assertEqual(list(Lap.objects.values_list("number", "time", "length")), [(1, 60.0, 1000)])
+        self.assertEqual(list(Session.objects.values_list("session_id", flat=True)), ["1"])
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(drainer.metrics()["pitcrew_spool_drained_total"], 1)
+
+    def test_spool_survives_restart(self):
+        self.finish_lap(1)
+        self.finish_lap(2)
+        self.saver.process_events()
+        self.spool.close()
+
+        self.spool = Spool(self.path)
+        self.assertEqual(len(self.spool), 2)
+        SpoolDrainer(self.spool).drain()
+        self.assertEqual(Lap.objects.count(), 2)
+
+    def test_lap_number_spooled_again(self):
+        drainer = SpoolDrainer(self.spool)
+        self.finish_lap(1)
+        self.saver.process_events()
+        drainer.drain()
+
+        # the session restarted, its first lap has the same number
+        self.finish_lap(1, minutes=30)
+        self.saver.process_events()
+        drainer.drain()
+        self.assertEqual(Lap.objects.count(), 2)
+        self.assertEqual(len(self.spool), 0)
+
+    def test_backoff_while_database_is_down(self):
+        self.finish_lap(1)
+        self.saver.process_events()
+
+        drainer = SpoolDrainer(self.spool, max_backoff=3)
+        with mock.patch.object(drainer.saver, "save_session", side_effect=Exception("database is down")):
+            self.assertEqual(drainer.drain(), 1)
+            self.assertEqual(drainer.drain(), 2)
+            self.assertEqual(drainer.drain(), 3)
+            self.assertEqual(drainer.drain(), 3)
+        self.assertEqual(len(self.spool), 1)
+        self.assertEqual(drainer.errors, 4)
+
+        drainer.drain()
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(drainer.backoff, 0)
+
+    def test_crew_components(self):
+        crew = Crew(spool=os.path.join(self.tmpdir.name, "crew.sqlite"))
+        self.assertIn("spool_drainer", crew.components)
+        self.assertIn("session_saver", crew.components)
+        self.assertNotIn("firehose", crew.components)
+        crew.spool_drainer.spool.close()
+
+        crew = Crew()
+        self.assertNotIn("spool_drainer", crew.components)
+        self.assertNotIn("firehose", crew.components)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from telemetry.fast_lap_analyzer import FastLapAnalyzer
+from telemetry.pitcrew.telemetry_buffer import TelemetryBuffer
+
+from .utils import get_session_df
+
+
+class TestTelemetryBuffer(TestCase):
+    def test_frames_are_views(self):
+        buffer = TelemetryBuffer(capacity=4)
+        for meters in range(3):
+            buffer.append(pd.Timestamp(meters, unit="s", tz="UTC"), {"DistanceRoundTrack": meters, "Brake": None})
+        frame = buffer.finish()
+        self.assertEqual(len(frame), 3)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(list(frame["DistanceRoundTrack"]), [0, 1, 2])
+        self.assertEqual(list(frame["Time"]), [0, 1_000_000_000, 2_000_000_000])
+        self.assertTrue(np.isnan(frame["Brake"]).all())
+        with self.assertRaises(ValueError):
+            frame["Brake"][0] = 1
+
+        # the rows of the current segment move to a new block, the frame keeps the old one
+        for meters in range(3, 9):
+            buffer.append(None, {"DistanceRoundTrack": meters})
+        self.assertEqual(buffer.blocks, 3)
+        self.assertEqual(list(buffer.finish()["DistanceRoundTrack"]), [3, 4, 5, 6, 7, 8])
+        self.assertEqual(list(frame["DistanceRoundTrack"]), [0, 1, 2])
+
+    def test_preprocess_frame(self):
+        # the same features as the records of the rows run through preprocess
+        session_df = get_session_df("1673613558")
+        analyzer = FastLapAnalyzer()
+        rows = [row.to_dict() for _, row in session_df.iloc[1000:1600].iterrows()]
+        rows[10]["Gear"] = 0
+        rows[20]["Brake"] = None
+
+        buffer = TelemetryBuffer()
+        for row in rows:
+            buffer.append(row["_time"], row)
+        df = analyzer.preprocess_frame(buffer.finish()).to_df()
+
+        expected = analyzer.preprocess(pd.DataFrame.from_records(rows))
+        pd.testing.assert_frame_equal(df, expected[df.columns])
+        self.assertEqual(analyzer.brake_features(df), analyzer.brake_features(expected))
+        self.assertEqual(analyzer.throttle_features(df), analyzer.throttle_features(expected))
+        self.assertEqual(analyzer.gear_features(df), analyzer.gear_features(expected))
@@ -0,0 +1,35 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from telemetry.pitcrew.worker_processes import WorkerProcesses
+
+
+def echo(key, inbox, outbox, prefix=""):
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        outbox.put((key, f"{prefix}{message}"))
+
+
+class TestWorkerProcesses(SimpleTestCase):
+    @mock.patch("telemetry.pitcrew.worker_processes.db.connections.close_all")
+    def test_start_and_stop(self, close_all):
+        workers = WorkerProcesses()
+        # waiting for the worker
+        workers.inbox(0).put("a")
+        for key in [0, 1]:
+            workers.start(key, f"echo-{key}", echo, prefix="echo ")
+        self.assertEqual(close_all.call_count, 2)
+        self.assertEqual(len(workers.alive()), 2)
+        workers.inboxes[1].put("b")
+
+        received = []
+        workers.stop(received.append, timeout=30)
+        self.assertEqual(sorted(received), [(0, "echo a"), (1, "echo b")])
+        self.assertEqual(workers.alive(), [])
+        self.assertEqual(sorted(workers.dead().keys()), [0, 1])
+
+        self.assertEqual(workers.remove(0).name, "echo-0")
+        self.assertEqual(list(workers.processes.keys()), [1])